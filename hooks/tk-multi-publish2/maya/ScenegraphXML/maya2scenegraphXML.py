@@ -1,20 +1,36 @@
 # Copyright (c) 2012 The Foundry Visionmongers Ltd. All Rights Reserved.
 
 import maya.cmds as cmds
+import maya.api.OpenMaya as om
 import sys
 import os.path
+import hashlib
+from array import array
 import scenegraphXML
 
+# PyAlembic is optional and only used to read the bounds of the exported components back
+# from their Alembic files
+try:
+    from alembic import Abc, AbcGeom
+except ImportError:
+    Abc = AbcGeom = None
+
 # Make sure the Alembic plugin is loaded
 cmds.loadPlugin('AbcExport', quiet=True)
 
-# Module level global used to hold animating bounds data from alembic callbacks
-animBoundsData = {}
+# Rough Alembic size model used to estimate exports: float32 positions of every vertex
+# for every sample, the face counts and indices (assuming quads) once per file, plus a
+# fixed overhead per file
+ABC_BYTES_PER_VERTEX_SAMPLE = 12
+ABC_BYTES_PER_FACE = 20
+ABC_FILE_OVERHEAD_BYTES = 4096
 
 
 # Main function called to actually export from Maya to ScenegraphXML format
 def maya2ScenegraphXML(mayaSelection, xmlFileName, startFrame=None, endFrame=None,
-                       arbAttrs=None, geoFileOptions=''):
+                       arbAttrs=None, geoFileOptions='', channelFormat='xml', channelWriterThreads=0,
+                       foldConstantChannels=False, deltaChannels=False, dedupComponents=False,
+                       channelSampling='timeline', batchAbcExport=False, dryRun=False):
     # Strip xmlFileName into directory and file name components
     fileDir, fileStem = os.path.split(xmlFileName)
  
@@ -22,8 +38,16 @@ def maya2ScenegraphXML(mayaSelection, xmlFileName, startFrame=None, endFrame=Non
     if fileStem.endswith('.xml'):
         fileStem = fileStem[:-4]
 
-    # Clear the animBoundsData
-    animBoundsData = {}
+    # Optionally export identical components once and share their files
+    componentStore = None
+    if dedupComponents:
+        componentStore = ComponentStore()
+
+    # Collects the animated bounds of this export only
+    animBounds = AnimBoundsStore()
+
+    # Collects the component Alembic exports of the whole hierarchy
+    abcExportPlan = AbcExportPlan(batchAbcExport, componentStore, animBounds)
 
     # Construct python classes to represent Maya Hierarchy using scenegraphXML.py
     sgxmlHandler = MayaSgxmlHandler(mayaSelection=mayaSelection,
@@ -32,7 +56,25 @@ def maya2ScenegraphXML(mayaSelection, xmlFileName, startFrame=None, endFrame=Non
                                     startFrame=startFrame,
                                     endFrame=endFrame,
                                     arbAttrs=arbAttrs,
-                                    geoFileOptions=geoFileOptions)
+                                    geoFileOptions=geoFileOptions,
+                                    channelFormat=channelFormat,
+                                    channelWriterThreads=channelWriterThreads,
+                                    foldConstantChannels=foldConstantChannels,
+                                    deltaChannels=deltaChannels,
+                                    componentStore=componentStore,
+                                    channelSampling=channelSampling,
+                                    animBounds=animBounds,
+                                    abcExportPlan=abcExportPlan)
+
+    # A dry run only reports what the export would write, without exporting anything
+    if dryRun:
+        exportEstimate = ExportEstimate(startFrame, endFrame)
+        sgxmlHandler.estimateExport(exportEstimate)
+        abcExportPlan.estimate(exportEstimate)
+        return exportEstimate
+
+    # Export the components, which also gathers their animated bounds
+    abcExportPlan.run()
 
     sgxmlHandler.writeChannelData()
 
@@ -43,42 +85,332 @@ def maya2ScenegraphXML(mayaSelection, xmlFileName, startFrame=None, endFrame=Non
     #sgxmlHandler.writeChannelData()
 
 
-def addAnimBoundsData(mayaNode, frame, bounds):
-    # Adds an entry in animBoundsData for mayaNode for the current frame.
-    if not mayaNode in animBoundsData:
-        animBoundsData[mayaNode] = {}
-    animBoundsData[mayaNode][frame] = bounds
-
+class AnimBoundsStore:
+    # animated bounds of the Maya nodes of one export. The bounds of each node are held as
+    # a frames x 6 array of doubles, along with a flag per frame telling if it's been set
+
+    def __init__(self):
+        # mayaNode -> [first frame, bounds array, set flags array, number of frames set]
+        self.nodeBounds = {}
+        # Alembic file path -> bounds array sampled from it
+        self.fileBounds = {}
+
+    def sampleBounds(self, mayaNode, mayaSelection, filepath, startFrame=None, endFrame=None,
+                     abcOptions=''):
+        # stores the bounds of the component exported from the mayaSelection roots under
+        # mayaNode to filepath, for every frame of the range, or once at the current time
+        # without a range, replacing any bounds it had. These are the bounds of the roots in
+        # the object space of mayaNode, read back from the archive bounds AbcExport wrote
+        # to filepath. Without PyAlembic, or when the archive bounds are in world space,
+        # the roots are evaluated in Maya at each frame instead
+        if startFrame is None or endFrame is None:
+            firstFrame = int(round(cmds.currentTime(query=True)))
+            sampleTimes = [None]
+        else:
+            firstFrame = startFrame
+            sampleTimes = range(startFrame, endFrame+1)
+        # components sharing a file have the same bounds
+        values = self.fileBounds.get(filepath)
+        if values is None:
+            if not isWorldSpaceAbcExport(abcOptions):
+                values = readAbcArchiveBounds(filepath, len(sampleTimes))
+            if values is None:
+                values = getRootBounds(mayaSelection, sampleTimes)
+            self.fileBounds[filepath] = values
+        self.nodeBounds[mayaNode] = [firstFrame, array('d', values), array('b', [1]) * len(sampleTimes),
+                                     len(sampleTimes)]
+
+    def setBounds(self, mayaNode, frame, bounds):
+        frame = int(round(frame))
+        if mayaNode not in self.nodeBounds:
+            self.nodeBounds[mayaNode] = [frame, array('d'), array('b'), 0]
+        entry = self.nodeBounds[mayaNode]
+        firstFrame, values, isSet = entry[0], entry[1], entry[2]
+        # grow the arrays to hold the frame, at the front or the back
+        if frame < firstFrame:
+            values[0:0] = array('d', [0.0]) * ((firstFrame - frame) * 6)
+            isSet[0:0] = array('b', [0]) * (firstFrame - frame)
+            entry[0] = firstFrame = frame
+        slot = frame - firstFrame
+        if slot >= len(isSet):
+            values.extend(array('d', [0.0]) * ((slot - len(isSet) + 1) * 6))
+            isSet.extend(array('b', [0]) * (slot - len(isSet) + 1))
+        values[slot*6:slot*6+6] = array('d', bounds)
+        if not isSet[slot]:
+            isSet[slot] = 1
+            entry[3] += 1
+
+    def getBounds(self, mayaNode, frame):
+        # returns the bounds of mayaNode at frame, or None if there are no bounds for
+        # mayaNode. Bounds set for a single frame are static and used for every frame
+        if mayaNode not in self.nodeBounds:
+            return None
+        firstFrame, values, isSet, numSet = self.nodeBounds[mayaNode]
+        if numSet == 1:
+            slot = list(isSet).index(1)
+        else:
+            slot = int(round(frame)) - firstFrame
+            if slot < 0 or slot >= len(isSet) or not isSet[slot]:
+                raise ValueError('matching anim bounds value not found')
+        return values[slot*6:slot*6+6].tolist()
 
-def maya2abcCallback(mayaNode, frame, bounds):
-    # Callback used to store animating bounds information calculated when exporting using Alembic.
-    # Needs to convert order of bounds data from [minx, miny, minz, maxx, maxy, maxz] to [minx, maxx, miny, maxy, minz, maxz]
-    addAnimBoundsData(mayaNode, frame, [bounds[0], bounds[3], bounds[1], bounds[4], bounds[2], bounds[5]])
 
+def isWorldSpaceAbcExport(abcOptions):
+    # returns True if the AbcExport options write the roots in world space
+    abcFlags = abcOptions.split()
+    return '-worldSpace' in abcFlags or '-ws' in abcFlags
 
 
-def maya2Abc(mayaParent, mayaSelection, filepath, startFrame=None, endFrame=None, abcOptions=''):
+def readAbcArchiveBounds(filepath, numSamples):
+    # returns the archive bounds AbcExport wrote to filepath, which are the bounds of its
+    # roots in the space of their parent, as a numSamples x 6 array ordered
+    # [minx, maxx, miny, maxy, minz, maxz]. Returns None if PyAlembic isn't available or
+    # the file doesn't hold one bounds sample per frame
+    if Abc is None or not os.path.isfile(filepath):
+        return None
+    archive = Abc.IArchive(filepath)
+    boundsProperty = AbcGeom.GetIArchiveBounds(archive)
+    if not boundsProperty.valid():
+        return None
+    numFileSamples = boundsProperty.getNumSamples()
+    if numFileSamples != numSamples and not (numFileSamples and boundsProperty.isConstant()):
+        return None
+    values = array('d')
+    for sampleIndex in range(numSamples):
+        box = boundsProperty.getValue(Abc.ISampleSelector(min(sampleIndex, numFileSamples-1)))
+        boundsMin = box.min()
+        boundsMax = box.max()
+        values.extend([boundsMin[0], boundsMax[0], boundsMin[1], boundsMax[1], boundsMin[2], boundsMax[2]])
+    return values
+
+
+def getRootBounds(mayaSelection, sampleTimes):
+    # returns the union of the bounds of the mayaSelection roots at each of sampleTimes,
+    # None being the current time, as a frames x 6 array ordered
+    # [minx, maxx, miny, maxy, minz, maxz]. The bounds of a transform include its own
+    # matrix, so these are in the space of the parent of the roots
+    values = array('d')
+    for curTime in sampleTimes:
+        curBounds = None
+        for mayaRoot in mayaSelection:
+            boundsMin = getAttrAtTime(mayaRoot + '.boundingBoxMin', curTime)[0]
+            boundsMax = getAttrAtTime(mayaRoot + '.boundingBoxMax', curTime)[0]
+            rootBounds = [boundsMin[0], boundsMax[0], boundsMin[1], boundsMax[1], boundsMin[2], boundsMax[2]]
+            if curBounds is None:
+                curBounds = rootBounds
+            else:
+                curBounds = [min(curBounds[0], rootBounds[0]), max(curBounds[1], rootBounds[1]),
+                             min(curBounds[2], rootBounds[2]), max(curBounds[3], rootBounds[3]),
+                             min(curBounds[4], rootBounds[4]), max(curBounds[5], rootBounds[5])]
+        values.extend(curBounds)
+    return values
+
+
+def getAbcJobString(mayaParent, mayaSelection, filepath, startFrame=None, endFrame=None, abcOptions=''):
+    # returns the AbcExport job string exporting mayaSelection to filepath, creating the
+    # directory of filepath if need be
+    # create the directory if it doesn't exist
+    dir = os.path.dirname(filepath)
+    if not os.path.isdir(dir):
+        os.makedirs(dir)
+    abcCommandString = abcOptions + ' -root ' + ' -root '.join(mayaSelection) + ' -file ' + filepath
+    if startFrame is not None and endFrame is not None:            
+        abcCommandString = '-frameRange ' + str(startFrame) + ' ' + str(endFrame) + ' ' + abcCommandString
+        #abcCommandString = 'range ' + str(startFrame) + ' ' + str(endFrame) + ' ' + abcCommandString
+    return abcCommandString
+
+
+def maya2Abc(mayaParent, mayaSelection, filepath, startFrame=None, endFrame=None, abcOptions='',
+             animBounds=None):
     # check that we actually have elements in the mayaSelection
     if mayaSelection:
-        # create the directory if it doesn't exist
-        dir = os.path.dirname(filepath)
-        if not os.path.isdir(dir):
-            os.makedirs(dir)
-        abcCommandString = abcOptions + ' -root ' + ' -root '.join(mayaSelection) + ' -file ' + filepath
-        # add Python callback to store bounding box information
-        #abcCommandString = 'pythonPerFrameCallback=maya2scenegraphXML.maya2abcCallback(mayaNode="'+mayaParent+'",frame=#FRAME#,bounds=#BOUNDSARRAY#) ' + abcCommandString
-        abcCommandString = '-pythonPerFrameCallback maya2scenegraphXML.maya2abcCallback(mayaNode="'+mayaParent+'",frame=#FRAME#,bounds=#BOUNDSARRAY#) ' + abcCommandString
-        if startFrame is not None and endFrame is not None:            
-            abcCommandString = '-frameRange ' + str(startFrame) + ' ' + str(endFrame) + ' ' + abcCommandString
-            #abcCommandString = 'range ' + str(startFrame) + ' ' + str(endFrame) + ' ' + abcCommandString
-        
+        abcCommandString = getAbcJobString(mayaParent, mayaSelection, filepath, startFrame, endFrame,
+                                           abcOptions)
         print("Command string: %s" % abcCommandString)
         cmds.AbcExport(j=abcCommandString)
+        # store the bounds of the exported component for the SgXML bounds channels
+        if animBounds is not None:
+            animBounds.sampleBounds(mayaParent, mayaSelection, filepath, startFrame, endFrame, abcOptions)
     else:
         cmds.warning("%s doesn't have any children to export as a component"
                      % mayaParent)
 
 
+class AbcExportPlan:
+    # component Alembic exports collected while building the SgXML hierarchy. With batch
+    # set they are run as a single AbcExport holding one job per component, so that the
+    # frame range is evaluated once for all the components, falling back to one
+    # AbcExport per component if the batched export fails. Without batch each component
+    # gets its own AbcExport, as it always did
+
+    def __init__(self, batch=False, componentStore=None, animBounds=None):
+        self.batch = batch
+        self.componentStore = componentStore
+        # AnimBoundsStore receiving the bounds of the exported components
+        self.animBounds = animBounds
+        # [mayaParent, mayaSelection, filepath, startFrame, endFrame, abcOptions] per
+        # component to export
+        self.exports = []
+        # [mayaParent, mayaSelection, shared filepath, startFrame, endFrame, abcOptions] per
+        # component sharing the file of an identical component instead of being exported
+        self.sharedExports = []
+
+    def addExport(self, mayaParent, mayaSelection, filepath, startFrame=None, endFrame=None,
+                  abcOptions='', referenceElement=None, refDir=None):
+        # if referenceElement is given and the component store already holds a component
+        # identical to mayaSelection, the component isn't exported and the refFile of
+        # referenceElement is pointed at the file of that component, relative to refDir
+        if self.componentStore is not None and referenceElement is not None:
+            sourceKey = getComponentSourceKey(mayaSelection, startFrame, endFrame, abcOptions)
+            if sourceKey is not None:
+                sharedPath = self.componentStore.addComponent(sourceKey, filepath)
+                if sharedPath != filepath:
+                    referenceElement.setRefFile(relativeRefPath(sharedPath, refDir))
+                    self.sharedExports.append([mayaParent, mayaSelection, sharedPath, startFrame, endFrame,
+                                               abcOptions])
+                    return
+        self.exports.append([mayaParent, mayaSelection, filepath, startFrame, endFrame, abcOptions])
+
+    def run(self):
+        exports = self.exports
+        sharedExports = self.sharedExports
+        self.exports = []
+        self.sharedExports = []
+        jobs = []
+        jobFiles = []
+        for mayaParent, mayaSelection, filepath, startFrame, endFrame, abcOptions in exports:
+            if mayaSelection:
+                jobs.append(getAbcJobString(mayaParent, mayaSelection, filepath, startFrame, endFrame,
+                                            abcOptions))
+                jobFiles.append(filepath)
+            else:
+                cmds.warning("%s doesn't have any children to export as a component"
+                             % mayaParent)
+
+        exported = False
+        if self.batch and len(jobs) > 1:
+            print("Exporting %d components in a single AbcExport" % len(jobs))
+            for curJob in jobs:
+                print("Command string: %s" % curJob)
+            try:
+                cmds.AbcExport(j=jobs)
+                exported = True
+            except Exception as e:
+                # the batch may have written some of the files before failing, so every
+                # file of the batch is written again
+                cmds.warning("Batched AbcExport failed, exporting components one by one: %s" % e)
+                for curFile in jobFiles:
+                    cmds.warning("Exporting %s again" % curFile)
+        if not exported:
+            for curJob in jobs:
+                print("Command string: %s" % curJob)
+                cmds.AbcExport(j=curJob)
+
+        # store the bounds of the exported components for the SgXML bounds channels, read
+        # back from the written files once all of them are exported
+        if self.animBounds is not None:
+            for mayaParent, mayaSelection, filepath, startFrame, endFrame, abcOptions in exports + sharedExports:
+                if mayaSelection:
+                    self.animBounds.sampleBounds(mayaParent, mayaSelection, filepath, startFrame, endFrame,
+                                                 abcOptions)
+
+    def estimate(self, exportEstimate):
+        # adds the files the planned exports would write to exportEstimate, without
+        # exporting anything. Components sharing the file of an identical component add
+        # no file of their own
+        for mayaParent, mayaSelection, filepath, startFrame, endFrame, abcOptions in self.exports:
+            if mayaSelection:
+                numSamples = 1
+                if startFrame is not None and endFrame is not None:
+                    numSamples = endFrame - startFrame + 1
+                numVertices, numFaces = getPolyCounts(mayaSelection)
+                exportEstimate.addAbcFile(filepath, numVertices, numFaces, numSamples)
+        for mayaParent, mayaSelection, sharedPath, startFrame, endFrame, abcOptions in self.sharedExports:
+            exportEstimate.addSharedAbcFile(sharedPath)
+
+
+class ExportEstimate:
+    # files, bytes and animated channels an export would write, gathered by a dry run of
+    # maya2ScenegraphXML. All sizes are estimates:
+    # - XML sizes are measured on the hierarchy before any bounds or channel value is
+    #   sampled, so default values stand in for them, and static XML files that the
+    #   export would share with an identical file are still counted
+    # - channel files are counted before any constant channel folding
+    # - every sample of an animated component is assumed to deform
+    # Components sharing the Alembic file of an identical component with dedupComponents
+    # aren't counted as Alembic files, only listed in sharedAbcFiles
+
+    def __init__(self, startFrame=None, endFrame=None):
+        self.startFrame = startFrame
+        self.endFrame = endFrame
+        # [filepath, bytes] per file
+        self.xmlFiles = []
+        self.abcFiles = []
+        # shared Alembic file path per component using the file of another component
+        self.sharedAbcFiles = []
+        # [channel path, number of channels, number of frames, number of files, bytes]
+        # per channel set, i.e. per SgXML file with animated channels
+        self.channelSets = []
+
+    def addXMLFile(self, filepath, numBytes):
+        self.xmlFiles.append([filepath, numBytes])
+
+    def addAbcFile(self, filepath, numVertices, numFaces, numSamples):
+        numBytes = (ABC_FILE_OVERHEAD_BYTES + numFaces * ABC_BYTES_PER_FACE +
+                    numVertices * numSamples * ABC_BYTES_PER_VERTEX_SAMPLE)
+        self.abcFiles.append([filepath, numBytes])
+
+    def addSharedAbcFile(self, filepath):
+        self.sharedAbcFiles.append(filepath)
+
+    def addChannelSet(self, channelPath, numChannels, numFrames, numFiles, numBytes):
+        self.channelSets.append([channelPath, numChannels, numFrames, numFiles, numBytes])
+
+    def getNumChannelFiles(self):
+        return sum(channelSet[3] for channelSet in self.channelSets)
+
+    def getNumChannels(self):
+        # number of animated channels over all the SgXML files
+        return sum(channelSet[1] for channelSet in self.channelSets)
+
+    def getNumChannelSamples(self):
+        # number of channel values written, i.e. frames x channels over all the SgXML files
+        return sum(channelSet[1] * channelSet[2] for channelSet in self.channelSets)
+
+    def getNumFiles(self):
+        return len(self.xmlFiles) + len(self.abcFiles) + self.getNumChannelFiles()
+
+    def getNumBytes(self):
+        return (sum(numBytes for _, numBytes in self.xmlFiles) +
+                sum(numBytes for _, numBytes in self.abcFiles) +
+                sum(channelSet[4] for channelSet in self.channelSets))
+
+    def asDict(self):
+        return {'startFrame': self.startFrame,
+                'endFrame': self.endFrame,
+                'numFiles': self.getNumFiles(),
+                'numBytes': self.getNumBytes(),
+                'xmlFiles': len(self.xmlFiles),
+                'xmlBytes': sum(numBytes for _, numBytes in self.xmlFiles),
+                'abcFiles': len(self.abcFiles),
+                'abcBytes': sum(numBytes for _, numBytes in self.abcFiles),
+                'sharedAbcComponents': len(self.sharedAbcFiles),
+                'channelFiles': self.getNumChannelFiles(),
+                'channelBytes': sum(channelSet[4] for channelSet in self.channelSets),
+                'animatedChannels': self.getNumChannels(),
+                'channelSamples': self.getNumChannelSamples()}
+
+    def __str__(self):
+        estimate = self.asDict()
+        return ("Export of frames %(startFrame)s-%(endFrame)s: %(numFiles)d files, %(numBytes)d bytes\n"
+                "  xml: %(xmlFiles)d files, %(xmlBytes)d bytes\n"
+                "  abc: %(abcFiles)d files, %(abcBytes)d bytes, "
+                "%(sharedAbcComponents)d components sharing a file\n"
+                "  channels: %(channelFiles)d files, %(channelBytes)d bytes, "
+                "%(animatedChannels)d animated channels, %(channelSamples)d frames x channels"
+                % estimate)
+
+
 def getMayaNodeName(mayaPath):
     nameParts = mayaPath.rstrip('|').rsplit('|',1)
     return nameParts[-1]
@@ -88,9 +420,13 @@ def mayaNode2FileStem(mayaPath):
     return mayaPath.lstrip('|').replace('_','__').replace('|','_')
 
 
-def mayaNode2FilePath(mayaPath, directory, extension=None, relativePath=True):
+def mayaNode2FilePath(mayaPath, directory, extension=None, relativePath=True, sgxmlAttrs=None):
     # check if the node explicitly defines a file path
-    if cmds.listAttr(mayaPath, st=['sgxml_filepath']):
+    if sgxmlAttrs is not None:
+        hasFilepath = sgxmlAttrs.hasAttr(mayaPath, 'sgxml_filepath')
+    else:
+        hasFilepath = cmds.listAttr(mayaPath, st=['sgxml_filepath'])
+    if hasFilepath:
         return cmds.getAttr(mayaPath + '.sgxml_filepath', x=True)
     else:
         basePath = mayaPath.lstrip('|').replace('_','__').replace('|','_')
@@ -102,13 +438,17 @@ def mayaNode2FilePath(mayaPath, directory, extension=None, relativePath=True):
             return basePath + '.' + extension
 
 
-def getValidChildren(mayaElementPath):
+def getValidChildren(mayaElementPath, sgxmlAttrs=None):
     validChildren = []
     childNodes = cmds.listRelatives(mayaElementPath, fullPath=True)
     if childNodes is not None:
         for mayaChildPath in childNodes:
         # check if the node is set to 'ignore'
-            if cmds.listAttr(mayaChildPath, st=['sgxml_ignore']) is None:
+            if sgxmlAttrs is not None:
+                isIgnored = sgxmlAttrs.hasAttr(mayaChildPath, 'sgxml_ignore')
+            else:
+                isIgnored = cmds.listAttr(mayaChildPath, st=['sgxml_ignore']) is not None
+            if not isIgnored:
                 # check if this is a valid instance node. We only process transform nodes
                 curNodeType = cmds.nodeType(mayaChildPath)
                 if curNodeType == 'transform':
@@ -116,18 +456,34 @@ def getValidChildren(mayaElementPath):
     return validChildren
 
 
+def getPolyCounts(mayaSelection):
+    # returns the number of vertices and faces of the meshes under mayaSelection
+    meshes = cmds.listRelatives(mayaSelection, allDescendents=True, type='mesh', fullPath=True,
+                                noIntermediate=True)
+    if not meshes:
+        return 0, 0
+    return cmds.polyEvaluate(meshes, vertex=True), cmds.polyEvaluate(meshes, face=True)
+
+
 def getAttrOrNone(mayaPath, attrName):    
     if cmds.listAttr(mayaPath, st=[attrName]):
         return cmds.getAttr(mayaPath + '.' + attrName)
     else:
         return None
 
-def getAttrOrZero(mayaPath, attrName):    
+def getAttrOrZero(mayaPath, attrName, time=None):    
     if cmds.listAttr(mayaPath, st=[attrName]):
-        return cmds.getAttr(mayaPath + '.' + attrName)
+        return getAttrAtTime(mayaPath + '.' + attrName, time)
     else:
         return 0
 
+def getAttrAtTime(mayaPlug, time=None):
+    # evaluates the attribute at the given time without changing the current time, or
+    # at the current time if time is None
+    if time is None:
+        return cmds.getAttr(mayaPlug)
+    return cmds.getAttr(mayaPlug, time=time)
+
 def isAnimated(mayaPath, attrName):
     return cmds.connectionInfo(mayaPath+'.'+attrName, isDestination=True)
 
@@ -143,22 +499,37 @@ def isXformAnimated(mayaPath):
         return False
 
 
-def getAnimBoundsData(mayaPath, frameNumber):
-    # check if we have bounds data for this maya node in animBoundsData 
-    if mayaPath in animBoundsData.keys():
-        curAnimBounds = animBoundsData[mayaPath]
-        # check if we have animating values or not
-        if len(curAnimBounds) == 1:
-            # bounds are static, so take the value from the single element in the dictionary
-            return curAnimBounds.values()[0]
-        else:
-            # bounds are animated so we should have a matching value for this frame
-            if frameNumber in curAnimBounds:
-                return curAnimBounds[frameNumber]
-            else:
-                raise ValueError, 'matching anim bounds value not found'
-    else:
-        return None
+# Transform attributes (short, long and compound names) tested by isXformAnimated
+XFORM_ANIM_ATTRS = frozenset(['tx', 'ty', 'tz', 'rx', 'ry', 'rz', 'sx', 'sy', 'sz',
+                              'translateX', 'translateY', 'translateZ',
+                              'rotateX', 'rotateY', 'rotateZ',
+                              'scaleX', 'scaleY', 'scaleZ',
+                              't', 'r', 's', 'translate', 'rotate', 'scale'])
+
+
+def getAnimatedXforms(mayaSelection):
+    # returns the set of full paths of the transforms under mayaSelection (included) that
+    # isXformAnimated would report as animated, using a single listConnections query for
+    # all the transforms rather than nine connectionInfo calls per transform
+    animatedXforms = set()
+    if not mayaSelection:
+        return animatedXforms
+    xformPaths = cmds.ls(mayaSelection, long=True, type='transform') or []
+    if not xformPaths:
+        return animatedXforms
+    xformPaths.extend(cmds.listRelatives(xformPaths, allDescendents=True, fullPath=True,
+                                         type='transform') or [])
+
+    # pairs of plugs: the destination plug on one of the transforms, then its source plug
+    connections = cmds.listConnections(xformPaths, source=True, destination=False, connections=True,
+                                       plugs=True, fullNodeName=True) or []
+    for mayaPlug in connections[0::2]:
+        mayaPath, attrName = mayaPlug.split('.', 1)
+        if attrName in XFORM_ANIM_ATTRS:
+            if not mayaPath.startswith('|'):
+                mayaPath = cmds.ls(mayaPath, long=True)[0]
+            animatedXforms.add(mayaPath)
+    return animatedXforms
 
 
 def deleteSgxmlAttr(mayaPath, attrName):
@@ -223,6 +594,111 @@ def mayaAssignTagToShape(selection, tagName, tagValue):
             mayaAddStringAttributeToShape(curItem, tagName, tagValue)
            
 
+# MPlug readers of the single value numeric attribute types, returning what getAttr does
+PLUG_NUMERIC_READERS = {
+    om.MFnNumericData.kBoolean: om.MPlug.asBool,
+    om.MFnNumericData.kByte: om.MPlug.asInt,
+    om.MFnNumericData.kChar: om.MPlug.asInt,
+    om.MFnNumericData.kShort: om.MPlug.asInt,
+    om.MFnNumericData.kInt: om.MPlug.asInt,
+    om.MFnNumericData.kFloat: om.MPlug.asDouble,
+    om.MFnNumericData.kDouble: om.MPlug.asDouble,
+}
+
+# sgxml_ attributes read by the exporter while building the SgXML hierarchy
+SGXML_HIERARCHY_ATTRS = ('sgxml_nodeType', 'sgxml_nodeGroupType', 'sgxml_refType', 'sgxml_filepath',
+                         'sgxml_ignore', 'sgxml_boundsWriteMode', 'sgxml_customBounds', 'sgxml_lodTag',
+                         'sgxml_lodWeight', 'sgxml_proxyName', 'sgxml_proxyFile')
+
+
+def getStringPlugValue(plug):
+    # returns the value of a string plug, or None if it was never set, as getAttr does
+    stringData = plug.asMObject()
+    if stringData.isNull():
+        return None
+    return om.MFnStringData(stringData).string()
+
+
+def getPlugValues(mayaPlugs):
+    # returns the values of mayaPlugs, as getAttr would, read through a single OpenMaya
+    # selection list. String, bool and plain numeric attributes, which are the types
+    # setSgxmlAttr creates, are read from the plugs directly and any other attribute
+    # type goes through getAttr
+    plugList = om.MSelectionList()
+    for mayaPlug in mayaPlugs:
+        plugList.add(mayaPlug)
+    if plugList.length() != len(mayaPlugs):
+        return [cmds.getAttr(mayaPlug) for mayaPlug in mayaPlugs]
+    values = []
+    for plugIndex, mayaPlug in enumerate(mayaPlugs):
+        plug = plugList.getPlug(plugIndex)
+        attribute = plug.attribute()
+        plugReader = None
+        if attribute.hasFn(om.MFn.kTypedAttribute):
+            if om.MFnTypedAttribute(attribute).attrType() == om.MFnData.kString:
+                plugReader = getStringPlugValue
+        elif attribute.hasFn(om.MFn.kNumericAttribute):
+            plugReader = PLUG_NUMERIC_READERS.get(om.MFnNumericAttribute(attribute).numericType())
+        if plugReader is None:
+            values.append(cmds.getAttr(mayaPlug))
+        else:
+            values.append(plugReader(plug))
+    return values
+
+
+class SgxmlAttrSnapshot:
+    # values of the sgxml_ and arbAttr_ attributes of every node under a selection,
+    # read up front with one ls query per attribute name and one OpenMaya selection list
+    # holding the plugs found, so that building the SgXML hierarchy doesn't need a
+    # listAttr and getAttr per node for each attribute
+
+    def __init__(self, mayaSelection, arbAttrs=None):
+        self.mayaSelection = mayaSelection
+        # full node path -> {attribute name: value}
+        self.nodeAttrs = {}
+        self.longNames = {}
+        # full paths of the animated transforms, found on the first isXformAnimated call
+        self.animatedXforms = None
+
+        rootPaths = []
+        if mayaSelection:
+            rootPaths = cmds.ls(mayaSelection, long=True) or []
+        nodePaths = set(rootPaths)
+        if rootPaths:
+            nodePaths.update(cmds.listRelatives(rootPaths, allDescendents=True, fullPath=True) or [])
+
+        attrNames = list(SGXML_HIERARCHY_ATTRS)
+        if arbAttrs is not None:
+            attrNames.extend(['arbAttr_' + attrName for attrName in arbAttrs])
+        for attrName in attrNames:
+            # lists the attribute on every node of the scene, in any namespace
+            mayaPlugs = [mayaPlug for mayaPlug in cmds.ls('*.' + attrName, recursive=True, long=True) or []
+                         if mayaPlug.rsplit('.', 1)[0] in nodePaths]
+            for mayaPlug, value in zip(mayaPlugs, getPlugValues(mayaPlugs)):
+                self.nodeAttrs.setdefault(mayaPlug.rsplit('.', 1)[0], {})[attrName] = value
+
+    def getLongName(self, mayaPath):
+        if mayaPath.startswith('|'):
+            return mayaPath
+        if mayaPath not in self.longNames:
+            longNames = cmds.ls(mayaPath, long=True)
+            self.longNames[mayaPath] = longNames[0] if longNames else mayaPath
+        return self.longNames[mayaPath]
+
+    def hasAttr(self, mayaPath, attrName):
+        return attrName in self.nodeAttrs.get(self.getLongName(mayaPath), {})
+
+    def get(self, mayaPath, attrName):
+        # same as getAttrOrNone, for the attributes held by the snapshot
+        return self.nodeAttrs.get(self.getLongName(mayaPath), {}).get(attrName)
+
+    def isXformAnimated(self, mayaPath):
+        # same as isXformAnimated, for the transforms under the selection
+        if self.animatedXforms is None:
+            self.animatedXforms = getAnimatedXforms(self.mayaSelection)
+        return self.getLongName(mayaPath) in self.animatedXforms
+
+
 class ChannelHandler:
     # holds data for animated channels prior to export as ScenegraphXML channel files
 
@@ -235,11 +711,103 @@ class ChannelHandler:
         self.mayaChannelData.append(newChannelData)
 
 
+def hashFile(filepath, blockSize=1 << 20):
+    # returns the SHA-1 hex digest of the contents of a file
+    fileHash = hashlib.sha1()
+    with open(filepath, 'rb') as f:
+        block = f.read(blockSize)
+        while block:
+            fileHash.update(block)
+            block = f.read(blockSize)
+    return fileHash.hexdigest()
+
+
+def getComponentSourceKey(mayaSelection, startFrame=None, endFrame=None, abcOptions=''):
+    # returns a key identifying what AbcExport would write for mayaSelection, computed from
+    # the Maya scene before exporting: the hierarchy below each root (names without
+    # namespaces, local matrices) and the topology, points and uvs of its meshes. Returns
+    # None if the components can't be compared, i.e. when exporting a frame range with
+    # animated transforms or meshes with incoming connections (deformers, history), or
+    # other shapes than meshes
+    if not mayaSelection:
+        return None
+    rootPaths = cmds.ls(mayaSelection, long=True) or []
+    if startFrame is not None and endFrame is not None and getAnimatedXforms(rootPaths):
+        return None
+
+    sourceHash = hashlib.sha1()
+    sourceHash.update(repr((startFrame, endFrame, abcOptions)).encode('utf-8'))
+    for rootPath in rootPaths:
+        rootParent = rootPath[:rootPath.rfind('|')]
+        nodePaths = [rootPath] + (cmds.listRelatives(rootPath, allDescendents=True, fullPath=True) or [])
+        for nodePath in sorted(nodePaths):
+            relativePath = '|'.join(curName.split(':')[-1] for curName in nodePath[len(rootParent):].split('|'))
+            nodeType = cmds.nodeType(nodePath)
+            if nodeType == 'transform':
+                nodeData = cmds.xform(nodePath, query=True, matrix=True, objectSpace=True)
+            elif nodeType == 'mesh':
+                if startFrame is not None and endFrame is not None and \
+                        cmds.listConnections(nodePath + '.inMesh', source=True, destination=False):
+                    return None
+                selectionList = om.MSelectionList()
+                selectionList.add(nodePath)
+                meshFn = om.MFnMesh(selectionList.getDagPath(0))
+                faceCounts, faceVertices = meshFn.getVertices()
+                points = meshFn.getPoints(om.MSpace.kObject)
+                uValues, vValues = meshFn.getUVs()
+                nodeData = (list(faceCounts), list(faceVertices), [(p.x, p.y, p.z) for p in points],
+                            list(uValues), list(vValues))
+            else:
+                return None
+            sourceHash.update(repr((relativePath, nodeType, nodeData)).encode('utf-8'))
+    return sourceHash.hexdigest()
+
+
+def relativeRefPath(filepath, directory):
+    # returns filepath relative to directory, using '/' separators as SgXML refs do
+    return os.path.relpath(filepath, directory or os.curdir).replace(os.sep, '/')
+
+
+class ComponentStore:
+    # shares a single file between all the components of an export that would write
+    # identical contents. Component files (e.g. .abc) are keyed by their Maya source
+    # before they're exported, so that duplicates are never exported. Each shared file
+    # stays at the path planned for the first component using it
+
+    def __init__(self):
+        # content hash -> path of the file holding that content
+        self.files = {}
+        # source key -> path of the component file exported for it
+        self.components = {}
+
+    def addComponent(self, sourceKey, filepath):
+        # returns the path of the file already planned for sourceKey, or registers
+        # filepath for it and returns filepath
+        return self.components.setdefault(sourceKey, filepath)
+
+    def addRelativeFile(self, filepath):
+        # registers a file holding refs relative to its own directory (e.g. SgXML .xml
+        # files). Such files are left in place and only shared between files of the
+        # same directory, so that their relative refs still resolve. Returns the path
+        # of the first file registered with the same contents, deleting filepath if it
+        # is a duplicate.
+        fileDir = os.path.dirname(os.path.abspath(filepath))
+        fileHash = hashFile(filepath) + ':' + fileDir
+        if fileHash in self.files:
+            os.remove(filepath)
+            return self.files[fileHash]
+        self.files[fileHash] = filepath
+        return filepath
+
+
 class MayaSgxmlHandler:
     # creates python classes using scenegraphXML.py to represent Maya hierarchy data
 
     def __init__(self, mayaSelection, fileDir, fileStem, startFrame=None, endFrame=None,
-                 arbAttrs=None, geoFileOptions=None, boundsWriteMode='all', mayaParent=None):
+                 arbAttrs=None, geoFileOptions=None, boundsWriteMode='all', mayaParent=None,
+                 channelFormat='xml', channelWriterThreads=0, foldConstantChannels=False,
+                 deltaChannels=False, componentStore=None, sgxmlAttrs=None, channelSampling='timeline',
+                 abcExportPlan=None, animBounds=None):
         self.mayaSelection = mayaSelection
         self.mayaParent = mayaParent
         self.fileDir = fileDir
@@ -249,6 +817,36 @@ class MayaSgxmlHandler:
         self.arbAttrs = arbAttrs
         self.geoFileOptions = geoFileOptions
         self.boundsWriteMode = boundsWriteMode
+        self.channelFormat = channelFormat
+        self.channelWriterThreads = channelWriterThreads
+        self.foldConstantChannels = foldConstantChannels
+        self.deltaChannels = deltaChannels
+        self.componentStore = componentStore
+        # 'timeline' samples channels by stepping the current time through the frame range,
+        # 'context' evaluates them at each frame through getAttr's time flag, without
+        # changing the current time
+        if channelSampling not in ('timeline', 'context'):
+            raise ValueError('unsupported channelSampling: %s' % channelSampling)
+        self.channelSampling = channelSampling
+        # read the sgxml_ and arbAttr_ attributes of the whole hierarchy at once. Child
+        # handlers share the snapshot of the top level handler
+        if sgxmlAttrs is None:
+            sgxmlAttrs = SgxmlAttrSnapshot(mayaSelection, arbAttrs)
+        self.sgxmlAttrs = sgxmlAttrs
+        # animated bounds of the whole export, shared with the child handlers
+        if animBounds is None:
+            animBounds = AnimBoundsStore()
+        self.animBounds = animBounds
+        # component Alembic exports are collected in a plan shared with the child handlers
+        # and run by the handler that created the plan once the hierarchy is built
+        runAbcExportPlan = abcExportPlan is None
+        if abcExportPlan is None:
+            abcExportPlan = AbcExportPlan(componentStore=componentStore, animBounds=animBounds)
+        self.abcExportPlan = abcExportPlan
+        # Reference element pointing at this handler's file in the parent handler
+        self.referenceElement = None
+        # channel values of every frame, kept when folding constant channels
+        self.sampledFrames = None
         self.childHandlers = []
         self.mayaChannelData = []
         self.numChannels = 0
@@ -270,13 +868,26 @@ class MayaSgxmlHandler:
             frameNo = self.getStaticFrameNo()
             self.root.channelData = scenegraphXML.ChannelData(frameNo, frameNo)
         else:
-            self.root.channelData = scenegraphXML.ChannelData(startFrame, endFrame, chanPath)
+            self.root.channelData = scenegraphXML.ChannelData(startFrame, endFrame, chanPath,
+                                                              fileFormat=channelFormat)
+            # raises a ValueError for channel formats without delta support (archives)
+            if deltaChannels:
+                self.root.channelData.setEncoding(scenegraphXML.CHANNEL_ENCODING_DELTA)
 
         # iterate through the Maya selection list creating a SgXML hierarchy for each
         # instance and add them to the root SgXML element
         for curMayaElement in self.mayaSelection:
             curInstance = self.createSgXMLHierarchy(curMayaElement)
             self.root.addInstance(curInstance)
+
+        # size the channel values for all the channels registered by the hierarchy
+        self.root.channelData.setNumValues(self.numChannels)
+
+        # only recalculate bounds for the parts of the hierarchy that animate
+        self.root.setBoundsCaching(True)
+
+        if runAbcExportPlan:
+            self.abcExportPlan.run()
         
     def isStatic(self):
         return self.startFrame == self.endFrame
@@ -290,10 +901,10 @@ class MayaSgxmlHandler:
     def createSgXMLHierarchy(self, mayaElementPath):
         curNodeName = getMayaNodeName(mayaElementPath)
 
-        nodeType = getAttrOrNone(mayaElementPath, 'sgxml_nodeType')
+        nodeType = self.sgxmlAttrs.get(mayaElementPath, 'sgxml_nodeType')
         newElement = None
 
-        nodeGroupType = getAttrOrNone(mayaElementPath, 'sgxml_nodeGroupType')
+        nodeGroupType = self.sgxmlAttrs.get(mayaElementPath, 'sgxml_nodeGroupType')
 
         dirUsed = self.fileDir
         stemUsed = ''
@@ -305,7 +916,7 @@ class MayaSgxmlHandler:
             # SgXML files together
 
             # Allow to overwrite the name and path of the destination file
-            nodeFilepath = getAttrOrNone(mayaElementPath, 'sgxml_filepath')            
+            nodeFilepath = self.sgxmlAttrs.get(mayaElementPath, 'sgxml_filepath')            
             if nodeFilepath:
                 fileDir = os.path.dirname(nodeFilepath)
                 if fileDir:
@@ -315,9 +926,9 @@ class MayaSgxmlHandler:
             else:
                 stemUsed = mayaNode2FileStem(mayaElementPath)
 
-            filepath = mayaNode2FilePath(mayaElementPath, self.fileDir, 'xml', relativePath=True)
+            filepath = mayaNode2FilePath(mayaElementPath, self.fileDir, 'xml', relativePath=True, sgxmlAttrs=self.sgxmlAttrs)
             newElement = scenegraphXML.Reference(curNodeName, refFile=filepath, groupType=nodeGroupType)
-            elementChildList = getValidChildren(mayaElementPath)
+            elementChildList = getValidChildren(mayaElementPath, self.sgxmlAttrs)
             newChildHandler = MayaSgxmlHandler(mayaSelection=elementChildList,
                                                 fileDir=dirUsed,
                                                 fileStem=stemUsed,
@@ -326,7 +937,16 @@ class MayaSgxmlHandler:
                                                 arbAttrs=self.arbAttrs,
                                                 geoFileOptions=self.geoFileOptions,
                                                 boundsWriteMode=self.boundsWriteMode,
-                                                mayaParent=mayaElementPath)
+                                                mayaParent=mayaElementPath,
+                                                channelFormat=self.channelFormat,
+                                                foldConstantChannels=self.foldConstantChannels,
+                                                deltaChannels=self.deltaChannels,
+                                                componentStore=self.componentStore,
+                                                sgxmlAttrs=self.sgxmlAttrs,
+                                                channelSampling=self.channelSampling,
+                                                abcExportPlan=self.abcExportPlan,
+                                                animBounds=self.animBounds)
+            newChildHandler.referenceElement = newElement
             self.childHandlers.append(newChildHandler)
 
         elif nodeType == 'component' or nodeType == 'staticComponent':
@@ -334,31 +954,40 @@ class MayaSgxmlHandler:
             # alembic format .abc file
             # (Would be nice to generalise this later)
             
-            refType = getAttrOrNone(mayaElementPath, 'sgxml_refType')
+            refType = self.sgxmlAttrs.get(mayaElementPath, 'sgxml_refType')
 
-            elementChildList = getValidChildren(mayaElementPath)
+            elementChildList = getValidChildren(mayaElementPath, self.sgxmlAttrs)
             if not elementChildList and mayaElementPath:
                 elementChildList = [mayaElementPath]
 
             if refType == 'abc':
-                filepath = mayaNode2FilePath(mayaElementPath, self.fileDir, 'abc', relativePath=True)
+                filepath = mayaNode2FilePath(mayaElementPath, self.fileDir, 'abc', relativePath=True, sgxmlAttrs=self.sgxmlAttrs)
                 newElement = scenegraphXML.Reference(curNodeName, refType='abc', refFile=filepath, groupType=nodeGroupType)
-                abcFilePath = mayaNode2FilePath(mayaElementPath, self.fileDir, 'abc', relativePath=False)
+                abcFilePath = mayaNode2FilePath(mayaElementPath, self.fileDir, 'abc', relativePath=False, sgxmlAttrs=self.sgxmlAttrs)
                     
+                # share the exported file with any identical component already exported,
+                # unless the node explicitly defines where its file should go
+                sharedElement = None
+                if self.sgxmlAttrs.get(mayaElementPath, 'sgxml_filepath') is None:
+                    sharedElement = newElement
+
                 # if staticComponent force no writing of animation in the abc file
                 if nodeType == 'staticComponent':
-                    maya2Abc(mayaElementPath, elementChildList, abcFilePath, None, None, self.geoFileOptions)
+                    self.abcExportPlan.addExport(mayaElementPath, elementChildList, abcFilePath, None, None,
+                                                 self.geoFileOptions, sharedElement, self.fileDir)
                 else:
-                    maya2Abc(mayaElementPath, elementChildList, abcFilePath, self.startFrame, self.endFrame, self.geoFileOptions)
+                    self.abcExportPlan.addExport(mayaElementPath, elementChildList, abcFilePath,
+                                                 self.startFrame, self.endFrame, self.geoFileOptions,
+                                                 sharedElement, self.fileDir)
 
         elif nodeType == 'reference':
             # This is a reference to an already existing .abc or .xml file
             newElement = scenegraphXML.Reference(curNodeName)
-            refType = getAttrOrNone(mayaElementPath, 'sgxml_refType')
+            refType = self.sgxmlAttrs.get(mayaElementPath, 'sgxml_refType')
             if refType == 'abc':
-                filepath = mayaNode2FilePath(mayaElementPath, self.fileDir, 'abc', relativePath=True)
+                filepath = mayaNode2FilePath(mayaElementPath, self.fileDir, 'abc', relativePath=True, sgxmlAttrs=self.sgxmlAttrs)
             else:
-                filepath = mayaNode2FilePath(mayaElementPath, self.fileDir, 'xml', relativePath=True)
+                filepath = mayaNode2FilePath(mayaElementPath, self.fileDir, 'xml', relativePath=True, sgxmlAttrs=self.sgxmlAttrs)
             
             newElement = scenegraphXML.Reference(curNodeName, refType=refType, refFile=filepath, groupType=nodeGroupType)
 
@@ -381,7 +1010,7 @@ class MayaSgxmlHandler:
             if childNodes is not None:
                 for mayaChildPath in childNodes:
                     # check if the node isn't set to 'ignore'
-                    if cmds.listAttr(mayaChildPath, st=['sgxml_ignore']) is None:
+                    if not self.sgxmlAttrs.hasAttr(mayaChildPath, 'sgxml_ignore'):
                         # check if this is a valid instance node. For now we only
                         # process transform nodes
                         curNodeType = cmds.nodeType(mayaChildPath)
@@ -397,13 +1026,13 @@ class MayaSgxmlHandler:
         # the time being we are going to just leave it out of the scenegraph file.
         #
         # test if xform is animating
-        refType = getAttrOrNone(mayaElementPath, 'sgxml_refType')
+        refType = self.sgxmlAttrs.get(mayaElementPath, 'sgxml_refType')
         if cmds.listRelatives(mayaElementPath, shapes=True ) and refType == 'abc':
             cmds.warning("%s contains a shape node. Transforms will be stored "
                          "in the Alembic file to prevent double transforms."
                          % mayaElementPath)
         else:
-            if self.isFrameRangeSet() and isXformAnimated(mayaElementPath):
+            if self.isFrameRangeSet() and self.sgxmlAttrs.isXformAnimated(mayaElementPath):
                 newChannelIndex = self.newAnimChannel(mayaElementPath, 'xform', 16)
                 newElement.setXform(channelIndex=newChannelIndex)
             else:
@@ -412,7 +1041,7 @@ class MayaSgxmlHandler:
 
         # process bounds
         # Check if local override has been set to force the boundsWriteMode on this node
-        processBounds = getAttrOrNone(mayaElementPath, 'sgxml_boundsWriteMode')
+        processBounds = self.sgxmlAttrs.get(mayaElementPath, 'sgxml_boundsWriteMode')
         if processBounds is None:
             if self.boundsWriteMode == 'all':
                 processBounds = True
@@ -423,7 +1052,7 @@ class MayaSgxmlHandler:
                 # Now supporting static components (no animation)
                 processBounds = nodeType in ('assembly', 'component', 'staticComponent', 'reference')
                 
-        customBounds = getAttrOrNone(mayaElementPath, 'sgxml_customBounds')
+        customBounds = self.sgxmlAttrs.get(mayaElementPath, 'sgxml_customBounds')
         if customBounds:
             newChannelIndex = self.newAnimChannel(mayaElementPath, 'customBounds', 6)
         
@@ -437,22 +1066,22 @@ class MayaSgxmlHandler:
                 newElement.setBounds(channelIndex=newChannelIndex)
 
         # process lodData
-        lodTag = getAttrOrNone(mayaElementPath, 'sgxml_lodTag')
-        lodWeight = getAttrOrNone(mayaElementPath, 'sgxml_lodWeight')
+        lodTag = self.sgxmlAttrs.get(mayaElementPath, 'sgxml_lodTag')
+        lodWeight = self.sgxmlAttrs.get(mayaElementPath, 'sgxml_lodWeight')
         if lodTag is not None or lodWeight is not None:
             newElement.setLodData(tag=lodTag, weight=lodWeight)
 
         # process proxyList
         # note: currently only supports single proxy in proxyList
-        proxyName = getAttrOrNone(mayaElementPath, 'sgxml_proxyName')
-        proxyFile = getAttrOrNone(mayaElementPath, 'sgxml_proxyFile')
+        proxyName = self.sgxmlAttrs.get(mayaElementPath, 'sgxml_proxyName')
+        proxyFile = self.sgxmlAttrs.get(mayaElementPath, 'sgxml_proxyFile')
         if proxyName is not None and proxyFile is not None:
             newElement.addProxy(name=proxyName, ref=proxyFile)
 
         # process arbitrary attributes
         if self.arbAttrs is not None:
             for attrName in self.arbAttrs:
-                curVal = getAttrOrNone(mayaElementPath, 'arbAttr_' + attrName)
+                curVal = self.sgxmlAttrs.get(mayaElementPath, 'arbAttr_' + attrName)
                 if curVal is not None:
                     if isinstance( curVal, float ):
                         # animated float attribute case
@@ -490,80 +1119,169 @@ class MayaSgxmlHandler:
     def newRangeMaxBounds(self, mayaPath, sgxmlElement):
         self.rangeMaxBoundsList.append([mayaPath, sgxmlElement])
 
-    def writeSgxml(self):
+    def getXMLFilePath(self):
         # construct full file path for ScenegraphXML file
         fullFilePath = self.fileStem + '.xml'
         if self.fileDir is not None:
             fullFilePath = os.path.join(self.fileDir, fullFilePath)
+        return fullFilePath
 
-        # write our file for the SgXML handler
-        self.root.writeXMLFile(fullFilePath)
+    def estimateExport(self, exportEstimate):
+        # adds the SgXML and channel files this and any child handlers would write to
+        # exportEstimate, without writing anything. Nothing has been sampled yet, so the
+        # XML sizes are those of the hierarchy with its default bounds and values
+        for curChildHandler in self.childHandlers:
+            curChildHandler.estimateExport(exportEstimate)
+
+        exportEstimate.addXMLFile(self.getXMLFilePath(), self.root.getXMLFileSize())
+        if not self.isStatic():
+            channelData = self.root.channelData
+            numFiles, numBytes = channelData.estimateChannelFiles()
+            exportEstimate.addChannelSet(channelData.ref, self.numChannels, self.endFrame - self.startFrame + 1,
+                                         numFiles, numBytes)
+
+    def writeSgxml(self):
+        fullFilePath = self.getXMLFilePath()
 
-        # write out files for child SgXML handlers
+        # write out files for child SgXML handlers first, so that references to
+        # duplicated child files can be pointed at a shared file
         for curChildHandler in self.childHandlers:
-            curChildHandler.writeSgxml()
+            childFilePath = curChildHandler.writeSgxml()
+            if self.componentStore is not None and curChildHandler.isStatic():
+                sharedFilePath = self.componentStore.addRelativeFile(childFilePath)
+                if sharedFilePath != childFilePath:
+                    curChildHandler.referenceElement.setRefFile(
+                        relativeRefPath(sharedFilePath, self.fileDir))
+
+        # write our file for the SgXML handler
+        self.root.writeXMLFile(fullFilePath)
+        return fullFilePath
 
     def writeChannelData(self):
         # write the channel data for the animation range for this and any child handlers
         # note: we should only get here if a valid animation range has been set
+        # With channelWriterThreads set, channel files are written by a pool of
+        # background threads while Maya moves on to the next frame
+        channelWriter = scenegraphXML.ChannelFileWriter(numThreads=self.channelWriterThreads)
         try:
             if self.isStatic():
                 curFrame = self.getStaticFrameNo()
-                cmds.currentTime(curFrame)
-                self.writeChannelDataForFrame(curFrame)
-            else:                
+                self.setSampleFrame(curFrame)
+                self.writeChannelDataForFrame(curFrame, channelWriter)
+            elif self.foldConstantChannels:
+                # sample every frame first, so that constant channels can be folded
+                # into static values before any channel file is written
+                self.startChannelSampling()
                 for curFrame in range(self.startFrame, self.endFrame+1):
-                    cmds.currentTime(curFrame)
+                    self.setSampleFrame(curFrame)
                     self.writeChannelDataForFrame(curFrame)
+                self.writeSampledChannelData(channelWriter)
+            else:                
+                for curFrame in range(self.startFrame, self.endFrame+1):
+                    self.setSampleFrame(curFrame)
+                    self.writeChannelDataForFrame(curFrame, channelWriter)
+            channelWriter.close()
         except Exception as e:
+            channelWriter.close(raiseErrors=False)
             cmds.error("Exception: %s (MayaSgxmlHandler.writeChannelData)" % e)
 
-    def writeChannelDataForFrame(self, frameNumber):
+    def setSampleFrame(self, frameNumber):
+        # only step the timeline when channels are sampled at the current time
+        if self.channelSampling == 'timeline':
+            cmds.currentTime(frameNumber)
+
+    def getSampleTime(self, frameNumber):
+        # time to pass to getAttr for the channels of frameNumber, None for the current time
+        if self.channelSampling == 'context':
+            return frameNumber
+        return None
+
+    def startChannelSampling(self):
+        # keep the channel values of each frame in memory rather than writing them
+        self.sampledFrames = []
+        for curChildHandler in self.childHandlers:
+            curChildHandler.startChannelSampling()
+
+    def writeSampledChannelData(self, channelWriter=None):
+        # fold the channels that are constant over the frame range into static values
+        # and write the remaining animated channels for every frame
+        for curChildHandler in self.childHandlers:
+            curChildHandler.writeSampledChannelData(channelWriter)
+
+        frameValues = self.root.foldConstantChannels(self.sampledFrames)
+        self.sampledFrames = None
+        channelData = self.root.channelData
+        if not frameValues or len(frameValues[0]) == 0:
+            # nothing animates, so no channel files are needed
+            self.root.channelData = None
+            return
+
+        for curFrame, curValues in zip(range(self.startFrame, self.endFrame+1), frameValues):
+            channelData.setAllValues(curValues)
+            if channelWriter is not None:
+                channelWriter.submit(channelData, curFrame)
+            else:
+                channelData.writeXMLChannelFile(curFrame)
+            # each delta encoded frame is relative to the previous one, as it will be decoded
+            channelData.updateDeltaBase(curFrame)
+
+    def writeChannelDataForFrame(self, frameNumber, channelWriter=None):
         # recurse through each child handler writing the channel data for this frame
         for curChildHandler in self.childHandlers:
-            curChildHandler.writeChannelDataForFrame(frameNumber)
+            curChildHandler.writeChannelDataForFrame(frameNumber, channelWriter)
 
         # copy the values for the animated values from maya to the sgxml channels
+        sampleTime = self.getSampleTime(frameNumber)
         for mayaPath, attrName, channelIndex, numChannels in self.mayaChannelData:
             vals = []
             #print("mayaPath = %s" % mayaPath)
             #print("attrName = %s" % attrName)
             if attrName is 'bounds':
-                vals = getAnimBoundsData(mayaPath, frameNumber)
+                vals = self.animBounds.getBounds(mayaPath, frameNumber)
             elif attrName is 'xform':
-                vals = cmds.xform(mayaPath, query=True, matrix=True, objectSpace=True)
+                if sampleTime is None:
+                    vals = cmds.xform(mayaPath, query=True, matrix=True, objectSpace=True)
+                else:
+                    # the local matrix attribute holds the same object space matrix
+                    vals = getAttrAtTime(mayaPath + '.matrix', sampleTime)
             elif attrName is 'customBounds':
-                sgxml_boundMinX = getAttrOrZero(mayaPath, 'sgxml_boundMinX')
-                sgxml_boundMaxX = getAttrOrZero(mayaPath, 'sgxml_boundMaxX')
-                sgxml_boundMinY = getAttrOrZero(mayaPath, 'sgxml_boundMinY')
-                sgxml_boundMaxY = getAttrOrZero(mayaPath, 'sgxml_boundMaxY')
-                sgxml_boundMinZ = getAttrOrZero(mayaPath, 'sgxml_boundMinZ')
-                sgxml_boundMaxZ = getAttrOrZero(mayaPath, 'sgxml_boundMaxZ')
+                sgxml_boundMinX = getAttrOrZero(mayaPath, 'sgxml_boundMinX', sampleTime)
+                sgxml_boundMaxX = getAttrOrZero(mayaPath, 'sgxml_boundMaxX', sampleTime)
+                sgxml_boundMinY = getAttrOrZero(mayaPath, 'sgxml_boundMinY', sampleTime)
+                sgxml_boundMaxY = getAttrOrZero(mayaPath, 'sgxml_boundMaxY', sampleTime)
+                sgxml_boundMinZ = getAttrOrZero(mayaPath, 'sgxml_boundMinZ', sampleTime)
+                sgxml_boundMaxZ = getAttrOrZero(mayaPath, 'sgxml_boundMaxZ', sampleTime)
                 
-                addAnimBoundsData(mayaPath, frameNumber, [sgxml_boundMinX, sgxml_boundMaxX, sgxml_boundMinY, sgxml_boundMaxY, sgxml_boundMinZ, sgxml_boundMaxZ])
+                self.animBounds.setBounds(mayaPath, frameNumber, [sgxml_boundMinX, sgxml_boundMaxX, sgxml_boundMinY, sgxml_boundMaxY, sgxml_boundMinZ, sgxml_boundMaxZ])
             else:
                 if numChannels == 1:
-                    vals = [cmds.getAttr(mayaPath + '.' + attrName)]
+                    vals = [getAttrAtTime(mayaPath + '.' + attrName, sampleTime)]
                 else:
-                    vals = cmds.getAttr(mayaPath + '.' + attrName)
+                    vals = getAttrAtTime(mayaPath + '.' + attrName, sampleTime)
             # note: vals can be none for bounds that are to be automatically calculated
             if vals is not None:
-                for i, curVal in enumerate(vals):
-                    fle = channelIndex + i
-                    self.root.setChannelDataValue(channelIndex + i, curVal)
+                self.root.setChannelDataValues(channelIndex, vals)
 
         # force any automatic calculation of bounds of parents based on children needed
         curBounds = self.root.calcBounds()
 
         # if this SgXML handler has a mayaParent, place the top level bounds data into
-        # animBoundsData for use by the parent handler
-        if self.mayaParent is not None:
-            addAnimBoundsData(self.mayaParent, frameNumber, curBounds)
+        # animBounds for use by the parent handler
+        if self.mayaParent is not None and curBounds is not None:
+            self.animBounds.setBounds(self.mayaParent, frameNumber, curBounds)
 
         # write out the XML file for the channel data
         if not self.isStatic():
             "Writing XML channel file..."
-            self.root.writeXMLChannelFile(frameNumber)
+            if self.sampledFrames is not None:
+                self.sampledFrames.append(self.root.channelData.snapshot().values)
+            elif channelWriter is not None:
+                channelWriter.submit(self.root.channelData, frameNumber)
+            else:
+                self.root.writeXMLChannelFile(frameNumber)
+            if self.sampledFrames is None:
+                # each delta encoded frame is relative to the previous one, as it will be decoded
+                self.root.channelData.updateDeltaBase(frameNumber)
            
 
 def setSgxmlAttr( attrName, selection=None, value=None, attrType='bool' ):
@@ -8,8 +8,30 @@ that can be read and written using XML and Alembic .abc files.
 """
 
 import xml.etree.ElementTree as ET
+import xml.parsers.expat
 import os.path
 import logging
+import struct
+import mmap
+import sys
+import threading
+import re
+import fnmatch
+import bisect
+import hashlib
+from array import array
+from collections import OrderedDict
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+# NumPy is optional and only used to speed up batched bounds calculations
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 
 __version__ = '0.1.0'
@@ -21,6 +43,75 @@ SG_XML_LOG_LEVEL = logging.WARNING
 log = logging.getLogger("scenegraphXML")
 log.setLevel(SG_XML_LOG_LEVEL)
 
+# Defines whether ScenegraphRoot.writeXMLFile streams XML to disk while walking
+# the hierarchy (True) or builds the full ElementTree in memory first (False)
+SG_XML_STREAMING_WRITE = False
+
+# ElementTree sorts attributes on output before Python 3.8 and keeps insertion
+# order from then on. The streaming writer follows the same rule so that both
+# writers produce byte-identical files.
+SG_XML_SORT_ATTRIBUTES = sys.version_info < (3, 8)
+
+# Minimum number of bounds in a batch for applyXformsToBounds to use NumPy.
+# Smaller batches are faster in pure Python.
+SG_XML_NUMPY_MIN_BATCH = 16
+
+# Defines whether ScenegraphRoot.readXMLFile goes through the process-wide 
+# readCache by default, and the memory budget of that cache in bytes. The memory
+# used by a cached scene is estimated as SG_XML_CACHE_SIZE_FACTOR times the size
+# of its XML file.
+SG_XML_READ_CACHE = False
+SG_XML_CACHE_MAX_BYTES = 512 * 1024 * 1024
+SG_XML_CACHE_SIZE_FACTOR = 4
+
+# On-disk formats supported for per-frame channel files
+CHANNEL_FORMAT_XML = 'xml'
+CHANNEL_FORMAT_BINARY = 'binary'
+CHANNEL_FORMAT_ARCHIVE = 'archive'
+CHANNEL_FORMATS = (CHANNEL_FORMAT_XML, CHANNEL_FORMAT_BINARY, CHANNEL_FORMAT_ARCHIVE)
+
+# Binary channel files start with a fixed little-endian header holding a magic
+# string, the format version, the struct type code of the values ('f' for
+# float32, 'd' for float64) and the number of values that follow the header
+CHANNEL_BINARY_MAGIC = b'SGCH'
+CHANNEL_BINARY_VERSION = 1
+CHANNEL_BINARY_HEADER = struct.Struct('<4sHcxI')
+CHANNEL_BINARY_TYPECODES = {'float32': 'f', 'float64': 'd'}
+# type code of binary channel files holding delta encoded frames, whose values
+# are zigzag encoded little-endian base 128 integers
+CHANNEL_BINARY_VARINT_TYPECODE = 'v'
+
+# Channel archives hold every frame of a channel set in a single file: a header
+# (magic, version, type code, number of channels per row, start frame and number
+# of frames), a frame index table with one (frameNumber, rowOffset) entry per
+# frame of the range (rowOffset is -1 until the frame is written) and the rows
+# themselves, each holding all channels of a frame at a fixed stride
+CHANNEL_ARCHIVE_MAGIC = b'SGCA'
+CHANNEL_ARCHIVE_VERSION = 1
+CHANNEL_ARCHIVE_HEADER = struct.Struct('<4sHcxIiI')
+CHANNEL_ARCHIVE_INDEX_ENTRY = struct.Struct('<iq')
+
+# Encodings of the values in channel files. Delta encoded files hold the
+# difference to the values of the previous frame, as a reader decodes them, so
+# that rounding errors don't accumulate over the range. The differences are 
+# stored as whole numbers of CHANNEL_DELTA_QUANTUM (written as integers in XML
+# files and as variable length integers in binary files), which is what makes
+# the files smaller. The first frame of the range holds absolute values. 
+# Channel archives have a fixed row size and don't support delta encoding.
+CHANNEL_ENCODING_ABSOLUTE = 'absolute'
+CHANNEL_ENCODING_DELTA = 'delta'
+CHANNEL_DELTA_QUANTUM = 1e-6
+
+# Relative precision of the values written to channel files, used to check that
+# delta encoded values round trip. Python 2 writes XML values with 12 significant
+# digits, Python 3 with as many as needed to read back the same double.
+CHANNEL_PRECISION_EPSILON = {'float32': 2.0 ** -23, 'float64': 2.0 ** -52}
+CHANNEL_XML_EPSILON = 2.0 ** -52 if sys.version_info[0] >= 3 else 1e-11
+
+# Typical number of characters of a channel value written to an XML channel
+# file, used to estimate the size of XML channel files before they're written
+CHANNEL_XML_VALUE_CHARS = 18
+
 
 def floatOrNone(val):
     """
@@ -32,6 +123,51 @@ def floatOrNone(val):
         return float(val)
 
 
+def encodeVarints(values):
+    """
+    Returns integers packed as zigzag encoded little-endian base 128 varints, 
+    which take a single byte for values between -64 and 63.
+    """
+    data = bytearray()
+    for curValue in values:
+        curValue = 2 * curValue if curValue >= 0 else -2 * curValue - 1
+        while curValue > 0x7f:
+            data.append((curValue & 0x7f) | 0x80)
+            curValue >>= 7
+        data.append(curValue)
+    return bytes(data)
+
+
+def decodeVarints(buf, offset, numValues):
+    """
+    Returns the numValues integers packed by encodeVarints from buf, starting 
+    at offset.
+    """
+    data = bytearray(buf[offset:])
+    values = []
+    curValue = shift = 0
+    for curByte in data:
+        curValue |= (curByte & 0x7f) << shift
+        if curByte & 0x80:
+            shift += 7
+            continue
+        values.append(curValue >> 1 if not curValue & 1 else -(curValue >> 1) - 1)
+        if len(values) == numValues:
+            return values
+        curValue = shift = 0
+    raise ValueError('Truncated varint data: %d of %d values found' % (len(values), numValues))
+
+
+def floatArrayOrNone(val):
+    """
+    Returns None if val is None and copy it into an array of doubles otherwise.
+    """
+    if val is None:
+        return None
+    else:
+        return array('d', val)
+
+
 def intOrNone(val):
     """
     Returns None if val is None and cast it into int otherwise.
@@ -63,6 +199,180 @@ def createScenegraphElementFromXMLData(xmlElement):
     raise ValueError('No valid scenegraph element found when reading XML data for ScenegraphElement')
 
 
+def createLazyScenegraphElementFromXMLData(xmlElement, filepath, instancePath, fileIndex=None):
+    """
+    Lazy counterpart of createScenegraphElementFromXMLData. Groups are created
+    as LazyGroup instances that read their instances from filepath on first 
+    access, using instancePath to locate them in the file, through fileIndex 
+    if given.
+    """
+    elementType = xmlElement.get('type')
+
+    if elementType == 'group':
+        newGroup = LazyGroup(filepath=filepath, instancePath=instancePath, fileIndex=fileIndex)
+        newGroup.readXMLData(xmlElement)
+        return newGroup
+
+    if elementType == 'reference':
+        newReference = Reference()
+        newReference.readXMLData(xmlElement)
+        return newReference
+
+    raise ValueError('No valid scenegraph element found when reading XML data for ScenegraphElement')
+
+
+def readLazyInstanceList(filepath, instancePath=(), sgRoot=None, fileIndex=None):
+    """
+    Reads the instances held directly in the instanceList found at instancePath
+    in a scenegraphXML file, using iterparse. instancePath is the tuple of 
+    instance indices leading from the root to a group, () being the root 
+    itself. Parsed XML elements are freed as soon as they have been read, 
+    nested instances are left for their LazyGroup to read on first access and 
+    parsing stops at the end of the requested instanceList. If sgRoot is given,
+    the file version and channelData are read into it as well. The LazyGroups
+    created read their own instances through fileIndex if given.
+    """
+    log.debug('\nlazily reading instances %s of XML file %s' % (instancePath, filepath))
+    if not os.path.isfile(filepath):
+        raise ValueError('File not found: "%s"' % filepath)
+
+    instancePath = tuple(instancePath)
+    instanceList = None
+    curInstancePath = []
+    instanceCounts = []
+    xmlStack = []
+    for event, xmlElement in ET.iterparse(filepath, events=('start', 'end')):
+        tag = xmlElement.tag
+        if event == 'start':
+            xmlStack.append(xmlElement)
+            if tag == 'instanceList':
+                instanceCounts.append(0)
+            elif tag == 'instance':
+                curInstancePath.append(instanceCounts[-1])
+                instanceCounts[-1] += 1
+            elif tag == 'scenegraphXML' and sgRoot is not None:
+                if xmlElement.get('version') != __version__:
+                    print('WARNING: XML file version does not match')
+            continue
+
+        xmlStack.pop()
+        if tag == 'instance':
+            if len(curInstancePath) == len(instancePath) + 1 and \
+               tuple(curInstancePath[:-1]) == instancePath:
+                if instanceList is None:
+                    instanceList = []
+                instanceList.append(createLazyScenegraphElementFromXMLData(
+                    xmlElement, filepath, tuple(curInstancePath), fileIndex))
+            curInstancePath.pop()
+            # free the instance now it has been read. Earlier siblings have
+            # already been removed, so this is the first child of its parent
+            xmlElement.clear()
+            xmlStack[-1].remove(xmlElement)
+        elif tag == 'instanceList':
+            instanceCounts.pop()
+            if tuple(curInstancePath) == instancePath:
+                if instanceList is None:
+                    instanceList = []
+                break
+        elif tag == 'channelData' and sgRoot is not None and not curInstancePath:
+            sgRoot.channelData = ChannelData()
+            sgRoot.channelData.readXMLData(xmlElement)
+
+    if instanceList is None:
+        raise ValueError('Cannot find XML element "instanceList" for instance %s when reading XML file "%s"'
+                         % (instancePath, filepath))
+    return instanceList
+
+
+class LazyFileIndex(object):
+    """
+    Byte range of every instanceList of a scenegraphXML file, keyed by the 
+    instance path of the group holding it. The index is built with a single 
+    expat pass over the file on first use and shared by all the LazyGroups 
+    read from the file, so that each of them only parses its own part of the 
+    file rather than the file from the start.
+    """
+
+    def __init__(self, filepath):
+        self.filepath = filepath
+        # instance path -> (byte offset of <instanceList>, byte offset of its end event)
+        self.ranges = None
+        self.lock = threading.Lock()
+
+    def build(self):
+        log.debug('\nindexing instance lists of XML file %s' % self.filepath)
+        ranges = {}
+        curInstancePath = []
+        instanceCounts = []
+        startOffsets = []
+        parser = xml.parsers.expat.ParserCreate()
+
+        def startElement(tag, attrs):
+            if tag == 'instanceList':
+                instanceCounts.append(0)
+                startOffsets.append(parser.CurrentByteIndex)
+            elif tag == 'instance':
+                curInstancePath.append(instanceCounts[-1])
+                instanceCounts[-1] += 1
+
+        def endElement(tag):
+            if tag == 'instanceList':
+                instanceCounts.pop()
+                ranges[tuple(curInstancePath)] = (startOffsets.pop(), parser.CurrentByteIndex)
+            elif tag == 'instance':
+                curInstancePath.pop()
+
+        parser.StartElementHandler = startElement
+        parser.EndElementHandler = endElement
+        with open(self.filepath, 'rb') as f:
+            parser.ParseFile(f)
+        self.ranges = ranges
+
+    def readInstanceList(self, instancePath):
+        """
+        Reads the instances held directly in the instanceList of the group at 
+        instancePath, parsing only the bytes of that instanceList.
+        """
+        with self.lock:
+            if self.ranges is None:
+                self.build()
+        instancePath = tuple(instancePath)
+        if instancePath not in self.ranges:
+            raise ValueError('Cannot find XML element "instanceList" for instance %s when reading XML file "%s"'
+                             % (instancePath, self.filepath))
+        startOffset, endOffset = self.ranges[instancePath]
+        closingTag = b'</instanceList>'
+        with open(self.filepath, 'rb') as f:
+            f.seek(startOffset)
+            fragment = f.read(endOffset - startOffset + len(closingTag))
+        # expat reports the end of an empty element tag after the tag, and the
+        # end of other elements at the start of their closing tag
+        if not fragment.startswith(closingTag, endOffset - startOffset):
+            fragment = fragment[:endOffset - startOffset]
+        xmlInstanceList = ET.fromstring(fragment)
+        return [createLazyScenegraphElementFromXMLData(xmlCurInstance, self.filepath, instancePath + (index,), self)
+                for index, xmlCurInstance in enumerate(xmlInstanceList)]
+
+
+def findConstantChannels(frameValues, tolerance=0.0):
+    """
+    Utility function returning, for each channel of the per-frame channel values
+    in frameValues, whether the channel stays within tolerance of its first 
+    frame value across all frames. Uses NumPy when available.
+    """
+    firstValues = frameValues[0]
+    if numpy is not None:
+        values = numpy.asarray(frameValues, dtype=numpy.float64)
+        return (numpy.abs(values - values[0]) <= tolerance).all(axis=0).tolist()
+
+    constantChannels = [True] * len(firstValues)
+    for curValues in frameValues[1:]:
+        for index, (curValue, firstValue) in enumerate(zip(curValues, firstValues)):
+            if constantChannels[index] and abs(curValue - firstValue) > tolerance:
+                constantChannels[index] = False
+    return constantChannels
+
+
 def applyXformToVector(m, v):
     """
     Utility function to calculate the effect of an Xform (list of 16 values) on a 3D vector (list of 3 values)
@@ -107,15 +417,75 @@ def applyXformToBounds(curXform, curBounds):
                 newBounds[5] = curPos[2]
     # return result
     return newBounds
+
+
+def multiplyXforms(a, b):
+    """
+    Utility function returning the Xform (list of 16 values) applying Xform a 
+    and then Xform b, in the convention used by applyXformToVector.
+    """
+    return [a[row]*b[col] + a[row+1]*b[col+4] + a[row+2]*b[col+8] + a[row+3]*b[col+12]
+            for row in (0, 4, 8, 12) for col in (0, 1, 2, 3)]
+
+
+def getFrustumPlanes(viewProjection):
+    """
+    Utility function returning the 6 planes (a, b, c, d) of the view frustum of 
+    a view-projection Xform (list of 16 values, OpenGL style clip space), in 
+    the convention used by applyXformToVector. Points inside the frustum have 
+    a*x + b*y + c*z + d >= 0 for every plane.
+    """
+    m = viewProjection
+    columns = [(m[col], m[col+4], m[col+8], m[col+12]) for col in (0, 1, 2, 3)]
+    planes = []
+    for col in (0, 1, 2):
+        for sign in (1.0, -1.0):
+            planes.append(tuple(w + sign * v for w, v in zip(columns[3], columns[col])))
+    return planes
+
+
+def applyXformsToBounds(xforms, boundsList):
+    """
+    Batched version of applyXformToBounds. Applies each of N Xforms (lists of 16
+    values) to the matching one of N bounds (lists of 6 values) and returns the
+    N resulting bounds. Uses NumPy when available.
+    """
+    if len(xforms) != len(boundsList):
+        raise ValueError('Number of Xforms and bounds differ when transforming bounds')
+    if numpy is None or len(xforms) < SG_XML_NUMPY_MIN_BATCH:
+        return [applyXformToBounds(curXform, curBounds)
+                for curXform, curBounds in zip(xforms, boundsList)]
+
+    matrices = numpy.asarray(xforms, dtype=numpy.float64).reshape(-1, 4, 4)
+    bounds = numpy.asarray(boundsList, dtype=numpy.float64)
+    # build the 8 corners of each bounding box as homogeneous vectors of form (x, y, z, 1)
+    corners = numpy.ones((len(bounds), 8, 4))
+    for cornerIndex, (ix, iy, iz) in enumerate(((0,2,4), (1,2,4), (0,3,4), (1,3,4), (0,2,5), (1,2,5), (0,3,5), (1,3,5))):
+        corners[:, cornerIndex, 0] = bounds[:, ix]
+        corners[:, cornerIndex, 1] = bounds[:, iy]
+        corners[:, cornerIndex, 2] = bounds[:, iz]
+    # same matrix multiplication as applyXformToVector, for all corners at once
+    positions = numpy.matmul(corners, matrices)
+    w = positions[:, :, 3:]
+    # trap for case w == 0
+    if not w.all():
+        raise ValueError("w==0 after homogeneous matrix multiplication")
+    positions = positions[:, :, :3] / w
+    newBounds = numpy.empty((len(bounds), 6))
+    newBounds[:, 0::2] = positions.min(axis=1)
+    newBounds[:, 1::2] = positions.max(axis=1)
+    return newBounds.tolist()
         
 
-class ArbitraryAttribute:
+class ArbitraryAttribute(object):
     """
     Class to hold animated static arbitrary attribute values. Values are typed, and
     can be single values or lists of the same value type. It also writes and 
     reads the in-memory XML representation of these values using ElementTree. 
     """
 
+    __slots__ = ('name', 'dataType', 'numValues', 'value', 'channelIndex')
+
     def __init__(self, name=None, dataType=None, value=None, numValues=None, channelIndex=None):
         """
             Type of the generic value is defined by the combination of dataType and listLength.
@@ -163,6 +533,25 @@ class ArbitraryAttribute:
             xmlArbitraryAttribute.attrib['channelIndex'] = str(self.channelIndex)
        
 
+    def getNumChannels(self):
+        if self.numValues is None:
+            return 1
+        return self.numValues
+
+    def foldChannels(self, channelValues):
+        """
+        Replaces the animated value by the static channelValues. Returns False 
+        if the data type cannot be held as a static value.
+        """
+        if self.dataType == 'float':
+            self.value = channelValues[0]
+        elif self.dataType == 'floatList':
+            self.value = list(channelValues)
+        else:
+            return False
+        self.channelIndex = None
+        return True
+
     def readXMLData(self, xmlArbitraryAttribute):
         """
         Reads the Arbitrary Attribute values from the in-memory XML representation  
@@ -190,30 +579,28 @@ class ArbitraryAttribute:
         self.channelIndex = intOrNone(xmlArbitraryAttribute.get('channelIndex'))
 
 
-class Bounds:
+class Bounds(object):
     """
     Class to hold Bounding Box  values. It also writes and reads the in-memory 
-    XML representation of these values using ElementTree. 
+    XML representation of these values using ElementTree. Static values are 
+    stored as an array of doubles.
     """
 
+    __slots__ = ('value', 'channelIndex')
+
     def __init__(self, minx=None, maxx=None, miny=None, maxy=None, minz=None, maxz=None, value=None, channelIndex=None):
         if minx is not None:
-            self.value = [minx, maxx, miny, maxy, minz, maxz]
+            self.value = array('d', [minx, maxx, miny, maxy, minz, maxz])
         else:
-            self.value = value
+            self.value = floatArrayOrNone(value)
         self.channelIndex = channelIndex
             
 
     def setValue(self, value, channelData):
         if self.channelIndex is not None:
-            channelData.setValue(self.channelIndex, value[0])
-            channelData.setValue(self.channelIndex+1, value[1])
-            channelData.setValue(self.channelIndex+2, value[2])
-            channelData.setValue(self.channelIndex+3, value[3])
-            channelData.setValue(self.channelIndex+4, value[4])
-            channelData.setValue(self.channelIndex+5, value[5])
+            channelData.setValues(self.channelIndex, value[:6])
         else:
-            self.value = value
+            self.value = floatArrayOrNone(value)
 
     def getValue(self, channelData):
         if self.channelIndex is not None:
@@ -221,6 +608,14 @@ class Bounds:
         else:
             return self.value
 
+    def getNumChannels(self):
+        return 6
+
+    def foldChannels(self, channelValues):
+        self.value = floatArrayOrNone(channelValues)
+        self.channelIndex = None
+        return True
+
     def writeXMLData(self, xmlBounds):
         """
         Writes the Bounding Box values into the in-memory XML representation  
@@ -254,20 +649,23 @@ class Bounds:
         minz = floatOrNone(xmlBounds.get('minz'))
         maxz = floatOrNone(xmlBounds.get('maxz'))
         if minx is not None:
-            self.value = [minx, maxx, miny, maxy, minz, maxz]
+            self.value = array('d', [minx, maxx, miny, maxy, minz, maxz])
         else:
             self.value = None
         self.channelIndex = intOrNone(xmlBounds.get('channelIndex'))
 
 
-class Xform:
+class Xform(object):
     """
     Class to hold Transform values. It also writes and reads the in-memory 
-    XML representation of these values using ElementTree. 
+    XML representation of these values using ElementTree. Static values are 
+    stored as an array of doubles.
     """
 
+    __slots__ = ('value', 'channelIndex')
+
     def __init__(self, value=None, channelIndex=None):
-        self.value = value
+        self.value = floatArrayOrNone(value)
         self.channelIndex = channelIndex
 
     def getValue(self, channelData):
@@ -276,6 +674,14 @@ class Xform:
         else:
             return self.value
 
+    def getNumChannels(self):
+        return 16
+
+    def foldChannels(self, channelValues):
+        self.value = floatArrayOrNone(channelValues)
+        self.channelIndex = None
+        return True
+
     def writeXMLData(self, xmlXform):
         """
         Writes the Transformation values into the in-memory XML representation  
@@ -299,17 +705,19 @@ class Xform:
         log.debug('    calling Xform.readXMLData')
         valueAsString = xmlXform.get('value')
         if valueAsString is not None:
-            self.value = [float(x) for x in valueAsString.split(' ')]
+            self.value = array('d', [float(x) for x in valueAsString.split(' ')])
 
         self.channelIndex = intOrNone(xmlXform.get('channelIndex'))
 
 
-class Proxy:
+class Proxy(object):
     """
     Class to hold a geometry Proxy. It also writes and reads the in-memory 
     XML representation of these values using ElementTree. 
     """
 
+    __slots__ = ('name', 'ref')
+
     def __init__(self, name=None, ref=None):
         self.name = name
         self.ref = ref
@@ -343,17 +751,27 @@ class Proxy:
             raise ValueError('Cannot find XML attribute "ref" when reading XML data for Proxy')
 
 
-class LodData:
+class LodData(object):
     """
     Class to hold a geometry LOD data. It also writes and reads the in-memory 
     XML representation of these values using ElementTree. 
     """
 
+    __slots__ = ('tag', 'weight', 'channelIndex')
+
     def __init__(self, tag=None, weight=None, channelIndex=None):
         self.tag = tag
         self.weight = weight
         self.channelIndex = channelIndex
 
+    def getNumChannels(self):
+        return 1
+
+    def foldChannels(self, channelValues):
+        self.weight = channelValues[0]
+        self.channelIndex = None
+        return True
+
     def writeXMLData(self, xmlLodData):
         """
         Writes the LOD Data values into the in-memory XML representation  
@@ -384,12 +802,20 @@ class LodData:
         self.channelIndex = intOrNone(xmlLodData.get('channelIndex'))
 
 
-class LookFile:
+class LookFile(object):
+
+    __slots__ = ('ref', 'channelIndex')
 
     def __init__(self, ref=None, channelIndex=None):
         self.ref = ref        
         self.channelIndex = channelIndex
 
+    def getNumChannels(self):
+        return 1
+
+    def foldChannels(self, channelValues):
+        return False
+
     def writeXMLData(self, xmlLookFile):
         log.debug('    calling LookFile.writeXMLData')
         if self.ref is not None:
@@ -403,7 +829,9 @@ class LookFile:
         self.channelIndex = intOrNone(xmlLookFile.get('channelIndex'))
 
 
-class AttributeFile:
+class AttributeFile(object):
+
+    __slots__ = ('ref', 'groupName', 'customParser', 'channelIndex')
 
     def __init__(self, ref=None, groupName=None, customParser=None, channelIndex=None):
         self.ref = ref
@@ -411,6 +839,12 @@ class AttributeFile:
         self.customParser = customParser
         self.channelIndex = channelIndex
 
+    def getNumChannels(self):
+        return 1
+
+    def foldChannels(self, channelValues):
+        return False
+
     def writeXMLData(self, xmlAttributeFile):
         log.debug('    calling AttributeFile.writeXMLData')
         if self.ref is not None:
@@ -433,15 +867,154 @@ class AttributeFile:
 class ChannelData:
     """
     Class to hold a animation Channel data. It also writes and reads the 
-    in-memory XML representation of these values using ElementTree. 
+    in-memory XML representation of these values using ElementTree. Values 
+    are held in an array of doubles, which can be preallocated to the known 
+    number of channels.
     """
     
-    def __init__(self, startFrame=None, endFrame=None, ref=None):
+    def __init__(self, startFrame=None, endFrame=None, ref=None, fileFormat=CHANNEL_FORMAT_XML, precision='float64',
+                 numValues=0):
         self.startFrame = startFrame
         self.endFrame = endFrame
         self.ref = ref
-        self.values = []
+        self.values = array('d', [0.0]) * numValues
         self.relativeMode = True
+        # channel index -> auto calculated Groups whose bounds depend on it. Only
+        # set while bounds caching is enabled on the ScenegraphRoot
+        self.boundsDependents = None
+        # incremented whenever all values are replaced at once, which invalidates
+        # every cached bounds value
+        self.generation = 0
+        self.encoding = CHANNEL_ENCODING_ABSOLUTE
+        # decoded values of baseFrame, which the delta encoded frame after it is
+        # relative to
+        self.baseValues = None
+        self.baseFrame = None
+        self.deltaQuantum = CHANNEL_DELTA_QUANTUM
+        self._archiveCreated = False
+        self._archiveFile = None
+        self._archiveMap = None
+        self._archiveStat = None
+        self.setFileFormat(fileFormat, precision)
+
+    def setFileFormat(self, fileFormat, precision='float64'):
+        """
+        Sets the on-disk format used for the channel files. Valid values of 
+        fileFormat: "xml", "binary" (one packed file per frame) or "archive" 
+        (one packed file for the whole frame range). precision ("float32" or 
+        "float64") is only used by the binary and archive formats.
+        """
+        if fileFormat not in CHANNEL_FORMATS:
+            raise ValueError('Invalid fileFormat for ChannelData: "%s"' % fileFormat)
+        if precision not in CHANNEL_BINARY_TYPECODES:
+            raise ValueError('Invalid precision for ChannelData: "%s"' % precision)
+        if fileFormat == CHANNEL_FORMAT_ARCHIVE and self.encoding == CHANNEL_ENCODING_DELTA:
+            raise ValueError('Channel archives do not support delta encoding')
+        self.fileFormat = fileFormat
+        self.precision = precision
+        self.closeChannelArchive()
+
+    def setEncoding(self, encoding, deltaQuantum=CHANNEL_DELTA_QUANTUM):
+        """
+        Sets the encoding of the values in the channel files. Valid values of 
+        encoding: "absolute" or "delta". Delta encoded values are rounded to 
+        whole numbers of deltaQuantum, and must be written in frame order, 
+        calling updateDeltaBase after each frame.
+        """
+        if encoding not in (CHANNEL_ENCODING_ABSOLUTE, CHANNEL_ENCODING_DELTA):
+            raise ValueError('Invalid encoding for ChannelData: "%s"' % encoding)
+        if encoding == CHANNEL_ENCODING_DELTA:
+            if self.fileFormat == CHANNEL_FORMAT_ARCHIVE:
+                raise ValueError('Channel archives do not support delta encoding')
+            if not deltaQuantum > 0.0:
+                raise ValueError('Invalid deltaQuantum for ChannelData: %r' % deltaQuantum)
+        self.encoding = encoding
+        self.deltaQuantum = float(deltaQuantum)
+        self.baseValues = None
+        self.baseFrame = None
+
+    def isDeltaFrame(self, frameNumber):
+        return self.encoding == CHANNEL_ENCODING_DELTA and frameNumber != self.startFrame
+
+    def quantizeFileValues(self, values):
+        """
+        Returns values as they will be read back from the channel files, after
+        rounding them to the precision they are written with.
+        """
+        if self.fileFormat == CHANNEL_FORMAT_XML:
+            return array('d', [float(str(float(curValue))) for curValue in values])
+        return array('d', array(CHANNEL_BINARY_TYPECODES[self.precision], values))
+
+    def getFileValues(self, frameNumber):
+        """
+        Returns the values to store in the channel file of frameNumber. For delta
+        encoded frames these are the differences to the decoded values of the 
+        previous frame, as whole numbers of deltaQuantum.
+        """
+        if not self.isDeltaFrame(frameNumber):
+            return self.values
+        if self.baseFrame != frameNumber - 1 or len(self.baseValues) != len(self.values):
+            raise ValueError('Frame %d of delta encoded ChannelData written out of order' % frameNumber)
+        deltaQuantum = self.deltaQuantum
+        return [int(round((curValue - baseValue) / deltaQuantum))
+                for curValue, baseValue in zip(self.values, self.baseValues)]
+
+    def updateDeltaBase(self, frameNumber):
+        """
+        Records the current values, as a reader will decode them from the channel
+        file of frameNumber, as the base of the next delta encoded frame. Raises
+        a ValueError if a decoded value doesn't match the current value within 
+        half a deltaQuantum for delta encoded frames, or within the precision of
+        the channel files for the first frame.
+        """
+        if self.encoding != CHANNEL_ENCODING_DELTA:
+            return
+        if self.isDeltaFrame(frameNumber):
+            decodedValues = self.decodeDeltas(self.baseValues, self.getFileValues(frameNumber))
+            tolerance = 0.5 * self.deltaQuantum
+            epsilon = 2.0 ** -51
+        else:
+            decodedValues = self.quantizeFileValues(self.values)
+            tolerance = 0.0
+            if self.fileFormat == CHANNEL_FORMAT_XML:
+                epsilon = CHANNEL_XML_EPSILON
+            else:
+                epsilon = CHANNEL_PRECISION_EPSILON[self.precision]
+        for index, (curValue, decodedValue) in enumerate(zip(self.values, decodedValues)):
+            if not abs(decodedValue - curValue) <= tolerance + epsilon * (abs(decodedValue) + abs(curValue)):
+                raise ValueError('Channel %d of frame %d decodes to %r instead of %r'
+                                 % (index, frameNumber, decodedValue, curValue))
+        self.baseValues = decodedValues
+        self.baseFrame = frameNumber
+
+    def decodeDeltas(self, baseValues, fileValues):
+        """
+        Returns the values of a delta encoded frame from the decoded values of
+        the previous frame and the values stored in the channel file.
+        """
+        deltaQuantum = self.deltaQuantum
+        return array('d', [baseValue + fileValue * deltaQuantum
+                           for baseValue, fileValue in zip(baseValues, fileValues)])
+
+    def decodeFileValues(self, frameNumber, fileValues):
+        """
+        Returns the absolute values of a delta encoded frame from the values read
+        from its channel file, by adding them to the decoded values of the 
+        previous frame. Reading frames in order only reads each file once, other
+        frames are decoded from the closest frame decoded before them, or from 
+        the start of the range.
+        """
+        if self.baseValues is None or self.baseFrame is None or not \
+                self.startFrame <= self.baseFrame < frameNumber:
+            self.baseValues = array('d', self.readFileValues(self.startFrame))
+            self.baseFrame = self.startFrame
+        while self.baseFrame < frameNumber - 1:
+            self.baseFrame += 1
+            self.baseValues = self.decodeDeltas(self.baseValues, self.readFileValues(self.baseFrame))
+        values = self.decodeDeltas(self.baseValues, fileValues)
+        self.baseValues = values
+        self.baseFrame = frameNumber
+        return values
 
     def isStatic(self):
         return self.startFrame == self.endFrame
@@ -454,9 +1027,54 @@ class ChannelData:
         """
         # pad value range if need be
         if index >= len(self.values):
-            self.values = self.values + [0.0]*(index - len(self.values) + 1)
+            self.values.extend(array('d', [0.0]) * (index - len(self.values) + 1))
+        # mark the cached bounds of Groups depending on this channel as dirty
+        if self.boundsDependents is not None and self.values[index] != value:
+            dependents = self.boundsDependents.get(index)
+            if dependents is not None:
+                for curGroup in dependents:
+                    curGroup.boundsDirty = True
         self.values[index] = value
 
+    def setValues(self, index, values):
+        """
+        Sets consecutive values starting at a given channel index in a single 
+        slice assignment, padding the channels with 0.0 like setValue if need be.
+        """
+        values = array('d', values)
+        endIndex = index + len(values)
+        # pad value range if need be
+        if endIndex > len(self.values):
+            self.values.extend(array('d', [0.0]) * (endIndex - len(self.values)))
+        # mark the cached bounds of Groups depending on the changed channels as dirty
+        if self.boundsDependents is not None:
+            for curIndex, curValue in enumerate(values, index):
+                if self.values[curIndex] != curValue:
+                    dependents = self.boundsDependents.get(curIndex)
+                    if dependents is not None:
+                        for curGroup in dependents:
+                            curGroup.boundsDirty = True
+        self.values[index:endIndex] = values
+
+    def setNumValues(self, numValues):
+        """
+        Resizes the channel values to numValues, padding with 0.0 or truncating.
+        Setting the known number of channels up front avoids growing the values 
+        while they are being set.
+        """
+        if numValues > len(self.values):
+            self.values.extend(array('d', [0.0]) * (numValues - len(self.values)))
+        else:
+            del self.values[numValues:]
+
+    def setAllValues(self, values):
+        """
+        Replaces all channel values at once. Every cached bounds value depending 
+        on this ChannelData is invalidated.
+        """
+        self.values = array('d', values)
+        self.generation += 1
+
     def getValues(self, index, numElements):
         """
         Returns a single value from the channelData base
@@ -487,6 +1105,14 @@ class ChannelData:
             else:
                 xmlChannelData.attrib['ref'] = self.ref
 
+        if self.fileFormat != CHANNEL_FORMAT_XML:
+            xmlChannelData.attrib['format'] = self.fileFormat
+            xmlChannelData.attrib['precision'] = self.precision
+
+        if self.encoding != CHANNEL_ENCODING_ABSOLUTE:
+            xmlChannelData.attrib['encoding'] = self.encoding
+            xmlChannelData.attrib['deltaQuantum'] = repr(self.deltaQuantum)
+
     def readXMLData(self, xmlChannelData):
         """
         Read the Channel Data values from the in-memory XML representation  
@@ -496,23 +1122,48 @@ class ChannelData:
         self.startFrame = int(xmlChannelData.get('startFrame'))
         self.endFrame = int(xmlChannelData.get('endFrame'))
         self.ref = xmlChannelData.get('ref')
+        self.setFileFormat(xmlChannelData.get('format', CHANNEL_FORMAT_XML),
+                           xmlChannelData.get('precision', 'float64'))
+        self.setEncoding(xmlChannelData.get('encoding', CHANNEL_ENCODING_ABSOLUTE),
+                         float(xmlChannelData.get('deltaQuantum', CHANNEL_DELTA_QUANTUM)))
+
+    def getChannelFilePath(self, frameNumber):
+        """
+        Returns the path of the channel file for frameNumber, using 4 zero 
+        padding and an extension matching the channel file format. Channel 
+        archives use the same file for every frame.
+        """
+        if self.fileFormat == CHANNEL_FORMAT_BINARY:
+            return self.ref + ".chan.%04d.bin" % frameNumber
+        if self.fileFormat == CHANNEL_FORMAT_ARCHIVE:
+            return self.ref + ".chan.arc"
+        return self.ref + ".chan.%04d.xml" % frameNumber
 
     def writeXMLChannelFile(self, frameNumber, verbose=True):
         """
         Writes the in-memory XML representation using ElemenTree into a channel
         xml file. frameNumber will be used in the filename before the .xml 
-        extention using 4 zero padding.
+        extention using 4 zero padding. If the binary channel format is set,
+        the values are written as a packed binary channel file instead, or as 
+        a row of the channel archive if the archive format is set.
         """
-        filepath = self.ref + ".chan.%04d.xml" % frameNumber
+        if self.fileFormat == CHANNEL_FORMAT_BINARY:
+            return self.writeBinaryChannelFile(frameNumber, verbose)
+        if self.fileFormat == CHANNEL_FORMAT_ARCHIVE:
+            return self.writeArchiveChannelFrame(frameNumber, verbose)
+
+        filepath = self.getChannelFilePath(frameNumber)
         log.debug('\nwriting XML channel data to file %s' % filepath)
         dir = os.path.dirname(filepath)
         if not os.path.isdir(dir):
             os.makedirs(dir)
         xmlRoot = ET.Element('channels')
 
-        for curValue in self.values:
+        # delta encoded values are whole numbers of deltaQuantum
+        valueType = int if self.isDeltaFrame(frameNumber) else float
+        for curValue in self.getFileValues(frameNumber):
             xmlCurValue = ET.SubElement(xmlRoot, 'c')
-            xmlCurValue.attrib['v'] = str(float(curValue))
+            xmlCurValue.attrib['v'] = str(valueType(curValue))
 
         if verbose:
             print('Writing file "%s"...' % filepath)
@@ -525,25 +1176,535 @@ class ChannelData:
         Reads the contents of a channel xml file into the in-memory XML 
         representation using ElemenTree. frameNumber will be used in the 
         construction of the filename before the .xml extention using 4 zero 
-        padding.
+        padding. If the binary channel format is set, the values are read from 
+        a packed binary channel file instead, or from the matching row of the 
+        channel archive if the archive format is set.
         """
-        filepath = self.ref + ".chan.%04d.xml" % frameNumber
+        if self.isDeltaFrame(frameNumber):
+            self.setAllValues(self.decodeFileValues(frameNumber, self.readFileValues(frameNumber)))
+            return
+        if self.fileFormat == CHANNEL_FORMAT_BINARY:
+            self.readBinaryChannelFile(frameNumber)
+        elif self.fileFormat == CHANNEL_FORMAT_ARCHIVE:
+            self.setAllValues(self.readArchiveChannelFrame(frameNumber))
+        else:
+            for index, value in enumerate(self.readFileValues(frameNumber)):
+                self.setValue(index, value)
+        if self.encoding == CHANNEL_ENCODING_DELTA:
+            self.baseValues = array('d', self.values)
+            self.baseFrame = frameNumber
+
+    def readFileValues(self, frameNumber):
+        """
+        Returns the values stored in the channel file of frameNumber without 
+        decoding them, leaving the values of this ChannelData untouched.
+        """
+        if self.fileFormat == CHANNEL_FORMAT_BINARY:
+            return self._readBinaryFileValues(frameNumber)
+        if self.fileFormat == CHANNEL_FORMAT_ARCHIVE:
+            return self.readArchiveChannelFrame(frameNumber)
+
+        filepath = self.getChannelFilePath(frameNumber)
         log.debug('\nreading XML channel data file %s' % filepath)
         if not os.path.isfile(filepath):
             raise ValueError('File not found: "%s"' % filepath)
         xmlTree = ET.parse(filepath)
-        xmlRoot = xmlTree.getroot()
+        valueType = int if self.isDeltaFrame(frameNumber) else float
+        return [valueType(xmlCurValue.get('v')) for xmlCurValue in xmlTree.getroot()]
 
-        for index, xmlCurValue in enumerate(xmlRoot):
-            value = float(xmlCurValue.get('v'))
-            self.setValue(index, value)
+    def writeBinaryChannelFile(self, frameNumber, verbose=True):
+        """
+        Writes the channel values into a binary channel file: a small header 
+        followed by a little-endian float32 or float64 block holding all values,
+        or by the varints of a delta encoded frame.
+        """
+        filepath = self.getChannelFilePath(frameNumber)
+        log.debug('\nwriting binary channel data to file %s' % filepath)
+        dir = os.path.dirname(filepath)
+        if dir and not os.path.isdir(dir):
+            os.makedirs(dir)
+
+        fileValues = self.getFileValues(frameNumber)
+        numValues = len(fileValues)
+        if self.isDeltaFrame(frameNumber):
+            typeCode = CHANNEL_BINARY_VARINT_TYPECODE
+            data = encodeVarints(fileValues)
+        else:
+            typeCode = CHANNEL_BINARY_TYPECODES[self.precision]
+            data = struct.pack('<%d%s' % (numValues, typeCode), *fileValues)
+        header = CHANNEL_BINARY_HEADER.pack(CHANNEL_BINARY_MAGIC, CHANNEL_BINARY_VERSION,
+                                            typeCode.encode('ascii'), numValues)
+
+        if verbose:
+            print('Writing file "%s"...' % filepath)
+
+        with open(filepath, 'wb') as f:
+            f.write(header + data)
+
+    def readBinaryChannelFile(self, frameNumber):
+        """
+        Reads the values of a binary channel file in a single buffer read.
+        """
+        self.setAllValues(self._readBinaryFileValues(frameNumber))
+
+    def _readBinaryFileValues(self, frameNumber):
+        filepath = self.getChannelFilePath(frameNumber)
+        log.debug('\nreading binary channel data file %s' % filepath)
+        if not os.path.isfile(filepath):
+            raise ValueError('File not found: "%s"' % filepath)
+        with open(filepath, 'rb') as f:
+            buf = f.read()
+
+        if len(buf) < CHANNEL_BINARY_HEADER.size:
+            raise ValueError('Truncated binary channel file: "%s"' % filepath)
+        magic, version, typeCode, numValues = CHANNEL_BINARY_HEADER.unpack_from(buf, 0)
+        if magic != CHANNEL_BINARY_MAGIC:
+            raise ValueError('Not a binary channel file: "%s"' % filepath)
+        if version != CHANNEL_BINARY_VERSION:
+            raise ValueError('Unsupported binary channel file version %d: "%s"' % (version, filepath))
+
+        typeCode = typeCode.decode('ascii')
+        if typeCode == CHANNEL_BINARY_VARINT_TYPECODE:
+            return decodeVarints(buf, CHANNEL_BINARY_HEADER.size, numValues)
+        valueFormat = '<%d%s' % (numValues, typeCode)
+        if len(buf) < CHANNEL_BINARY_HEADER.size + struct.calcsize(valueFormat):
+            raise ValueError('Truncated binary channel file: "%s"' % filepath)
+        return list(struct.unpack_from(valueFormat, buf, CHANNEL_BINARY_HEADER.size))
+
+    def _createChannelArchive(self, filepath, numChannels):
+        """
+        Creates an empty channel archive sized for the whole frame range, with
+        every entry of the frame index table marked as not written yet.
+        """
+        typeCode = CHANNEL_BINARY_TYPECODES[self.precision]
+        numFrames = self.endFrame - self.startFrame + 1
+        header = CHANNEL_ARCHIVE_HEADER.pack(CHANNEL_ARCHIVE_MAGIC, CHANNEL_ARCHIVE_VERSION,
+                                             typeCode.encode('ascii'), numChannels,
+                                             self.startFrame, numFrames)
+        indexTable = b''.join(CHANNEL_ARCHIVE_INDEX_ENTRY.pack(self.startFrame + i, -1)
+                              for i in range(numFrames))
+        rowSize = numChannels * struct.calcsize('<' + typeCode)
+        with open(filepath, 'wb') as f:
+            f.write(header + indexTable)
+            f.truncate(len(header) + len(indexTable) + numFrames * rowSize)
+
+    def _readChannelArchiveHeader(self, buf, filepath):
+        """
+        Validates the header of a channel archive and returns its type code,
+        number of channels per row, start frame and number of frames.
+        """
+        if len(buf) < CHANNEL_ARCHIVE_HEADER.size:
+            raise ValueError('Truncated channel archive: "%s"' % filepath)
+        magic, version, typeCode, numChannels, startFrame, numFrames = \
+            CHANNEL_ARCHIVE_HEADER.unpack_from(buf, 0)
+        if magic != CHANNEL_ARCHIVE_MAGIC:
+            raise ValueError('Not a channel archive: "%s"' % filepath)
+        if version != CHANNEL_ARCHIVE_VERSION:
+            raise ValueError('Unsupported channel archive version %d: "%s"' % (version, filepath))
+        return typeCode.decode('ascii'), numChannels, startFrame, numFrames
+
+    def createChannelArchive(self, verbose=True):
+        """
+        Creates the channel archive, sized for the current number of values, 
+        unless it has already been created by this ChannelData.
+        """
+        if self._archiveCreated:
+            return
+        filepath = self.getChannelFilePath(self.startFrame)
+        self.closeChannelArchive()
+        dir = os.path.dirname(filepath)
+        if dir and not os.path.isdir(dir):
+            os.makedirs(dir)
+        self._createChannelArchive(filepath, len(self.values))
+        self._archiveCreated = True
+        if verbose:
+            print('Writing file "%s"...' % filepath)
+
+    def snapshot(self):
+        """
+        Returns a copy of this ChannelData holding a copy of the current values,
+        which can be written out while this ChannelData moves on to other frames.
+        """
+        channelSnapshot = ChannelData(self.startFrame, self.endFrame, self.ref,
+                                      fileFormat=self.fileFormat, precision=self.precision)
+        channelSnapshot.values = array('d', self.values)
+        channelSnapshot.relativeMode = self.relativeMode
+        channelSnapshot.encoding = self.encoding
+        channelSnapshot.baseValues = self.baseValues
+        channelSnapshot.baseFrame = self.baseFrame
+        channelSnapshot.deltaQuantum = self.deltaQuantum
+        channelSnapshot._archiveCreated = self._archiveCreated
+        return channelSnapshot
+
+    def writeArchiveChannelFrame(self, frameNumber, verbose=True):
+        """
+        Writes the channel values as the row for frameNumber in the channel 
+        archive. The archive is created on the first frame written by this 
+        ChannelData, after which every frame must hold the same number of values.
+        """
+        filepath = self.getChannelFilePath(frameNumber)
+        log.debug('\nwriting frame %d to channel archive %s' % (frameNumber, filepath))
+        if self.startFrame is None or self.endFrame is None:
+            raise ValueError('Frame range not set when writing channel archive')
+        if frameNumber < self.startFrame or frameNumber > self.endFrame:
+            raise ValueError('Frame %d outside of channel archive range %d-%d'
+                             % (frameNumber, self.startFrame, self.endFrame))
+
+        self.createChannelArchive(verbose)
+
+        with open(filepath, 'r+b') as f:
+            buf = f.read(CHANNEL_ARCHIVE_HEADER.size)
+            typeCode, numChannels, startFrame, numFrames = self._readChannelArchiveHeader(buf, filepath)
+            if len(self.values) != numChannels:
+                raise ValueError('Frame %d has %d channels but channel archive "%s" holds %d'
+                                 % (frameNumber, len(self.values), filepath, numChannels))
+            slot = frameNumber - startFrame
+            rowSize = numChannels * struct.calcsize('<' + typeCode)
+            rowOffset = (CHANNEL_ARCHIVE_HEADER.size + numFrames * CHANNEL_ARCHIVE_INDEX_ENTRY.size
+                         + slot * rowSize)
+            f.seek(rowOffset)
+            f.write(struct.pack('<%d%s' % (numChannels, typeCode), *self.getFileValues(frameNumber)))
+            f.seek(CHANNEL_ARCHIVE_HEADER.size + slot * CHANNEL_ARCHIVE_INDEX_ENTRY.size)
+            f.write(CHANNEL_ARCHIVE_INDEX_ENTRY.pack(frameNumber, rowOffset))
+
+    def _getChannelArchiveMap(self, filepath):
+        """
+        Returns a read-only memory map of the channel archive, re-mapping it if 
+        the file has changed on disk since it was last mapped.
+        """
+        if not os.path.isfile(filepath):
+            raise ValueError('File not found: "%s"' % filepath)
+        fileStat = os.stat(filepath)
+        curStat = (filepath, fileStat.st_mtime, fileStat.st_size)
+        if self._archiveMap is None or self._archiveStat != curStat:
+            self.closeChannelArchive()
+            self._archiveFile = open(filepath, 'rb')
+            self._archiveMap = mmap.mmap(self._archiveFile.fileno(), 0, access=mmap.ACCESS_READ)
+            self._archiveStat = curStat
+        return self._archiveMap
+
+    def readArchiveChannelFrame(self, frameNumber, index=0, numElements=None):
+        """
+        Returns the values of frameNumber from the channel archive, optionally 
+        restricted to numElements channels starting at index. The archive is 
+        memory-mapped, so only the pages holding the requested values are read.
+        """
+        filepath = self.getChannelFilePath(frameNumber)
+        log.debug('\nreading frame %d from channel archive %s' % (frameNumber, filepath))
+        archiveMap = self._getChannelArchiveMap(filepath)
+        typeCode, numChannels, startFrame, numFrames = self._readChannelArchiveHeader(archiveMap, filepath)
+
+        slot = frameNumber - startFrame
+        if slot < 0 or slot >= numFrames:
+            raise ValueError('Frame %d not in channel archive "%s"' % (frameNumber, filepath))
+        entryFrame, rowOffset = CHANNEL_ARCHIVE_INDEX_ENTRY.unpack_from(
+            archiveMap, CHANNEL_ARCHIVE_HEADER.size + slot * CHANNEL_ARCHIVE_INDEX_ENTRY.size)
+        if entryFrame != frameNumber or rowOffset < 0:
+            raise ValueError('Frame %d not written to channel archive "%s"' % (frameNumber, filepath))
+
+        if numElements is None:
+            numElements = numChannels - index
+        if index < 0 or numElements < 0 or index + numElements > numChannels:
+            raise ValueError('Channels %d-%d out of range of channel archive "%s"'
+                             % (index, index + numElements - 1, filepath))
+        itemSize = struct.calcsize('<' + typeCode)
+        return list(struct.unpack_from('<%d%s' % (numElements, typeCode), archiveMap,
+                                       rowOffset + index * itemSize))
+
+    def readChannelRange(self, startFrame=None, endFrame=None, channels=None, numThreads=4):
+        """
+        Reads the channel files of a frame range, the whole range of this 
+        ChannelData by default, and returns a ChannelMatrix holding one row of
+        values per frame. channels optionally restricts the columns to a list 
+        of channel indices. Files are read on numThreads threads, each with its
+        own reader, so the values of this ChannelData are left untouched.
+        """
+        if startFrame is None:
+            startFrame = self.startFrame
+        if endFrame is None:
+            endFrame = self.endFrame
+        if startFrame is None or endFrame is None or endFrame < startFrame:
+            raise ValueError('Invalid frame range %s-%s when reading channel range' % (startFrame, endFrame))
+
+        # the first frame read gives the number of channels before the rest are
+        # read concurrently. Delta encoded frames are read as they are stored and
+        # added up once every row has been read
+        firstReader = self.snapshot()
+        firstReader.readXMLChannelFile(startFrame)
+        numValues = len(firstReader.values)
+        deltaRows = self.encoding == CHANNEL_ENCODING_DELTA
+
+        if channels is None:
+            channels = list(range(numValues))
+        else:
+            channels = [int(curChannel) for curChannel in channels]
+            for curChannel in channels:
+                if curChannel < 0 or curChannel >= numValues:
+                    raise ValueError('Channel %d out of range when reading channel range, %d channels found'
+                                     % (curChannel, numValues))
+        allChannels = channels == list(range(numValues))
+
+        matrix = ChannelMatrix(list(range(startFrame, endFrame + 1)), channels)
+        numChannels = len(channels)
+        errors = {}
+
+        def storeRow(values, frameNumber):
+            if len(values) < numValues:
+                raise ValueError('Frame %d has %d channels, %d expected when reading channel range'
+                                 % (frameNumber, len(values), numValues))
+            row = (frameNumber - startFrame) * numChannels
+            if allChannels:
+                matrix.values[row:row + numChannels] = values[:numChannels]
+            else:
+                matrix.values[row:row + numChannels] = array('d', [values[curChannel] for curChannel in channels])
+
+        def readFrames(reader, frameQueue):
+            while True:
+                try:
+                    frameNumber = frameQueue.get_nowait()
+                except queue.Empty:
+                    break
+                try:
+                    if deltaRows:
+                        storeRow(array('d', reader.readFileValues(frameNumber)), frameNumber)
+                    else:
+                        reader.readXMLChannelFile(frameNumber)
+                        storeRow(reader.values, frameNumber)
+                except Exception as e:
+                    log.debug('error reading channel file for frame %d: %s' % (frameNumber, e))
+                    errors[frameNumber] = e
+            reader.closeChannelArchive()
+
+        frameQueue = queue.Queue()
+        for frameNumber in range(startFrame + 1, endFrame + 1):
+            frameQueue.put(frameNumber)
+        try:
+            storeRow(firstReader.values, startFrame)
+            threads = []
+            for threadIndex in range(min(numThreads, endFrame - startFrame)):
+                reader = firstReader.snapshot()
+                curThread = threading.Thread(target=readFrames, args=(reader, frameQueue),
+                                             name='ChannelRangeReader-%d' % threadIndex)
+                curThread.daemon = True
+                curThread.start()
+                threads.append(curThread)
+            for curThread in threads:
+                curThread.join()
+            # read whatever is left synchronously when no threads are used
+            readFrames(firstReader, frameQueue)
+        finally:
+            firstReader.closeChannelArchive()
+
+        if errors:
+            raise errors[min(errors)]
+        if deltaRows:
+            values = matrix.values
+            deltaQuantum = self.deltaQuantum
+            for index in range(numChannels, len(values)):
+                values[index] = values[index - numChannels] + values[index] * deltaQuantum
+        return matrix
+
+    def estimateChannelFiles(self, numValues=None):
+        """
+        Returns the number of channel files written for the frame range and 
+        an estimate of their total size in bytes, for numValues channels (the 
+        current number of values by default). Binary and archive sizes are 
+        exact for absolute values, XML sizes assume CHANNEL_XML_VALUE_CHARS 
+        characters per value. With delta encoding every frame is counted as 
+        absolute values, which the quantised deltas normally undercut.
+        """
+        if self.isStatic():
+            return 0, 0
+        if numValues is None:
+            numValues = len(self.values)
+        numFrames = self.endFrame - self.startFrame + 1
+        if self.fileFormat == CHANNEL_FORMAT_XML:
+            frameBytes = len('<channels></channels>') + numValues * (len('<c v="" />') + CHANNEL_XML_VALUE_CHARS)
+            return numFrames, numFrames * frameBytes
+        valueBytes = struct.calcsize('<' + CHANNEL_BINARY_TYPECODES[self.precision])
+        if self.fileFormat == CHANNEL_FORMAT_BINARY:
+            return numFrames, numFrames * (CHANNEL_BINARY_HEADER.size + numValues * valueBytes)
+        return 1, (CHANNEL_ARCHIVE_HEADER.size +
+                   numFrames * (CHANNEL_ARCHIVE_INDEX_ENTRY.size + numValues * valueBytes))
+
+    def closeChannelArchive(self):
+        """
+        Releases the memory map held on the channel archive, if any.
+        """
+        if getattr(self, '_archiveMap', None) is not None:
+            self._archiveMap.close()
+            self._archiveFile.close()
+        self._archiveMap = None
+        self._archiveFile = None
+        self._archiveStat = None
 
 
-class ScenegraphElement:
+class ChannelMatrix(object):
     """
-    Base class used by Group, ScenegraphRoot and Reference classes
+    Values of a set of channels over a range of frames, held row-major in a 
+    single contiguous array of doubles with one row per frame and one column 
+    per channel.
     """
 
+    __slots__ = ('frames', 'channels', 'values', '_rows', '_columns')
+
+    def __init__(self, frames, channels, values=None):
+        self.frames = list(frames)
+        self.channels = list(channels)
+        if values is None:
+            values = array('d', [0.0]) * (len(self.frames) * len(self.channels))
+        elif len(values) != len(self.frames) * len(self.channels):
+            raise ValueError('ChannelMatrix needs %d values, %d given'
+                             % (len(self.frames) * len(self.channels), len(values)))
+        self.values = array('d', values)
+        self._rows = dict((frameNumber, row) for row, frameNumber in enumerate(self.frames))
+        self._columns = dict((channelIndex, column) for column, channelIndex in enumerate(self.channels))
+
+    def getNumFrames(self):
+        return len(self.frames)
+
+    def getNumChannels(self):
+        return len(self.channels)
+
+    def _getRow(self, frameNumber):
+        if frameNumber not in self._rows:
+            raise ValueError('Frame %s not in ChannelMatrix' % frameNumber)
+        return self._rows[frameNumber]
+
+    def _getColumn(self, channelIndex):
+        if channelIndex not in self._columns:
+            raise ValueError('Channel %s not in ChannelMatrix' % channelIndex)
+        return self._columns[channelIndex]
+
+    def getValue(self, frameNumber, channelIndex):
+        return self.values[self._getRow(frameNumber) * len(self.channels) + self._getColumn(channelIndex)]
+
+    def getFrameValues(self, frameNumber):
+        """
+        Returns the values of every channel of the matrix at frameNumber.
+        """
+        row = self._getRow(frameNumber) * len(self.channels)
+        return self.values[row:row + len(self.channels)]
+
+    def getChannelValues(self, channelIndex, numElements=1):
+        """
+        Returns the curve of a channel over the frames of the matrix. If 
+        numElements is more than 1, each frame holds the values of numElements 
+        consecutive channels, e.g. 16 for an Xform or 6 for a Bounds.
+        """
+        numChannels = len(self.channels)
+        columns = [self._getColumn(channelIndex + i) for i in range(numElements)]
+        if numElements == 1:
+            return self.values[columns[0]::numChannels]
+        return [array('d', [self.values[row + column] for column in columns])
+                for row in range(0, len(self.values), numChannels)]
+
+    def toNumpy(self):
+        """
+        Returns the values as a (frames, channels) NumPy array sharing the 
+        memory of this matrix.
+        """
+        if numpy is None:
+            raise ValueError('NumPy is not available to convert ChannelMatrix')
+        return numpy.frombuffer(self.values, dtype=numpy.float64).reshape(len(self.frames), len(self.channels))
+
+
+class ChannelFileWriter(object):
+    """
+    Writes channel files on a pool of background threads, so that encoding and
+    writing a frame overlaps with preparing the next one. At most maxPending 
+    frames are queued; submit blocks once that many are waiting, which bounds 
+    memory use. Errors are collected and raised by close(), always reporting 
+    the failure of the lowest frame number so exports fail deterministically.
+    With numThreads set to 0 the files are written synchronously by submit.
+    Channel directories are created and progress is printed by submit, on the
+    calling thread; the writer threads only write files.
+    """
+
+    def __init__(self, numThreads=4, maxPending=8, verbose=True):
+        self.numThreads = numThreads
+        self.verbose = verbose
+        self.errors = {}
+        # channel directories known to exist
+        self._channelDirs = set()
+        self._errorsLock = threading.Lock()
+        self._queue = queue.Queue(maxsize=max(maxPending, 1))
+        self._threads = []
+        for threadIndex in range(numThreads):
+            curThread = threading.Thread(target=self._writeFrames,
+                                         name='ChannelFileWriter-%d' % threadIndex)
+            curThread.daemon = True
+            curThread.start()
+            self._threads.append(curThread)
+
+    def _writeFrames(self):
+        while True:
+            task = self._queue.get()
+            try:
+                if task is None:
+                    return
+                channelSnapshot, frameNumber = task
+                self._writeFrame(channelSnapshot, frameNumber, verbose=False)
+            finally:
+                self._queue.task_done()
+
+    def _writeFrame(self, channelData, frameNumber, verbose):
+        try:
+            channelData.writeXMLChannelFile(frameNumber, verbose)
+        except Exception as e:
+            log.debug('error writing channel file for frame %d: %s' % (frameNumber, e))
+            with self._errorsLock:
+                self.errors[frameNumber] = e
+
+    def submit(self, channelData, frameNumber):
+        """
+        Queues the current values of channelData to be written as the channel 
+        file for frameNumber. Stops and raises the first error, by frame number,
+        if any frame has failed to write.
+        """
+        if self.errors:
+            self.close()
+        filepath = channelData.getChannelFilePath(frameNumber)
+        channelDir = os.path.dirname(filepath)
+        if channelDir and channelDir not in self._channelDirs:
+            # create the directory once here rather than racing in the writer threads
+            if not os.path.isdir(channelDir):
+                os.makedirs(channelDir)
+            self._channelDirs.add(channelDir)
+        if channelData.fileFormat == CHANNEL_FORMAT_ARCHIVE:
+            # create the archive before handing frames over to concurrent writers
+            channelData.createChannelArchive(self.verbose)
+        if not self._threads:
+            self._writeFrame(channelData, frameNumber, self.verbose)
+            return
+        if self.verbose and channelData.fileFormat != CHANNEL_FORMAT_ARCHIVE:
+            print('Writing file "%s"...' % filepath)
+        self._queue.put((channelData.snapshot(), frameNumber))
+
+    def close(self, raiseErrors=True):
+        """
+        Waits for all queued frames to be written and stops the writer threads. 
+        If any frame failed to write, the error of the lowest frame number is 
+        raised.
+        """
+        for curThread in self._threads:
+            self._queue.put(None)
+        for curThread in self._threads:
+            curThread.join()
+        self._threads = []
+        if raiseErrors and self.errors:
+            raise self.errors[min(self.errors)]
+
+
+class ScenegraphElement(object):
+    """
+    Base class used by Group, ScenegraphRoot and Reference classes. Scenegraph 
+    elements use __slots__ to keep large hierarchies compact in memory.
+    """
+
+    __slots__ = ('name', 'elemType', 'xform', 'bounds', 'proxyList', 'arbitraryList',
+                 'lodData', 'lookFile', 'attributeFile')
+
     def __init__(self, name=None, elemType=None, xform=None, bounds=None, proxyList=None, arbitraryList=None, lodData=None, lookFile=None, attributeFile=None):
         self.name = name
         self.elemType = elemType
@@ -576,6 +1737,40 @@ class ScenegraphElement:
         else:
             return self.bounds.getValue(channelData)
 
+    def getBoundsChannels(self, boundsDependents):
+        """
+        Returns the set of channel indices the value returned by getBounds 
+        depends on. Groups auto calculating their bounds also register 
+        themselves in boundsDependents against each of those indices.
+        """
+        if self.bounds is None or self.bounds.channelIndex is None:
+            return set()
+        return set(range(self.bounds.channelIndex, self.bounds.channelIndex + 6))
+
+    def getChannelUsers(self):
+        """
+        Returns the data objects of this element (Xform, Bounds, LodData, ...)
+        that read their values from channels.
+        """
+        channelUsers = []
+        for curData in (self.xform, self.bounds, self.lodData, self.lookFile, self.attributeFile):
+            if curData is not None and curData.channelIndex is not None:
+                channelUsers.append(curData)
+        if self.arbitraryList is not None:
+            for curAttribute in self.arbitraryList:
+                if curAttribute.channelIndex is not None:
+                    channelUsers.append(curAttribute)
+        return channelUsers
+
+    def getXformChannels(self):
+        """
+        Returns the set of channel indices the value returned by getXform 
+        depends on.
+        """
+        if self.xform is None or self.xform.channelIndex is None:
+            return set()
+        return set(range(self.xform.channelIndex, self.xform.channelIndex + 16))
+
     def setXform(self, value=None, channelIndex=None):
         """
         Sets a Transform's values. 
@@ -678,7 +1873,7 @@ class ScenegraphElement:
             self.xform = Xform()
             self.xform.readXMLData(xmlXform)
         else:
-            self.xfrom = None
+            self.xform = None
 
         xmlLodData = xmlElement.find('lodData')
         if xmlLodData is not None:
@@ -728,12 +1923,20 @@ class Group(ScenegraphElement):
     node type. 
     """
 
+    __slots__ = ('instanceList', 'groupType', 'boundsAutoCalc', 'boundsChannels', 'boundsDirty',
+                 'cachedBounds', 'cachedBoundsGeneration')
+
     def __init__(self, name=None, instanceList=None, groupType=None, xform=None, bounds=None, proxyList=None, arbitraryList=None, lodData=None):
         ScenegraphElement.__init__(self, name=name, xform=xform, bounds=bounds, proxyList=proxyList, arbitraryList=arbitraryList, lodData=lodData)
         self.instanceList = instanceList
         self.elemType = 'group'
         self.groupType = groupType
         self.boundsAutoCalc = True
+        # bounds cache state, used while bounds caching is enabled on the ScenegraphRoot
+        self.boundsChannels = None
+        self.boundsDirty = True
+        self.cachedBounds = None
+        self.cachedBoundsGeneration = None
 
     def setInstanceList(self, instanceList):
         self.instanceList = instanceList
@@ -747,44 +1950,100 @@ class Group(ScenegraphElement):
         for curInstance in newInstances:
             self.addInstance(curInstance)
 
+    def getBoundsChannels(self, boundsDependents):
+        if not self.boundsAutoCalc:
+            return ScenegraphElement.getBoundsChannels(self, boundsDependents)
+
+        # the calculated bounds depend on the bounds and Xforms of all instances
+        self.boundsChannels = set()
+        if self.instanceList is not None:
+            for curInstance in self.instanceList:
+                self.boundsChannels.update(curInstance.getBoundsChannels(boundsDependents))
+                self.boundsChannels.update(curInstance.getXformChannels())
+        for channelIndex in self.boundsChannels:
+            boundsDependents.setdefault(channelIndex, []).append(self)
+        self.boundsDirty = True
+        self.cachedBounds = None
+        return self.boundsChannels
+
+    def clearBoundsCache(self):
+        """
+        Disables bounds caching on this Group and the Groups below it.
+        """
+        self.boundsChannels = None
+        self.cachedBounds = None
+        self.boundsDirty = True
+        if self.instanceList is not None:
+            for curInstance in self.instanceList:
+                if isinstance(curInstance, Group):
+                    curInstance.clearBoundsCache()
+
     def getBounds(self, channelData=None):
         if self.instanceList is None:
             return None
 
+        # return the cached bounds if none of the channels they depend on have changed
+        if self.boundsAutoCalc and self.boundsChannels is not None and not self.boundsDirty and \
+           channelData is not None and self.cachedBoundsGeneration == channelData.generation:
+            if self.cachedBounds is None:
+                return None
+            if self.bounds is not None:
+                self.bounds.setValue(self.cachedBounds[:], channelData)
+            return self.cachedBounds[:]
+
         # returns the bounds for a group node, calculating it from the instances in the
         # instanceList if we're using BoundsAutoCalc on this node. Note: 'None' is
         # returned if there aren't any valid bounds                
         if self.boundsAutoCalc:            
             calculatedBounds = None
+            instanceBoundsList = []
+            xforms = []
+            xformedBoundsList = []
             for curInstance in self.instanceList:
                 # get current values for Xform and Bounds
                 curInstanceBounds = curInstance.getBounds(channelData)
 
                 if curInstanceBounds is not None:
                     curInstanceXform = curInstance.getXform(channelData)
-                    # if wen have an Xform, apply Xform to Bounds
+                    # if wen have an Xform, queue the Bounds to have the Xform applied
                     if curInstanceXform is not None:
-                        curInstanceBounds = applyXformToBounds(curInstanceXform, curInstanceBounds)
-                    # if this is the first valid bounds value, we set curBounds to it
-                    if calculatedBounds is None:
-                        calculatedBounds = curInstanceBounds[:]
-                    # otherwise we compare it with the existing value to see if it extends the bounds
+                        xforms.append(curInstanceXform)
+                        xformedBoundsList.append(curInstanceBounds)
                     else:
-                        if curInstanceBounds[0] < calculatedBounds[0]:
-                            calculatedBounds[0] = curInstanceBounds[0]
-                        if curInstanceBounds[1] > calculatedBounds[1]:
-                            calculatedBounds[1] = curInstanceBounds[1]
-                        if curInstanceBounds[2] < calculatedBounds[2]:
-                            calculatedBounds[2] = curInstanceBounds[2]
-                        if curInstanceBounds[3] > calculatedBounds[3]:
-                            calculatedBounds[3] = curInstanceBounds[3]
-                        if curInstanceBounds[4] < calculatedBounds[4]:
-                            calculatedBounds[4] = curInstanceBounds[4]
-                        if curInstanceBounds[5] > calculatedBounds[5]:
-                            calculatedBounds[5] = curInstanceBounds[5]
+                        instanceBoundsList.append(curInstanceBounds)
+            # apply all the Xforms to their Bounds in a single batch
+            if xforms:
+                instanceBoundsList.extend(applyXformsToBounds(xforms, xformedBoundsList))
+
+            for curInstanceBounds in instanceBoundsList:
+                # if this is the first valid bounds value, we set curBounds to it
+                if calculatedBounds is None:
+                    calculatedBounds = list(curInstanceBounds)
+                # otherwise we compare it with the existing value to see if it extends the bounds
+                else:
+                    if curInstanceBounds[0] < calculatedBounds[0]:
+                        calculatedBounds[0] = curInstanceBounds[0]
+                    if curInstanceBounds[1] > calculatedBounds[1]:
+                        calculatedBounds[1] = curInstanceBounds[1]
+                    if curInstanceBounds[2] < calculatedBounds[2]:
+                        calculatedBounds[2] = curInstanceBounds[2]
+                    if curInstanceBounds[3] > calculatedBounds[3]:
+                        calculatedBounds[3] = curInstanceBounds[3]
+                    if curInstanceBounds[4] < calculatedBounds[4]:
+                        calculatedBounds[4] = curInstanceBounds[4]
+                    if curInstanceBounds[5] > calculatedBounds[5]:
+                        calculatedBounds[5] = curInstanceBounds[5]
             # check if this node has bounds for export, in which case store the calculated curBounds 
             if self.bounds is not None and calculatedBounds is not None:
                 self.bounds.setValue(calculatedBounds, channelData)
+            # store the calculated bounds in the cache if bounds caching is enabled
+            if self.boundsChannels is not None and channelData is not None:
+                if calculatedBounds is None:
+                    self.cachedBounds = None
+                else:
+                    self.cachedBounds = calculatedBounds[:]
+                self.cachedBoundsGeneration = channelData.generation
+                self.boundsDirty = False
             # return the calculated bounds value
             return calculatedBounds
         else:
@@ -795,6 +2054,17 @@ class Group(ScenegraphElement):
                 return self.bounds.getValue(channelData)
         
     def writeXMLData(self, sgElement, xmlElement, channelMapping=None, channelData=None):
+        xmlInstanceList = self.writeXMLElementData(sgElement, xmlElement, channelMapping, channelData)
+        if self.instanceList is not None:
+            for curInstance in self.instanceList:
+                xmlCurInstance = ET.SubElement(xmlInstanceList, 'instance')
+                curInstance.writeXMLData(curInstance, xmlCurInstance, channelMapping, channelData)
+
+    def writeXMLElementData(self, sgElement, xmlElement, channelMapping=None, channelData=None):
+        """
+        Writes the data of this Group without its instances and returns the 
+        (still empty) instanceList XML element the instances belong in.
+        """
         if channelMapping is not None:
             if sgElement in channelMapping.keys():
                 channelNo = channelMapping[sgElement]
@@ -809,11 +2079,7 @@ class Group(ScenegraphElement):
         if self.groupType is not None:
             xmlElement.attrib['groupType'] = self.groupType
 
-        xmlInstanceList = ET.SubElement(xmlElement, 'instanceList')
-        if self.instanceList is not None:
-            for curInstance in self.instanceList:
-                xmlCurInstance = ET.SubElement(xmlInstanceList, 'instance')
-                curInstance.writeXMLData(curInstance, xmlCurInstance, channelMapping, channelData)
+        return ET.SubElement(xmlElement, 'instanceList')
 
     def readXMLData(self, xmlElement):
         log.debug('calling Group.readXMLData')
@@ -830,12 +2096,61 @@ class Group(ScenegraphElement):
             self.instanceList.append(curInstance)
 
 
+class LazyGroup(Group):
+    """
+    Represents a Group node read by the lazy reader. Its instances are only read
+    from the scenegraphXML file, and instantiated, the first time instanceList 
+    is accessed.
+    """
+
+    __slots__ = ('filepath', 'instancePath', 'fileIndex', '_instanceList', '_instancesLoaded')
+
+    def __init__(self, name=None, filepath=None, instancePath=(), groupType=None, fileIndex=None):
+        Group.__init__(self, name=name, groupType=groupType)
+        self.filepath = filepath
+        self.instancePath = instancePath
+        # LazyFileIndex shared by the LazyGroups of the file, if any
+        self.fileIndex = fileIndex
+        self._instancesLoaded = filepath is None
+
+    def getInstanceList(self):
+        if not self._instancesLoaded:
+            if self.fileIndex is not None:
+                self._instanceList = self.fileIndex.readInstanceList(self.instancePath)
+            else:
+                self._instanceList = readLazyInstanceList(self.filepath, self.instancePath)
+            self._instancesLoaded = True
+        return self._instanceList
+
+    def setInstanceList(self, instanceList):
+        self._instanceList = instanceList
+        self._instancesLoaded = True
+
+    instanceList = property(getInstanceList, setInstanceList)
+
+    def isLoaded(self):
+        return self._instancesLoaded
+
+    def readXMLData(self, xmlElement):
+        log.debug('calling LazyGroup.readXMLData')
+        self.readXMLCommonData(xmlElement)
+
+        self.groupType = xmlElement.get('groupType')
+
+        if xmlElement.find('instanceList') is None:
+            raise ValueError('Cannot find XML element "instanceList" when reading XML data for Group')
+        if self.filepath is not None:
+            self._instancesLoaded = False
+
+
 class Reference(ScenegraphElement):
     """
     Represents a Reference node. A Reference points to another xml file containing
     some sub-SceneGraph.  
     """
 
+    __slots__ = ('refFile', 'refType', 'groupType')
+
     def __init__(self, name=None, refFile=None, refType='xml', xform=None, bounds=None, proxyList=None, 
                  arbitraryList=None, lodData=None, lookFile=None, attributeFile=None, groupType=None):
         ScenegraphElement.__init__(self, name=name, xform=xform, bounds=bounds, proxyList=proxyList, arbitraryList=arbitraryList, lodData=lodData, lookFile=lookFile, attributeFile=attributeFile)
@@ -855,6 +2170,13 @@ class Reference(ScenegraphElement):
         self.refType = refType
         
     def writeXMLData(self, sgElement, xmlElement, channelMapping=None, channelData=None):      
+        self.writeXMLElementData(sgElement, xmlElement, channelMapping, channelData)
+
+    def writeXMLElementData(self, sgElement, xmlElement, channelMapping=None, channelData=None):
+        """
+        Writes the data of this Reference. References have no instances, so 
+        None is returned in place of an instanceList XML element.
+        """
         if channelMapping is not None:
             if sgElement in channelMapping.keys():
                 channelNo = channelMapping[sgElement]
@@ -877,6 +2199,8 @@ class Reference(ScenegraphElement):
         if self.groupType is not None:
             xmlElement.attrib['groupType'] = self.groupType
 
+        return None
+
     def readXMLData(self, xmlElement):
         log.debug('calling Reference.readXMLData')
         self.readXMLCommonData(xmlElement)
@@ -888,27 +2212,419 @@ class Reference(ScenegraphElement):
             raise ValueError('Cannot find XML attribute "refFile" when reading XMl data for Reference')
 
 
+def escapeXMLAttribute(value):
+    """
+    Escapes an attribute value exactly as ElementTree does when writing files.
+    """
+    if sys.version_info[0] < 3:
+        # Python 2 escapes and encodes in one go, using the default us-ascii encoding
+        return ET._escape_attrib(value, 'us-ascii')
+    return ET._escape_attrib(value)
+
+
+class XMLStreamWriter(object):
+    """
+    Writes scenegraphXML data to a file object incrementally. Each scenegraph 
+    element only has its own data converted to a shallow XML element, which is 
+    written out before moving on to its instances, so memory use is bounded by
+    the depth of the hierarchy rather than its size. Output is byte-identical 
+    to ElementTree's.
+    """
+
+    def __init__(self, fileObj, channelMapping=None, channelData=None):
+        self.fileObj = fileObj
+        self.channelMapping = channelMapping
+        self.channelData = channelData
+
+    def write(self, text):
+        self.fileObj.write(text.encode('ascii', 'xmlcharrefreplace'))
+
+    def writeStartTag(self, xmlElement, empty=False):
+        self.write('<' + xmlElement.tag)
+        items = list(xmlElement.items())
+        if SG_XML_SORT_ATTRIBUTES:
+            items.sort()
+        for key, value in items:
+            self.write(' %s="%s"' % (key, escapeXMLAttribute(value)))
+        if empty:
+            self.write(' />')
+        else:
+            self.write('>')
+
+    def writeElement(self, xmlElement, xmlInstanceList=None, instanceList=None):
+        """
+        Writes xmlElement and its XML children. If xmlInstanceList is one of 
+        those children, the scenegraph elements in instanceList are streamed 
+        into it in place of its XML content.
+        """
+        if len(xmlElement) == 0:
+            self.writeStartTag(xmlElement, empty=True)
+            return
+
+        self.writeStartTag(xmlElement)
+        for xmlChild in xmlElement:
+            if xmlChild is xmlInstanceList:
+                self.writeInstanceList(xmlChild, instanceList)
+            else:
+                self.writeElement(xmlChild)
+        self.write('</%s>' % xmlElement.tag)
+
+    def writeInstanceList(self, xmlInstanceList, instanceList):
+        if not instanceList:
+            self.writeElement(xmlInstanceList)
+            return
+
+        self.writeStartTag(xmlInstanceList)
+        for curInstance in instanceList:
+            xmlCurInstance = ET.Element('instance')
+            xmlCurInstanceList = curInstance.writeXMLElementData(curInstance, xmlCurInstance,
+                                                                 self.channelMapping, self.channelData)
+            self.writeElement(xmlCurInstance, xmlCurInstanceList, getattr(curInstance, 'instanceList', None))
+        self.write('</%s>' % xmlInstanceList.tag)
+
+
+class ByteCounter(object):
+    """
+    File-like object counting the bytes written to it instead of storing them.
+    """
+
+    def __init__(self):
+        self.numBytes = 0
+
+    def write(self, data):
+        self.numBytes += len(data)
+
+
+class ScenegraphCache(object):
+    """
+    Thread-safe LRU cache of parsed scenegraphXML files, keyed by absolute file
+    path. Each entry remembers the mtime and size of its file and is dropped 
+    as soon as either changes. Least recently used entries are evicted once the
+    estimated memory used by all entries exceeds maxBytes.
+
+    Only the parsed XML elements are cached, which are never modified. Each 
+    ScenegraphRoot read through the cache builds its own instances and 
+    ChannelData from them, so roots don't share any mutable state.
+    """
+
+    __slots__ = ('maxBytes', 'numBytes', 'hits', 'misses', '_entries', '_lock')
+
+    def __init__(self, maxBytes=SG_XML_CACHE_MAX_BYTES):
+        self.maxBytes = maxBytes
+        self.numBytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def setMaxBytes(self, maxBytes):
+        with self._lock:
+            self.maxBytes = maxBytes
+            self._evict()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.numBytes = 0
+
+    def invalidate(self, filepath):
+        """
+        Drops the entry of a file from the cache, if any.
+        """
+        with self._lock:
+            self._remove(os.path.abspath(filepath))
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.numBytes -= entry[2]
+
+    def _evict(self):
+        while self.numBytes > self.maxBytes and self._entries:
+            key = next(iter(self._entries))
+            log.debug('evicting "%s" from scenegraphXML read cache' % key)
+            self._remove(key)
+
+    def read(self, filepath):
+        """
+        Returns the XML channelData element (or None) and the XML instanceList
+        element of a scenegraphXML file, parsing the file only if it isn't 
+        cached or has changed since it was cached.
+        """
+        if not os.path.isfile(filepath):
+            raise ValueError('File not found: "%s"' % filepath)
+        key = os.path.abspath(filepath)
+        fileStat = os.stat(key)
+        signature = (fileStat.st_mtime, fileStat.st_size)
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] == signature:
+                    # mark as most recently used
+                    del self._entries[key]
+                    self._entries[key] = entry
+                    self.hits += 1
+                    return entry[1]
+                self._remove(key)
+            self.misses += 1
+
+        # parse outside the lock so other files can be read concurrently
+        parsedData = parseXMLTree(key)
+        numBytes = fileStat.st_size * SG_XML_CACHE_SIZE_FACTOR
+        with self._lock:
+            self._remove(key)
+            if numBytes <= self.maxBytes:
+                self._entries[key] = (signature, parsedData, numBytes)
+                self.numBytes += numBytes
+                self._evict()
+        return parsedData
+
+
+# Process-wide cache used by ScenegraphRoot.readXMLFile
+readCache = ScenegraphCache()
+
+
+def parseXMLTree(filepath):
+    """
+    Parses a scenegraphXML file and returns its XML channelData element (or 
+    None if it has none) and its XML instanceList element.
+    """
+    log.debug('\nreading XML file %s' % filepath)
+    if not os.path.isfile(filepath):
+        raise ValueError('File not found: "%s"' % filepath)
+    xmlTree = ET.parse(filepath)
+    xmlRoot = xmlTree.getroot()
+    fileVersion = xmlRoot.get('version')
+    if fileVersion != __version__:
+        print('WARNING: XML file version does not match')
+
+    xmlChannelData = xmlRoot.find('channelData')
+
+    xmlInstanceList = xmlRoot.find('instanceList')
+    if xmlInstanceList is None:
+        raise ValueError('Cannot find XML element "instanceList" when reading XML data for ScenegraphRoot')
+    return xmlChannelData, xmlInstanceList
+
+
+def parseXMLFile(filepath):
+    """
+    Parses a scenegraphXML file and returns its XML channelData element (or 
+    None if it has none) and its list of instances.
+    """
+    xmlChannelData, xmlInstanceList = parseXMLTree(filepath)
+    return xmlChannelData, createInstanceList(xmlInstanceList)
+
+
+def createInstanceList(xmlInstanceList):
+    """
+    Returns a list of new scenegraph elements built from the children of an
+    XML instanceList element.
+    """
+    return [createScenegraphElementFromXMLData(xmlCurInstance) for xmlCurInstance in xmlInstanceList]
+
+
 class ScenegraphRoot(Group):
     """
     Represents a root node of a full Scene.
     """
+
+    __slots__ = ('channelData', 'channelMapping', 'pathIndex')
     
     def __init__(self, name=None, instanceList=None, channelData=None):
         Group.__init__(self, name=name, instanceList=instanceList)
         self.channelData = channelData
         self.channelMapping = {}
+        self.pathIndex = None
+
+    def getIndex(self, resolver=None):
+        """
+        Returns the ScenegraphIndex of the scene, building it on first use. 
+        invalidateIndex must be called after changing the hierarchy. See 
+        ScenegraphIndex for resolver.
+        """
+        if self.pathIndex is None or self.pathIndex.resolver is not resolver:
+            self.pathIndex = ScenegraphIndex(self, resolver)
+        return self.pathIndex
+
+    def invalidateIndex(self):
+        self.pathIndex = None
+
+    def buildBVH(self, frameNumber=None, elementType='reference'):
+        """
+        Returns a ScenegraphBVH over the world space bounds of the elements of
+        elementType, reading the channel file of frameNumber first if given.
+        """
+        if frameNumber is not None:
+            self.readXMLChannelFile(frameNumber)
+        return ScenegraphBVH(self, elementType)
+
+    def findElements(self, pattern=None, regex=False, elementType=None, attributes=None, predicate=None):
+        """
+        Returns the elements of the scene matching the given filters, see 
+        ScenegraphIndex.findPaths.
+        """
+        return self.getIndex().findElements(pattern, regex, elementType, attributes, predicate)
+
+    def setChannelFormat(self, fileFormat, precision='float64'):
+        """
+        Selects the on-disk format ("xml" or "binary") of the channel files 
+        written and read for this root.
+        """
+        if self.channelData is None:
+            raise ValueError('channelData not set when setting channel format for ScenegraphRoot')
+        self.channelData.setFileFormat(fileFormat, precision)
 
     def setChannelDataValue(self, index, value):        
         self.channelData.setValue(index, value)
 
+    def setChannelDataValues(self, index, values):
+        self.channelData.setValues(index, values)
+
     def calcBounds(self):
         return self.getBounds(self.channelData)
 
-    def writeXMLFile(self, filepath, verbose=True):
+    def getAllChannelUsers(self):
+        """
+        Returns the data objects reading their values from channels for every 
+        element in the hierarchy.
+        """
+        channelUsers = []
+        elementStack = list(self.instanceList or [])
+        while elementStack:
+            curElement = elementStack.pop()
+            channelUsers.extend(curElement.getChannelUsers())
+            if isinstance(curElement, Group) and curElement.instanceList is not None:
+                elementStack.extend(curElement.instanceList)
+        return channelUsers
+
+    def foldConstantChannels(self, frameValues, tolerance=0.0):
+        """
+        Post-pass over the channel values sampled for every frame of the range,
+        given in frame order in frameValues. Xform, Bounds and other data whose
+        channels are constant (within tolerance) across the whole range are 
+        turned into static values, and the remaining animated channels are 
+        renumbered contiguously. Returns the values of the remaining channels 
+        for every frame.
+        """
+        if not frameValues:
+            return []
+        constantChannels = findConstantChannels(frameValues, tolerance)
+        firstValues = frameValues[0]
+
+        channelUsers = self.getAllChannelUsers()
+        channelUsers.sort(key=lambda curData: curData.channelIndex)
+        remappedIndices = {}
+        keptChannels = []
+        numKeptChannels = 0
+        for curData in channelUsers:
+            channelIndex = curData.channelIndex
+            numChannels = curData.getNumChannels()
+            # channels shared by several data objects are only folded or kept once
+            if channelIndex in remappedIndices:
+                if remappedIndices[channelIndex] is None:
+                    curData.foldChannels(firstValues[channelIndex:channelIndex + numChannels])
+                else:
+                    curData.channelIndex = remappedIndices[channelIndex]
+                continue
+            if all(constantChannels[channelIndex:channelIndex + numChannels]) and \
+               curData.foldChannels(firstValues[channelIndex:channelIndex + numChannels]):
+                remappedIndices[channelIndex] = None
+                continue
+            remappedIndices[channelIndex] = numKeptChannels
+            curData.channelIndex = numKeptChannels
+            keptChannels.append((channelIndex, numChannels))
+            numKeptChannels += numChannels
+
+        log.debug('folded %d channels into static values, %d channels remain animated'
+                  % (len(firstValues) - numKeptChannels, numKeptChannels))
+        self.invalidateBoundsCache()
+
+        keptFrameValues = []
+        for curValues in frameValues:
+            curKeptValues = array('d')
+            for channelIndex, numChannels in keptChannels:
+                curKeptValues.extend(curValues[channelIndex:channelIndex + numChannels])
+            keptFrameValues.append(curKeptValues)
+        return keptFrameValues
+
+    def setBoundsCaching(self, enabled=True):
+        """
+        Enables or disables incremental bounds calculation. While enabled each 
+        auto calculated Group caches its bounds, and setting a channel value 
+        only marks the Groups whose bounds depend on that channel as dirty, so
+        calcBounds only recalculates what has changed. invalidateBoundsCache 
+        must be called after changing the hierarchy while caching is enabled.
+        """
+        if self.channelData is None:
+            raise ValueError('channelData not set when enabling bounds caching for ScenegraphRoot')
+        self.clearBoundsCache()
+        self.channelData.boundsDependents = None
+        if enabled:
+            boundsDependents = {}
+            self.getBoundsChannels(boundsDependents)
+            self.channelData.boundsDependents = boundsDependents
+
+    def invalidateBoundsCache(self):
+        """
+        Rebuilds the bounds dependencies after a change to the hierarchy, if 
+        bounds caching is enabled.
+        """
+        if self.channelData is not None and self.channelData.boundsDependents is not None:
+            self.setBoundsCaching(True)
+
+    def writeXMLFile(self, filepath, verbose=True, streaming=None):
+        """
+        Writes the scene to an XML file. If streaming is True the XML is written
+        incrementally while the hierarchy is walked instead of building the 
+        full ElementTree first. When streaming is None SG_XML_STREAMING_WRITE 
+        is used. Both writers produce identical files.
+        """
         log.debug('\nwriting XML to file %s' % filepath)
         dir = os.path.dirname(filepath)
         if not os.path.isdir(dir):
             os.makedirs(dir)   
+        xmlRoot, xmlInstanceList, channelMappingPackage = self.createXMLRoot()
+
+        if streaming is None:
+            streaming = SG_XML_STREAMING_WRITE
+        if streaming:
+            if verbose:
+                print('Writing file "%s"...' % filepath)
+            with open(filepath, 'wb') as f:
+                streamWriter = XMLStreamWriter(f, channelMappingPackage, self.channelData)
+                streamWriter.writeElement(xmlRoot, xmlInstanceList, self.instanceList)
+            return
+        
+        for curInstance in self.instanceList:
+            xmlCurInstance = ET.SubElement(xmlInstanceList, 'instance')
+            curInstance.writeXMLData(curInstance, xmlCurInstance, channelMappingPackage, self.channelData)
+
+        if verbose:
+            print('Writing file "%s"...' % filepath)
+
+        xmlTree = ET.ElementTree(xmlRoot)
+        xmlTree.write(filepath)
+
+    def getXMLFileSize(self):
+        """
+        Returns the size in bytes of the XML file writeXMLFile would write,
+        without writing anything. The XML is streamed into a byte counter.
+        """
+        xmlRoot, xmlInstanceList, channelMappingPackage = self.createXMLRoot()
+        byteCounter = ByteCounter()
+        streamWriter = XMLStreamWriter(byteCounter, channelMappingPackage, self.channelData)
+        streamWriter.writeElement(xmlRoot, xmlInstanceList, self.instanceList)
+        return byteCounter.numBytes
+
+    def createXMLRoot(self):
+        """
+        Returns the root XML element of the file along with its empty instance
+        list element and the channel mapping to write static channel values with.
+        """
         xmlRoot = ET.Element('scenegraphXML')
         xmlRoot.attrib['version'] = __version__
         if self.channelData is not None and not self.channelData.isStatic():
@@ -923,41 +2639,39 @@ class ScenegraphRoot(Group):
         channelMappingPackage = None
         if self.channelData is not None and self.channelData.isStatic():
             channelMappingPackage = self.channelMapping
-        
-        for curInstance in self.instanceList:
-            xmlCurInstance = ET.SubElement(xmlInstanceList, 'instance')
-            curInstance.writeXMLData(curInstance, xmlCurInstance, channelMappingPackage, self.channelData)
-
-        if verbose:
-            print('Writing file "%s"...' % filepath)
-
-        xmlTree = ET.ElementTree(xmlRoot)
-        xmlTree.write(filepath)
+        return xmlRoot, xmlInstanceList, channelMappingPackage
 
-    def readXMLFile(self, filepath):
-        log.debug('\nreading XML file %s' % filepath)
-        if not os.path.isfile(filepath):
-            raise ValueError('File not found: "%s"' % filepath)
-        xmlTree = ET.parse(filepath)
-        xmlRoot = xmlTree.getroot()
-        fileVersion = xmlRoot.get('version')
-        if fileVersion != __version__:
-            print('WARNING: XML file version does not match')
+    def readXMLFile(self, filepath, lazy=False, cache=None):
+        """
+        Reads the scene from an XML file. If lazy is True only the top-level 
+        instances are instantiated; groups below them are LazyGroup instances 
+        that read their own instances from the file on first access, through a
+        LazyFileIndex of the file shared by all of them. If cache 
+        is True the file is read through readCache, which only skips parsing 
+        the file again: the instances are still built for this root. When 
+        cache is None SG_XML_READ_CACHE is used. Lazy reads are never cached.
+        """
+        self.pathIndex = None
+        if lazy:
+            self.channelData = None
+            self.instanceList = readLazyInstanceList(filepath, (), sgRoot=self,
+                                                     fileIndex=LazyFileIndex(filepath))
+            return
+
+        if cache is None:
+            cache = SG_XML_READ_CACHE
+        if cache:
+            xmlChannelData, xmlInstanceList = readCache.read(filepath)
+            instanceList = createInstanceList(xmlInstanceList)
+        else:
+            xmlChannelData, instanceList = parseXMLFile(filepath)
 
-        xmlChannelData = xmlRoot.find('channelData')
         if xmlChannelData is not None:
             self.channelData = ChannelData()
             self.channelData.readXMLData(xmlChannelData)
         else:
-            self.ChannelData = None
-
-        xmlInstanceList = xmlRoot.find('instanceList')
-        if xmlInstanceList is None:
-            raise ValueError('Cannot find XML element "instanceList" when reading XML data for ScenegraphRoot')
-        self.instanceList = []
-        for xmlCurInstance in xmlInstanceList:
-            curInstance = createScenegraphElementFromXMLData(xmlCurInstance)
-            self.instanceList.append(curInstance)
+            self.channelData = None
+        self.instanceList = instanceList
 
     def addChannelMapping(self, channelNo, element):
         self.channelMapping[element] = channelNo
@@ -968,6 +2682,729 @@ class ScenegraphRoot(Group):
     def readXMLChannelFile(self, frameNumber):
         self.channelData.readXMLChannelFile(frameNumber)
 
+    def readChannelRange(self, startFrame=None, endFrame=None, channels=None, numThreads=4):
+        return self.channelData.readChannelRange(startFrame, endFrame, channels, numThreads)
+
+
+class ReferenceResolver(object):
+    """
+    Loads the graph of xml files a scenegraphXML file references through 
+    Reference elements with refType 'xml', reading files concurrently on a 
+    pool of threads. refFile paths are relative to the directory of the file
+    holding the Reference. Every file is read once however many times it is 
+    referenced, and getRefRoot returns the ScenegraphRoot of the file an xml 
+    Reference references. The links are kept by the resolver, the References
+    themselves are left untouched. Reference cycles raise a ValueError.
+    """
+
+    def __init__(self, numThreads=8, cache=None):
+        self.numThreads = max(numThreads, 1)
+        self.cache = cache
+        # ScenegraphRoot of the file passed to resolve
+        self.root = None
+        # absolute file path -> ScenegraphRoot
+        self.roots = {}
+        # absolute file path -> list of (Reference, absolute referenced file path)
+        self.references = {}
+        # xml Reference -> ScenegraphRoot of the file it references
+        self.refRoots = {}
+
+    def getRefRoot(self, reference):
+        """
+        Returns the ScenegraphRoot of the file an xml Reference references, or 
+        None if the Reference wasn't loaded by this resolver.
+        """
+        return self.refRoots.get(reference)
+
+    def _readFiles(self, taskQueue, resultQueue):
+        while True:
+            filepath = taskQueue.get()
+            if filepath is None:
+                return
+            try:
+                sgRoot = ScenegraphRoot()
+                sgRoot.readXMLFile(filepath, cache=self.cache)
+                resultQueue.put((filepath, sgRoot, None))
+            except Exception as e:
+                resultQueue.put((filepath, None, e))
+
+    def getXMLReferences(self, sgRoot, filepath):
+        """
+        Returns the xml Reference elements of a scene along with the absolute 
+        path of the file each of them references.
+        """
+        fileDir = os.path.dirname(filepath)
+        references = []
+        elementStack = list(reversed(sgRoot.instanceList or []))
+        while elementStack:
+            curElement = elementStack.pop()
+            if isinstance(curElement, Reference):
+                if curElement.refType == 'xml':
+                    refPath = os.path.normpath(os.path.join(fileDir, curElement.refFile))
+                    references.append((curElement, refPath))
+            elif curElement.instanceList is not None:
+                elementStack.extend(reversed(curElement.instanceList))
+        return references
+
+    def resolve(self, filepath):
+        """
+        Loads filepath and every xml file it references, directly or not, links
+        all xml References and returns the ScenegraphRoot of filepath.
+        """
+        filepath = os.path.abspath(filepath)
+        self.root = None
+        self.roots = {}
+        self.references = {}
+        self.refRoots = {}
+        errors = {}
+
+        taskQueue = queue.Queue()
+        resultQueue = queue.Queue()
+        threads = []
+        for threadIndex in range(self.numThreads):
+            curThread = threading.Thread(target=self._readFiles, args=(taskQueue, resultQueue),
+                                         name='ReferenceResolver-%d' % threadIndex)
+            curThread.daemon = True
+            curThread.start()
+            threads.append(curThread)
+
+        try:
+            scheduled = set([filepath])
+            taskQueue.put(filepath)
+            numPending = 1
+            while numPending:
+                curPath, sgRoot, error = resultQueue.get()
+                numPending -= 1
+                if error is not None:
+                    log.debug('error reading referenced file %s: %s' % (curPath, error))
+                    errors[curPath] = error
+                    continue
+                self.roots[curPath] = sgRoot
+                self.references[curPath] = self.getXMLReferences(sgRoot, curPath)
+                for curReference, refPath in self.references[curPath]:
+                    if refPath not in scheduled:
+                        scheduled.add(refPath)
+                        taskQueue.put(refPath)
+                        numPending += 1
+        finally:
+            for curThread in threads:
+                taskQueue.put(None)
+            for curThread in threads:
+                curThread.join()
+
+        if errors:
+            raise errors[min(errors)]
+
+        self.checkCycles(filepath)
+        for curReferences in self.references.values():
+            for curReference, refPath in curReferences:
+                self.refRoots[curReference] = self.roots[refPath]
+        self.root = self.roots[filepath]
+        return self.root
+
+    def checkCycles(self, filepath):
+        """
+        Raises a ValueError naming the files involved if the loaded reference 
+        graph starting at filepath contains a cycle.
+        """
+        visited = set()
+        pathStack = [filepath]
+        onPath = set([filepath])
+        iterStack = [iter(self.references[filepath])]
+        while iterStack:
+            for curReference, refPath in iterStack[-1]:
+                if refPath in onPath:
+                    cycle = pathStack[pathStack.index(refPath):] + [refPath]
+                    raise ValueError('Reference cycle found: %s' % ' -> '.join(cycle))
+                if refPath not in visited:
+                    pathStack.append(refPath)
+                    onPath.add(refPath)
+                    iterStack.append(iter(self.references[refPath]))
+                    break
+            else:
+                iterStack.pop()
+                visited.add(pathStack[-1])
+                onPath.discard(pathStack.pop())
+
+
+def resolveReferences(filepath, numThreads=8, cache=None):
+    """
+    Reads a scenegraphXML file along with every xml file it references and 
+    returns the ReferenceResolver linking them, whose root is the 
+    ScenegraphRoot of filepath. See ReferenceResolver.
+    """
+    resolver = ReferenceResolver(numThreads, cache)
+    resolver.resolve(filepath)
+    return resolver
+
+
+class ScenegraphIndex(object):
+    """
+    Index of the elements of a scene by full path, name and type, for fast 
+    lookups in large hierarchies. Paths are made of the element names from the
+    top-level instances down, e.g. "/world/props/chair1". Types are the 
+    elemType ("group", "reference"), refType ("abc", "xml") and groupType of 
+    the elements. If a ReferenceResolver is given, the scenes it linked to xml
+    References are indexed below their Reference.
+
+    The index is a snapshot: it must be rebuilt after changing the hierarchy.
+    Building it reads the instances of every LazyGroup.
+    """
+
+    __slots__ = ('resolver', 'elements', 'sortedPaths', 'names', 'types')
+
+    def __init__(self, sgRoot, resolver=None):
+        self.resolver = resolver
+        # full path -> element
+        self.elements = {}
+        # name -> set of full paths
+        self.names = {}
+        # type -> set of full paths
+        self.types = {}
+
+        elementStack = [('', curInstance) for curInstance in reversed(sgRoot.instanceList or [])]
+        while elementStack:
+            parentPath, curElement = elementStack.pop()
+            curPath = '%s/%s' % (parentPath, curElement.name)
+            if curPath in self.elements:
+                log.debug('duplicate scenegraph path %s, only the first element is indexed' % curPath)
+                continue
+            self.elements[curPath] = curElement
+            self.names.setdefault(curElement.name, set()).add(curPath)
+            for curType in (curElement.elemType, getattr(curElement, 'refType', None),
+                            getattr(curElement, 'groupType', None)):
+                if curType is not None:
+                    self.types.setdefault(curType, set()).add(curPath)
+
+            if isinstance(curElement, Reference):
+                refRoot = resolver.getRefRoot(curElement) if resolver is not None else None
+                if refRoot is not None:
+                    childList = refRoot.instanceList
+                else:
+                    childList = None
+            else:
+                childList = curElement.instanceList
+            if childList:
+                elementStack.extend((curPath, curInstance) for curInstance in reversed(childList))
+
+        self.sortedPaths = sorted(self.elements)
+
+    def __len__(self):
+        return len(self.elements)
+
+    def getElement(self, path):
+        """
+        Returns the element at a full path, or None if there is none.
+        """
+        return self.elements.get(path)
+
+    def getPaths(self, name):
+        """
+        Returns the sorted full paths of all elements called name.
+        """
+        return sorted(self.names.get(name, ()))
+
+    def getPathsWithPrefix(self, prefix):
+        """
+        Returns the sorted full paths starting with prefix. Use a prefix ending 
+        with "/" to get every element below a given element.
+        """
+        start = bisect.bisect_left(self.sortedPaths, prefix)
+        paths = []
+        for curPath in self.sortedPaths[start:]:
+            if not curPath.startswith(prefix):
+                break
+            paths.append(curPath)
+        return paths
+
+    def getAttributeValue(self, element, attributeName):
+        """
+        Returns the value of an element attribute (e.g. "groupType" or 
+        "refFile") or of an arbitrary attribute of the element, or None.
+        """
+        if element.arbitraryList is not None:
+            for curAttribute in element.arbitraryList:
+                if curAttribute.name == attributeName:
+                    return curAttribute.value
+        if attributeName in ('name', 'elemType', 'refFile', 'refType', 'groupType'):
+            return getattr(element, attributeName, None)
+        return None
+
+    def findPaths(self, pattern=None, regex=False, elementType=None, attributes=None, predicate=None):
+        """
+        Returns the sorted full paths of the elements matching all of the given
+        filters:
+            pattern     - glob matched against the full path when it starts 
+                          with "/", and against the element name otherwise. 
+                          "*" also matches "/". A regular expression searched 
+                          in the full path if regex is True.
+            elementType - element type, e.g. "group", "reference", "abc" or 
+                          "xml", or a groupType such as "component"
+            attributes  - dict of attribute names and the values they must 
+                          have, see getAttributeValue
+            predicate   - callable taking an element and returning True for 
+                          the elements to keep
+        """
+        if pattern is None:
+            candidates = self.sortedPaths
+        elif regex:
+            compiledPattern = re.compile(pattern)
+            candidates = [curPath for curPath in self.sortedPaths if compiledPattern.search(curPath)]
+        elif not pattern.startswith('/'):
+            if hasWildcards(pattern):
+                matchingNames = [curName for curName in self.names if fnmatch.fnmatchcase(curName, pattern)]
+            else:
+                matchingNames = [pattern]
+            candidates = []
+            for curName in matchingNames:
+                candidates.extend(self.names.get(curName, ()))
+        elif not hasWildcards(pattern):
+            candidates = [pattern] if pattern in self.elements else []
+        else:
+            # only scan the paths sharing the literal start of the pattern
+            literalPrefix = re.split(r'[*?\[]', pattern, 1)[0]
+            candidates = [curPath for curPath in self.getPathsWithPrefix(literalPrefix)
+                          if fnmatch.fnmatchcase(curPath, pattern)]
+
+        if elementType is not None:
+            typePaths = self.types.get(elementType, set())
+            candidates = [curPath for curPath in candidates if curPath in typePaths]
+        if attributes:
+            candidates = [curPath for curPath in candidates
+                          if all(self.getAttributeValue(self.elements[curPath], curName) == curValue
+                                 for curName, curValue in attributes.items())]
+        if predicate is not None:
+            candidates = [curPath for curPath in candidates if predicate(self.elements[curPath])]
+        return sorted(candidates)
+
+    def findElements(self, pattern=None, regex=False, elementType=None, attributes=None, predicate=None):
+        """
+        Returns the elements matching findPaths, in path order.
+        """
+        return [self.elements[curPath]
+                for curPath in self.findPaths(pattern, regex, elementType, attributes, predicate)]
+
+
+def hasWildcards(pattern):
+    return '*' in pattern or '?' in pattern or '[' in pattern
+
+
+class ScenegraphBVH(object):
+    """
+    Bounding volume hierarchy over the world space bounds of the elements of a
+    scene, for the channel values currently loaded, answering box, frustum and 
+    ray queries. Only elements of elementType ("reference" by default, None 
+    for all elements) with bounds are indexed. Elements are identified by the 
+    same full paths as ScenegraphIndex.
+
+    The BVH is a snapshot: it must be rebuilt for another frame or after 
+    changing the hierarchy.
+    """
+
+    __slots__ = ('paths', 'elements', 'itemBounds', 'nodeBounds', 'nodeChildren')
+
+    # maximum number of elements held in a leaf node
+    LEAF_SIZE = 4
+
+    def __init__(self, sgRoot, elementType='reference'):
+        self.paths = []
+        self.elements = []
+        self.itemBounds = []
+        # per node, its bounds and either (leftNode, rightNode) or, for leaf 
+        # nodes, (-1 - firstItem, numItems)
+        self.nodeBounds = []
+        self.nodeChildren = []
+
+        channelData = sgRoot.channelData
+        xforms = []
+        boundsList = []
+        elementStack = [('', None, curInstance) for curInstance in reversed(sgRoot.instanceList or [])]
+        while elementStack:
+            parentPath, parentXform, curElement = elementStack.pop()
+            curPath = '%s/%s' % (parentPath, curElement.name)
+            curXform = curElement.getXform(channelData)
+            if curXform is None:
+                curXform = parentXform
+            elif parentXform is not None:
+                curXform = multiplyXforms(curXform, parentXform)
+
+            if elementType is None or curElement.elemType == elementType:
+                curBounds = curElement.getBounds(channelData)
+                if curBounds is not None:
+                    self.paths.append(curPath)
+                    self.elements.append(curElement)
+                    xforms.append(curXform)
+                    boundsList.append(list(curBounds))
+
+            if not isinstance(curElement, Reference) and curElement.instanceList:
+                elementStack.extend((curPath, curXform, curInstance)
+                                    for curInstance in reversed(curElement.instanceList))
+
+        # move all bounds into world space, batching those with an Xform
+        xformedIndices = [i for i, curXform in enumerate(xforms) if curXform is not None]
+        self.itemBounds = boundsList
+        if xformedIndices:
+            xformedBounds = applyXformsToBounds([xforms[i] for i in xformedIndices],
+                                                [boundsList[i] for i in xformedIndices])
+            for i, curBounds in zip(xformedIndices, xformedBounds):
+                self.itemBounds[i] = curBounds
+
+        if self.itemBounds:
+            self._build()
+
+    def __len__(self):
+        return len(self.elements)
+
+    def _build(self):
+        """
+        Builds the nodes top-down, splitting the elements of each node at the 
+        median of their centres along the longest axis of those centres.
+        """
+        order = list(range(len(self.itemBounds)))
+        centres = [((b[0] + b[1]) * 0.5, (b[2] + b[3]) * 0.5, (b[4] + b[5]) * 0.5) for b in self.itemBounds]
+        ranges = [(0, len(order), None)]
+        while ranges:
+            start, end, parentSlot = ranges.pop()
+            nodeIndex = len(self.nodeBounds)
+            self.nodeBounds.append(mergeBounds([self.itemBounds[i] for i in order[start:end]]))
+            self.nodeChildren.append(None)
+            if parentSlot is not None:
+                parentIndex, side = parentSlot
+                children = self.nodeChildren[parentIndex]
+                self.nodeChildren[parentIndex] = (nodeIndex, children[1]) if side == 0 else (children[0], nodeIndex)
+
+            if end - start <= self.LEAF_SIZE:
+                self.nodeChildren[nodeIndex] = (-1 - start, end - start)
+                continue
+            axis = max(range(3), key=lambda curAxis: max(centres[i][curAxis] for i in order[start:end]) -
+                                                     min(centres[i][curAxis] for i in order[start:end]))
+            order[start:end] = sorted(order[start:end], key=lambda i: centres[i][axis])
+            middle = (start + end) // 2
+            self.nodeChildren[nodeIndex] = (None, None)
+            ranges.append((middle, end, (nodeIndex, 1)))
+            ranges.append((start, middle, (nodeIndex, 0)))
+
+        # store the items in leaf order so leaves address contiguous ranges
+        self.paths = [self.paths[i] for i in order]
+        self.elements = [self.elements[i] for i in order]
+        self.itemBounds = [self.itemBounds[i] for i in order]
+
+    def _query(self, testBounds):
+        """
+        Returns the indices of the items whose bounds pass testBounds, pruning 
+        every node whose bounds don't.
+        """
+        items = []
+        if not self.nodeBounds:
+            return items
+        nodeStack = [0]
+        while nodeStack:
+            nodeIndex = nodeStack.pop()
+            if not testBounds(self.nodeBounds[nodeIndex]):
+                continue
+            first, second = self.nodeChildren[nodeIndex]
+            if first < 0:
+                start = -1 - first
+                items.extend(i for i in range(start, start + second) if testBounds(self.itemBounds[i]))
+            else:
+                nodeStack.append(second)
+                nodeStack.append(first)
+        return items
+
+    def queryBox(self, bounds):
+        """
+        Returns the (path, element) of each element whose world bounds overlap
+        bounds (list of 6 values), in path order.
+        """
+        def testBounds(b):
+            return b[0] <= bounds[1] and b[1] >= bounds[0] and b[2] <= bounds[3] and \
+                   b[3] >= bounds[2] and b[4] <= bounds[5] and b[5] >= bounds[4]
+        return sorted((self.paths[i], self.elements[i]) for i in self._query(testBounds))
+
+    def queryFrustum(self, planes):
+        """
+        Returns the (path, element) of each element whose world bounds are at 
+        least partly inside the planes (a, b, c, d) of a frustum, see 
+        getFrustumPlanes, in path order. The test is conservative: bounds near 
+        a corner of the frustum may be returned while being outside of it.
+        """
+        def testBounds(b):
+            for a, bb, c, d in planes:
+                # test the corner furthest along the plane normal
+                x = b[1] if a >= 0 else b[0]
+                y = b[3] if bb >= 0 else b[2]
+                z = b[5] if c >= 0 else b[4]
+                if a*x + bb*y + c*z + d < 0:
+                    return False
+            return True
+        return sorted((self.paths[i], self.elements[i]) for i in self._query(testBounds))
+
+    def queryRay(self, origin, direction, maxDistance=None):
+        """
+        Returns the (distance, path, element) of each element whose world 
+        bounds are hit by a ray, sorted by the distance along direction at 
+        which the ray enters the bounds (0.0 if origin is inside them).
+        """
+        def getHitDistance(b):
+            tMin = 0.0
+            tMax = maxDistance
+            for axis in (0, 1, 2):
+                low = b[axis * 2]
+                high = b[axis * 2 + 1]
+                if direction[axis] == 0:
+                    if origin[axis] < low or origin[axis] > high:
+                        return None
+                    continue
+                t1 = (low - origin[axis]) / float(direction[axis])
+                t2 = (high - origin[axis]) / float(direction[axis])
+                if t1 > t2:
+                    t1, t2 = t2, t1
+                tMin = max(tMin, t1)
+                tMax = t2 if tMax is None else min(tMax, t2)
+                if tMin > tMax:
+                    return None
+            return tMin
+
+        hits = [(getHitDistance(self.itemBounds[i]), self.paths[i], self.elements[i])
+                for i in self._query(lambda b: getHitDistance(b) is not None)]
+        hits.sort(key=lambda hit: (hit[0], hit[1]))
+        return hits
+
+
+def mergeBounds(boundsList):
+    """
+    Utility function returning the bounds (list of 6 values) enclosing all the 
+    bounds of a list.
+    """
+    return [min(b[0] for b in boundsList), max(b[1] for b in boundsList),
+            min(b[2] for b in boundsList), max(b[3] for b in boundsList),
+            min(b[4] for b in boundsList), max(b[5] for b in boundsList)]
+
+
+def getCanonicalXMLData(xmlElement):
+    """
+    Returns a canonical string of an XML element with its sorted attributes, 
+    text and children. XML character data can't hold the control characters 
+    used as separators, which keeps the string unambiguous.
+    """
+    parts = [xmlElement.tag]
+    for curName in sorted(xmlElement.attrib):
+        parts.append(curName)
+        parts.append(xmlElement.attrib[curName])
+    parts.append((xmlElement.text or '').strip())
+    for xmlChild in xmlElement:
+        parts.append(getCanonicalXMLData(xmlChild))
+    return '\x01%s\x02' % '\x00'.join(parts)
+
+
+def hashString(value):
+    return hashlib.sha1(value.encode('utf-8')).hexdigest()
+
+
+def getChildPath(parentPath, name, nameCounts):
+    # siblings sharing a name are told apart by an index suffix, e.g. /world/tree[1]
+    count = nameCounts.get(name, 0)
+    nameCounts[name] = count + 1
+    if count:
+        return '%s/%s[%d]' % (parentPath, name, count)
+    return '%s/%s' % (parentPath, name)
+
+
+class ElementHash(object):
+    """
+    Hashes of the XML data of a scenegraph element: localHash covers the data
+    of the element itself, fields hold the value of each XML attribute and a 
+    hash of each data child element (bounds, xform, arbitraryList, ...) and 
+    subtreeHash covers the element along with all the instances below it.
+    """
+
+    __slots__ = ('localHash', 'subtreeHash', 'fields')
+
+    def __init__(self, xmlElement, childHashes=()):
+        # attribute values are short, so they are kept as they are
+        self.fields = dict(xmlElement.attrib)
+        for xmlChild in xmlElement:
+            if xmlChild.tag != 'instanceList':
+                self.fields[xmlChild.tag] = hashString(getCanonicalXMLData(xmlChild))
+        self.localHash = hashString('\x00'.join('%s\x00%s' % curField for curField in sorted(self.fields.items())))
+        self.subtreeHash = hashString(self.localHash + ''.join(childHashes))
+
+
+def hashScenegraph(sgRoot):
+    """
+    Returns an OrderedDict of the ElementHash of every element of a scene, by
+    full path in depth-first order. Paths are built like ScenegraphIndex paths,
+    except that siblings sharing a name get an index suffix.
+    """
+    hashes = OrderedDict()
+
+    def hashInstances(parentPath, instanceList):
+        nameCounts = {}
+        subtreeHashes = []
+        for curInstance in instanceList or []:
+            curPath = getChildPath(parentPath, curInstance.name, nameCounts)
+            # reserve the slot of the element before those of its instances
+            hashes[curPath] = None
+            if isinstance(curInstance, Reference):
+                childHashes = []
+            else:
+                childHashes = hashInstances(curPath, curInstance.instanceList)
+            xmlElement = ET.Element('instance')
+            curInstance.writeXMLElementData(curInstance, xmlElement)
+            hashes[curPath] = ElementHash(xmlElement, childHashes)
+            subtreeHashes.append(hashes[curPath].subtreeHash)
+        return subtreeHashes
+
+    hashInstances('', sgRoot.instanceList)
+    return hashes
+
+
+def hashScenegraphXMLFile(filepath):
+    """
+    Streaming counterpart of hashScenegraph, hashing the elements of a 
+    scenegraphXML file with iterparse. Each instance is freed as soon as it 
+    has been hashed, so only the hashes are held in memory.
+    """
+    log.debug('\nhashing XML file %s' % filepath)
+    if not os.path.isfile(filepath):
+        raise ValueError('File not found: "%s"' % filepath)
+
+    hashes = OrderedDict()
+    pathStack = ['']
+    nameCountsStack = [{}]
+    childHashesStack = [[]]
+    xmlStack = []
+    for event, xmlElement in ET.iterparse(filepath, events=('start', 'end')):
+        if event == 'start':
+            xmlStack.append(xmlElement)
+            if xmlElement.tag == 'instance':
+                curPath = getChildPath(pathStack[-1], xmlElement.get('name'), nameCountsStack[-1])
+                hashes[curPath] = None
+                pathStack.append(curPath)
+                nameCountsStack.append({})
+                childHashesStack.append([])
+            continue
+
+        xmlStack.pop()
+        if xmlElement.tag == 'instance':
+            curPath = pathStack.pop()
+            nameCountsStack.pop()
+            hashes[curPath] = ElementHash(xmlElement, childHashesStack.pop())
+            childHashesStack[-1].append(hashes[curPath].subtreeHash)
+            # free the instance now it has been hashed
+            xmlElement.clear()
+            if xmlStack:
+                xmlStack[-1].remove(xmlElement)
+    return hashes
+
+
+def getTopmostPaths(paths, excludedPaths=()):
+    """
+    Returns the paths of a depth-first ordered list that are not below another
+    path of the list, leaving out excludedPaths and everything below them.
+    """
+    topmostPaths = []
+    skipPrefix = None
+    for curPath in paths:
+        if skipPrefix is not None and curPath.startswith(skipPrefix):
+            continue
+        skipPrefix = curPath + '/'
+        if curPath not in excludedPaths:
+            topmostPaths.append(curPath)
+    return topmostPaths
+
+
+class ScenegraphDiff(object):
+    """
+    Structural differences between two scenes, given as the element hashes 
+    returned by hashScenegraph or hashScenegraphXMLFile:
+        added   - paths of the elements only found in the second scene. 
+                  Elements below an added element are not listed.
+        removed - paths of the elements only found in the first scene. 
+                  Elements below a removed element are not listed.
+        moved   - (oldPath, newPath) of the elements found at another path 
+                  with identical data and instances
+        changed - (path, fields) of the elements found at the same path whose 
+                  own data differs, fields being the sorted names of the XML 
+                  attributes and data elements (e.g. "refFile", "xform") that 
+                  changed
+    Elements whose subtree hash matches are skipped with all their instances.
+    """
+
+    __slots__ = ('added', 'removed', 'moved', 'changed')
+
+    def __init__(self, hashesA, hashesB):
+        self.changed = []
+        skipPrefix = None
+        for curPath, hashA in hashesA.items():
+            if skipPrefix is not None and curPath.startswith(skipPrefix):
+                continue
+            skipPrefix = None
+            hashB = hashesB.get(curPath)
+            if hashB is None:
+                continue
+            if hashB.subtreeHash == hashA.subtreeHash:
+                skipPrefix = curPath + '/'
+                continue
+            if hashB.localHash != hashA.localHash:
+                fields = set(hashA.fields) | set(hashB.fields)
+                self.changed.append((curPath, sorted(curField for curField in fields
+                                                     if hashA.fields.get(curField) != hashB.fields.get(curField))))
+
+        removedPaths = [curPath for curPath in hashesA if curPath not in hashesB]
+        addedPaths = [curPath for curPath in hashesB if curPath not in hashesA]
+
+        # an added element with the same subtree as a removed one has been moved
+        removedBySubtree = {}
+        for curPath in removedPaths:
+            removedBySubtree.setdefault(hashesA[curPath].subtreeHash, []).append(curPath)
+        self.moved = []
+        movedFrom = set()
+        movedTo = set()
+        skipPrefix = None
+        for curPath in addedPaths:
+            if skipPrefix is not None and curPath.startswith(skipPrefix):
+                continue
+            skipPrefix = None
+            sourcePaths = removedBySubtree.get(hashesB[curPath].subtreeHash)
+            if sourcePaths:
+                sourcePath = sourcePaths.pop(0)
+                self.moved.append((sourcePath, curPath))
+                movedFrom.add(sourcePath)
+                movedTo.add(curPath)
+                skipPrefix = curPath + '/'
+
+        self.removed = getTopmostPaths(removedPaths, movedFrom)
+        self.added = getTopmostPaths(addedPaths, movedTo)
+
+    def isEmpty(self):
+        return not (self.added or self.removed or self.moved or self.changed)
+
+
+def diffScenegraphs(sceneA, sceneB):
+    """
+    Returns the ScenegraphDiff between two scenes, each given either as a 
+    ScenegraphRoot or as the path of a scenegraphXML file. Two files are 
+    compared in streaming fashion without building their scenes; a file 
+    compared with a ScenegraphRoot is read first so both are hashed from the 
+    same XML writer.
+    """
+    if isinstance(sceneA, ScenegraphRoot) != isinstance(sceneB, ScenegraphRoot):
+        if not isinstance(sceneA, ScenegraphRoot):
+            filepath, sceneA = sceneA, ScenegraphRoot()
+            sceneA.readXMLFile(filepath)
+        else:
+            filepath, sceneB = sceneB, ScenegraphRoot()
+            sceneB.readXMLFile(filepath)
+
+    hashesList = []
+    for curScene in (sceneA, sceneB):
+        if isinstance(curScene, ScenegraphRoot):
+            hashesList.append(hashScenegraph(curScene))
+        else:
+            hashesList.append(hashScenegraphXMLFile(curScene))
+    return ScenegraphDiff(hashesList[0], hashesList[1])
+
 
 # A test / example script:
 if __name__ == '__main__':
@@ -0,0 +1,245 @@
+# Copyright (c) 2012 The Foundry Visionmongers Ltd. All Rights Reserved.
+
+"""
+sgxmlBenchmark.py
+
+Standalone benchmark for scenegraphXML.py that does not need Maya. It builds a
+synthetic hierarchy of configurable depth, breadth, instance count and frame
+count, times the main read / write / bounds operations and reports wall time
+and bytes written for each of them, and the peak RSS of the whole run, as
+JSON, e.g.:
+
+    python sgxmlBenchmark.py --depth 3 --breadth 8 --instances 10 --frames 24
+"""
+
+import argparse
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+import scenegraphXML as sgxml
+
+
+IDENTITY_XFORM = [1.0, 0.0, 0.0, 0.0, 0.0, 1.0, 0.0, 0.0, 0.0, 0.0, 1.0, 0.0, 0.0, 0.0, 0.0, 1.0]
+
+
+def getPeakRSS():
+    """
+    Returns the peak resident set size of the process in bytes, or None if it
+    can't be queried on this platform. The peak never goes down, so it covers
+    every operation run by the process so far.
+    """
+    if resource is None:
+        return None
+    peakRSS = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+    if sys.platform == 'darwin':
+        return peakRSS
+    return peakRSS * 1024
+
+
+def getBytesWritten(directory):
+    totalBytes = 0
+    for dirPath, dirNames, fileNames in os.walk(directory):
+        for fileName in fileNames:
+            totalBytes += os.path.getsize(os.path.join(dirPath, fileName))
+    return totalBytes
+
+
+class SyntheticScene(object):
+    """
+    Builds a ScenegraphRoot with groups nested depth levels deep, breadth groups
+    per level and instances leaf references in each leaf group. A fraction of
+    the leaf references gets animated Xform channels, and every leaf reference
+    gets bounds channels, so that calcBounds has work to do.
+    """
+
+    def __init__(self, depth, breadth, instances, frames, animatedFraction, channelPath,
+                 channelFormat=sgxml.CHANNEL_FORMAT_XML, seed=0):
+        self.random = random.Random(seed)
+        self.depth = depth
+        self.breadth = breadth
+        self.instances = instances
+        self.animatedFraction = animatedFraction
+        self.numChannels = 0
+        self.animatedXforms = []
+        self.leafBounds = []
+        self.numElements = 0
+        channelData = sgxml.ChannelData(1, frames, channelPath, fileFormat=channelFormat)
+        self.root = sgxml.ScenegraphRoot(channelData=channelData)
+        self.root.setInstanceList([self.buildGroup('group%d' % i, 1) for i in range(breadth)])
+        channelData.setNumValues(self.numChannels)
+
+    def newChannels(self, numChannels):
+        channelIndex = self.numChannels
+        self.numChannels += numChannels
+        return channelIndex
+
+    def buildGroup(self, name, level):
+        self.numElements += 1
+        newGroup = sgxml.Group(name, groupType='assembly')
+        newGroup.setXform(value=IDENTITY_XFORM)
+        newGroup.setBounds(channelIndex=self.newChannels(6))
+        if level < self.depth:
+            for i in range(self.breadth):
+                newGroup.addInstance(self.buildGroup('%s_group%d' % (name, i), level + 1))
+        else:
+            for i in range(self.instances):
+                newGroup.addInstance(self.buildReference('%s_ref%d' % (name, i)))
+        return newGroup
+
+    def buildReference(self, name):
+        self.numElements += 1
+        newReference = sgxml.Reference(name, refType='abc', refFile=name + '.abc')
+        newReference.setLodData(tag='hi', weight=1.0)
+        boundsIndex = self.newChannels(6)
+        newReference.setBounds(channelIndex=boundsIndex)
+        self.leafBounds.append(boundsIndex)
+        if self.random.random() < self.animatedFraction:
+            channelIndex = self.newChannels(16)
+            newReference.setXform(channelIndex=channelIndex)
+            self.animatedXforms.append(channelIndex)
+        else:
+            newReference.setXform(value=IDENTITY_XFORM)
+        return newReference
+
+    def setFrame(self, frameNumber):
+        # moves the animated Xforms and jitters the leaf bounds for a frame
+        channelData = self.root.channelData
+        for channelIndex in self.animatedXforms:
+            xform = list(IDENTITY_XFORM)
+            xform[12] = frameNumber * self.random.uniform(-1.0, 1.0)
+            xform[13] = frameNumber * self.random.uniform(-1.0, 1.0)
+            channelData.setValues(channelIndex, xform)
+        for index in self.leafBounds:
+            size = self.random.uniform(0.5, 2.0)
+            channelData.setValues(index, [-size, size, -size, size, -size, size])
+
+
+class Benchmark(object):
+    """
+    Times named operations, recording wall time and the bytes written into the
+    output directory.
+    """
+
+    def __init__(self, outputDir):
+        self.outputDir = outputDir
+        self.results = []
+
+    def run(self, name, func, *args, **kwargs):
+        bytesBefore = getBytesWritten(self.outputDir)
+        startTime = time.time()
+        func(*args, **kwargs)
+        wallTime = time.time() - startTime
+        self.results.append({'name': name,
+                             'wallTime': wallTime,
+                             'bytesWritten': getBytesWritten(self.outputDir) - bytesBefore})
+
+
+def writeChannelFiles(scene, frames):
+    for frameNumber in range(1, frames + 1):
+        scene.setFrame(frameNumber)
+        scene.root.channelData.writeXMLChannelFile(frameNumber, verbose=False)
+
+
+def readChannelFiles(channelData, frames):
+    for frameNumber in range(1, frames + 1):
+        channelData.readXMLChannelFile(frameNumber)
+
+
+def calcBoundsForFrames(scene, frames):
+    for frameNumber in range(1, frames + 1):
+        scene.setFrame(frameNumber)
+        scene.root.calcBounds()
+
+
+def runBenchmarks(args, outputDir):
+    benchmark = Benchmark(outputDir)
+    xmlFilePath = os.path.join(outputDir, 'scene.xml')
+    sceneArgs = (args.depth, args.breadth, args.instances, args.frames, args.animated)
+
+    scene = SyntheticScene(*sceneArgs, channelPath=os.path.join(outputDir, 'scene'), seed=args.seed)
+    benchmark.run('writeXMLFile', scene.root.writeXMLFile, xmlFilePath, verbose=False, streaming=False)
+    benchmark.run('writeXMLFile[streaming]', scene.root.writeXMLFile,
+                  os.path.join(outputDir, 'scene_streaming.xml'), verbose=False, streaming=True)
+    benchmark.run('readXMLFile', sgxml.ScenegraphRoot().readXMLFile, xmlFilePath)
+    benchmark.run('readXMLFile[lazy]', sgxml.ScenegraphRoot().readXMLFile, xmlFilePath, lazy=True)
+    sgxml.ScenegraphRoot().readXMLFile(xmlFilePath, cache=True)
+    benchmark.run('readXMLFile[cached]', sgxml.ScenegraphRoot().readXMLFile, xmlFilePath, cache=True)
+    sgxml.readCache.invalidate(xmlFilePath)
+
+    for channelFormat in args.channel_formats:
+        channelPath = os.path.join(outputDir, 'channels_' + channelFormat)
+        channelScene = SyntheticScene(*sceneArgs, channelPath=channelPath, channelFormat=channelFormat,
+                                      seed=args.seed)
+        benchmark.run('writeXMLChannelFile[%s]' % channelFormat, writeChannelFiles, channelScene, args.frames)
+        channelData = sgxml.ChannelData(1, args.frames, channelPath, fileFormat=channelFormat)
+        benchmark.run('readXMLChannelFile[%s]' % channelFormat, readChannelFiles, channelData, args.frames)
+        benchmark.run('readChannelRange[%s]' % channelFormat, channelData.readChannelRange)
+        channelData.closeChannelArchive()
+
+    benchmark.run('calcBounds', calcBoundsForFrames, scene, args.frames)
+    scene.root.setBoundsCaching(True)
+    benchmark.run('calcBounds[cached]', calcBoundsForFrames, scene, args.frames)
+
+    return {'library': 'scenegraphXML',
+            'version': sgxml.__version__,
+            'python': sys.version.split()[0],
+            'numpy': sgxml.numpy is not None,
+            'parameters': {'depth': args.depth,
+                           'breadth': args.breadth,
+                           'instances': args.instances,
+                           'frames': args.frames,
+                           'animated': args.animated,
+                           'seed': args.seed},
+            'scene': {'elements': scene.numElements,
+                      'channels': scene.numChannels,
+                      'animatedXforms': len(scene.animatedXforms)},
+            'peakRSS': getPeakRSS(),
+            'results': benchmark.results}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the scenegraphXML library without Maya.')
+    parser.add_argument('--depth', type=int, default=3, help='number of group levels')
+    parser.add_argument('--breadth', type=int, default=4, help='number of child groups per group')
+    parser.add_argument('--instances', type=int, default=10, help='number of references per leaf group')
+    parser.add_argument('--frames', type=int, default=10, help='number of frames of channel data')
+    parser.add_argument('--animated', type=float, default=0.5,
+                        help='fraction of references with an animated Xform')
+    parser.add_argument('--channel-formats', nargs='+', default=list(sgxml.CHANNEL_FORMATS),
+                        choices=sgxml.CHANNEL_FORMATS, help='channel file formats to benchmark')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the random scene data')
+    parser.add_argument('--output-dir', help='directory to write files to (default: temporary directory)')
+    parser.add_argument('--keep', action='store_true', help='keep the files written')
+    parser.add_argument('--json', help='file to write the JSON report to (default: stdout)')
+    args = parser.parse_args(argv)
+
+    outputDir = args.output_dir or tempfile.mkdtemp(prefix='sgxmlBenchmark_')
+    if not os.path.isdir(outputDir):
+        os.makedirs(outputDir)
+    try:
+        report = runBenchmarks(args, outputDir)
+    finally:
+        if not args.keep:
+            shutil.rmtree(outputDir, ignore_errors=True)
+
+    reportText = json.dumps(report, indent=2, separators=(',', ': '), sort_keys=True)
+    if args.json:
+        with open(args.json, 'w') as f:
+            f.write(reportText + '\n')
+    else:
+        print(reportText)
+
+
+if __name__ == '__main__':
+    main()
@@ -74,6 +74,9 @@ class MayaSessionCollector(HookBaseClass):
 
         """
 
+        # forget the farm exports of any earlier publish that didn't finalize
+        _clear_tractor_session(self)
+
         # create an item representing the current maya session
         item = self.collect_current_maya_session(settings, parent_item)
         project_root = item.properties["project_root"]
@@ -814,3 +817,11 @@ class MayaSessionCollector(HookBaseClass):
 
 
         self.logger.debug("Collected shot sim dummy : %s"%(shot_name))
+
+
+def _clear_tractor_session(instance):
+
+    import sys
+    sys.path.append(instance.disk_location)
+    import to_tractor
+    to_tractor.clear_session_job()
@@ -347,7 +347,7 @@ def _to_tractor(instance,item,mel_command):
     start_frame, end_frame = _find_scene_animation_range()
     tractor = to_tractor.MayaToTractor(item)
     tractor.create_camera_usd_script(mel_command)
-    tractor.to_tractor(start_frame,end_frame,file_type)
+    tractor.add_to_session(start_frame,end_frame,file_type)
 
 def _find_scene_animation_range():
     """
@@ -364,7 +364,7 @@ def _to_tractor(instance,item,mel_command):
 
     #tractor.create_add_frame_script(mel_command,start_frame,end_frame)
     #tractor.create_script(mel_command)
-    tractor.to_tractor(start_frame,end_frame,file_type)
+    tractor.add_to_session(start_frame,end_frame,file_type)
 
 
 def _find_scene_animation_range():
@@ -0,0 +1,50 @@
+﻿# Copyright (c) 2017 Shotgun Software Inc.
+# 
+# CONFIDENTIAL AND PROPRIETARY
+# 
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit 
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your 
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights 
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+import os
+import sys
+import sgtk
+
+HookBaseClass = sgtk.get_hook_baseclass()
+
+
+class MayaSessionShotTractorPublishPlugin(HookBaseClass):
+    """
+    Base for the shot publish plugins that add their exports to the Tractor job
+    of the publish session rather than exporting in the Maya session.
+
+    The plugins inherit from it in the configuration, between the base file
+    publisher hook and their own hook::
+
+        hook: "{self}/publish_file.py:{config}/tk-multi-publish2/maya/shot/publish_shot_tractor.py:{config}/tk-multi-publish2/maya/shot/publish_shot_camera_abc.py"
+
+    """
+
+    def finalize(self, settings, item):
+        """
+        Execute the finalization pass. This pass executes once all the publish
+        tasks have completed.
+
+        Spools the farm exports of the whole publish session as Tractor jobs.
+        Every item of every plugin inheriting from this hook gets here, but the
+        first call spools and forgets all the exports of the session, so the
+        following calls find nothing left to spool and do nothing.
+
+        :param settings: Dictionary of Settings. The keys are strings, matching
+            the keys returned in the settings property. The values are `Setting`
+            instances.
+        :param item: Item to process
+        """
+
+        sys.path.append(os.path.dirname(self.disk_location))
+        import to_tractor
+        to_tractor.spool_session_job()
+
+        super(MayaSessionShotTractorPublishPlugin, self).finalize(settings, item)
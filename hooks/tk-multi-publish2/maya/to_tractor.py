@@ -6,12 +6,24 @@ import maya.cmds as cmds
 import sgtk
 
 
+# Farm exports added during the current publish session, spooled together as a single
+# Tractor job by spool_session_job. Kept across reloads of this module, which the publish
+# plugins reload before using it.
+try:
+    _session_exports
+except NameError:
+    _session_exports = []
+
+
 class MayaToTractor(object):
 
     def __init__(self,item):
 
         self.item = item
         self._temp_file = os.path.splitext(item.properties["path"])[0]+".py"
+        # export code and maya plugins set by the create_*_script methods
+        self._export_script = ''
+        self._plugins = []
 
     def create_add_frame_script(self,mel_command,sf,ef):
         
@@ -25,17 +37,6 @@ class MayaToTractor(object):
         temp_path = os.path.join(original_path,os.path.basename(orignal_file).split(".")[0]+"_fr")
 
         script = ''
-        script += 'import maya.standalone\n'
-        script += 'maya.standalone.initialize()\n'
-        script += 'import maya.cmds as cmds\n'
-        script += 'import maya.mel as mel\n'
-        script += 'import os\n'
-
-        script += '\n'
-        script += '\n'
-
-        script += 'cmds.file("{}",open=1,force=1,iv=1)\n'.format(cmds.file(query=True, sn=True))
-
         if not self.item.properties['name'].find("setgrp") == -1:
             cache_grp = [x for x in cmds.listRelatives(
                 self.item.properties['name'],ad=1) 
@@ -48,16 +49,6 @@ class MayaToTractor(object):
         else:
             script += 'cmds.select("{}")\n'.format(self.item.properties['name'])
 
-        if version == "2022":
-            script += 'cmds.loadPlugin("mayaUsdPlugin.so")\n'
-        else:
-            script += 'cmds.loadPlugin("pxrUsd.so")\n'
-            script += 'cmds.loadPlugin("cvJiggle.so")\n'
-            script += 'cmds.loadPlugin("cvwrap.so")\n'
-            script += 'cmds.loadPlugin("iDeform.so")\n'
-            script += 'cmds.loadPlugin("weightDriver.so")\n'
-        script += 'cmds.loadPlugin("AbcExport.so")\n'
-        
         for frame in range(sf,ef+1):
 
             mel_split  = original.split()
@@ -78,65 +69,34 @@ class MayaToTractor(object):
         
         script += 'os.system("usdstitch {0}/*.usd -o {1}")\n'.format(temp_path[1:],orignal_file[1:-1])
         
-
-        with open( self._temp_file, 'w' ) as f:
-            f.write(script)
+        self._export_script = script
+        self._plugins = _get_export_plugins(version)
 
     def create_script(self,mel_command):
 
         version = cmds.about(version=1)
         script = ''
-        script += 'import maya.standalone\n'
-        script += 'maya.standalone.initialize()\n'
-        script += 'import maya.cmds as cmds\n'
-        script += 'import maya.mel as mel\n'
-
-        script += '\n'
-        script += '\n'
-
-        script += 'cmds.file("{}",open=1,force=1,iv=1)\n'.format(cmds.file(query=True, sn=True))
         script += 'cmds.select("{}")\n'.format(self.item.properties['name'])
-        if version == "2022":
-            script += 'cmds.loadPlugin("mayaUsdPlugin.so")\n'
-        else:
-            script += 'cmds.loadPlugin("pxrUsd.so")\n'
-            script += 'cmds.loadPlugin("cvJiggle.so")\n'
-            script += 'cmds.loadPlugin("cvwrap.so")\n'
-            script += 'cmds.loadPlugin("iDeform.so")\n'
-            script += 'cmds.loadPlugin("weightDriver.so")\n'
-        script += 'cmds.loadPlugin("AbcExport.so")\n'
         script += 'mel.eval(\'{}\')\n'.format(mel_command)
         
-        
-
-        with open( self._temp_file, 'w' ) as f:
-            f.write(script)
+        self._export_script = script
+        self._plugins = _get_export_plugins(version)
 
     def create_camera_usd_script(self,mel_command):
 
 
         version = cmds.about(version=1)
         script = ''
-        script += 'import maya.standalone\n'
-        script += 'maya.standalone.initialize()\n'
-        script += 'import maya.cmds as cmds\n'
-        script += 'import maya.mel as mel\n'
-        
-        usd_attribute = ''
-        usd_attribute
-
-        script += '\n'
-        script += '\n'
-        
-        script += 'cmds.file("{}",open=1,force=1,iv=1)\n'.format(cmds.file(query=True, sn=True))
         script += 'start = int(cmds.playbackOptions(q=True, min=True))\n'
         script += 'end = int(cmds.playbackOptions(q=True, max=True))\n'
         script += '''camera_shapes = [ x for x in cmds.listRelatives("{}",c=1,f=1,ad=1) 
                                     if cmds.nodeType(x) == "camera"]\n'''.format(self.item.properties['name'])
         script += 'for cam_shape in camera_shapes:\n'
-        script += '    cmds.addAttr(cam_shape,ln="frameRange",dt="double2")\n'
+        script += '    if not cmds.attributeQuery("frameRange",node=cam_shape,exists=True):\n'
+        script += '        cmds.addAttr(cam_shape,ln="frameRange",dt="double2")\n'
         script += '    cmds.setAttr(cam_shape + ".frameRange",start ,end,type="double2")\n'
-        script += '    cmds.addAttr(cam_shape,ln="USD_UserExportedAttributesJson",dt="string")\n'
+        script += '    if not cmds.attributeQuery("USD_UserExportedAttributesJson",node=cam_shape,exists=True):\n'
+        script += '        cmds.addAttr(cam_shape,ln="USD_UserExportedAttributesJson",dt="string")\n'
         script += '''    cmds.setAttr(cam_shape+".USD_UserExportedAttributesJson",\
 '{"filmFit": {},\
 "filmFitOffset": {},\
@@ -158,141 +118,280 @@ class MayaToTractor(object):
 "zoom": {},\
 "cameraScale": {}}',type="string")\n'''
         script += 'cmds.select("{}")\n'.format(self.item.properties['name'])
+
+        script += _get_camera_export_script(mel_command)
+        
+        self._export_script = script
         if version == "2022":
-            script += 'cmds.loadPlugin("mayaUsdPlugin.so")\n'
+            self._plugins = ["mayaUsdPlugin.so", "AbcExport.so"]
         else:
-            script += 'cmds.loadPlugin("pxrUsd.so")\n'
-        script += 'cmds.loadPlugin("AbcExport.so")\n'
-
-        script += 'for shape in camera_shapes:\n'
-        script += '    cmds.setAttr(shape + ".overscan", 1.0)\n'
-        script += '    if cmds.getAttr(shape + ".panZoomEnabled") == True:\n'
-        script += '        cmds.setAttr(shape + ".pan", 0.0, 0.0, typ="float2")\n'
-        script += '        cmds.setAttr(shape + ".zoom", 1.0)\n'
-        script += '        if cmds.getAttr(shape + ".renderPanZoom") == True:\n'
-        script += '            cmds.setAttr(shape + ".renderPanZoom", False)\n'
-        script += '            cmds.setAttr(shape + ".panZoomEnabled", False)\n'
-        script += 'mel.eval(\'{}\')\n'.format(mel_command)
-        
-        
-
-        with open( self._temp_file, 'w' ) as f:
-            f.write(script)
+            self._plugins = ["pxrUsd.so", "AbcExport.so"]
 
     def create_camera_abc_script(self,mel_command):
 
         script = ''
-        script += 'import maya.standalone\n'
-        script += 'maya.standalone.initialize()\n'
-        script += 'import maya.cmds as cmds\n'
-        script += 'import maya.mel as mel\n'
-        
-        usd_attribute = ''
-        usd_attribute
-
-        script += '\n'
-        script += '\n'
-        
-        script += 'cmds.file("{}",open=1,force=1,iv=1)\n'.format(cmds.file(query=True, sn=True))
         script += 'start = int(cmds.playbackOptions(q=True, min=True))\n'
         script += 'end = int(cmds.playbackOptions(q=True, max=True))\n'
         script += '''camera_shapes = [ x for x in cmds.listRelatives("{}",c=1,f=1,ad=1) 
                                     if cmds.nodeType(x) == "camera"]\n'''.format(self.item.properties['name'])
         script += 'cmds.select("{}")\n'.format(self.item.properties['name'])
-        script += 'cmds.loadPlugin("AbcExport.so")\n'
-
-        script += 'for shape in camera_shapes:\n'
-        script += '    cmds.setAttr(shape + ".overscan", 1.0)\n'
-        script += '    if cmds.getAttr(shape + ".panZoomEnabled") == True:\n'
-        script += '        cmds.setAttr(shape + ".pan", 0.0, 0.0, typ="float2")\n'
-        script += '        cmds.setAttr(shape + ".zoom", 1.0)\n'
-        script += '        if cmds.getAttr(shape + ".renderPanZoom") == True:\n'
-        script += '            cmds.setAttr(shape + ".renderPanZoom", False)\n'
-        script += '            cmds.setAttr(shape + ".panZoomEnabled", False)\n'
-        script += 'mel.eval(\'{}\')\n'.format(mel_command)
-        
-        
 
-        with open( self._temp_file, 'w' ) as f:
-            f.write(script)
-
-    def _get_default_command(self): 
+        script += _get_camera_export_script(mel_command)
         
-        version = cmds.about(version=1)
-        engine = sgtk.platform.current_engine()
-        context = engine.context
-        project = context.project
-        sg = engine.shotgun
-        if version == "2022":
-            version="2022.1"
+        self._export_script = script
+        self._plugins = ["AbcExport.so"]
+
+    def add_to_session(self,start_frame,end_frame,file_type):
+        """
+        Adds the export set by the last create_*_script call to the Tractor job
+        of the current publish session, spooled by spool_session_job.
+        """
+        _session_exports.append(self._get_export(start_frame,end_frame,file_type))
+
+    def _get_export(self,start_frame,end_frame,file_type):
+
+        return {
+            "scene": cmds.file(query=True, sn=True),
+            "name": self.item.properties['name'],
+            "script": self._export_script,
+            "plugins": self._plugins,
+            "start_frame": start_frame,
+            "end_frame": end_frame,
+            "file_type": file_type,
+            "temp_file": self._temp_file,
+            "project": self.item.context.project['name'],
+            "user": self.item.context.user['name'],
+        }
 
+    def _get_default_command(self): 
 
-        filter_dict = [['code', 'is', 'Maya ' + version], ['projects', 'in', project]]
-        packages = sg.find("Software", filter_dict, ['sg_rez'])
-        if packages:
-            packages = packages[0]['sg_rez']
-            pkg_list = packages.split(',')
-        else:
-            filter_dict = [['code', 'is', "Maya " + version], ['projects', 'is', None]]
-            packages = sg.find("Software", filter_dict, ['sg_rez'])
-            packages = packages[0]['sg_rez']
-            pkg_list = packages.split(',')
-
-        #maya_ver = [pkg[:-4] for pkg in pkg_list if 'maya-' in pkg][0]
-        #packages = [pkg for pkg in pkg_list if 'maya-' not in pkg]
-        command = ['rez-env'] + pkg_list
-        return command
+        return _get_default_command()
 
     def to_tractor(self,start_frame,end_frame,file_type):
-        
-        version = cmds.about(version=1)
-        if version == "2022":
-            sys.path.append("/westworld/inhouse/tool/rez-packages/tractor/2.2.0/platform-linux/arch-x86_64/lib/python3.6/site-packages")
-        else:
-            sys.path.append("/westworld/inhouse/tool/rez-packages/tractor/2.2.0/platform-linux/arch-x86_64/lib/python2.7/site-packages")
-
-        import tractor.api.author as author
-
-        job = author.Job()
-        job.service = "convert"
-        job.priority = 50
-        
-        file_title = cmds.file(query=True, sn=True).split(".")[0].split("/")[-1]
-        project_name =self.item.context.project['name']
-        user_name = self.item.context.user['name']
-        user_id = os.environ['USER']
-
-        temp = "] ["
-        title = []
-        title.append(user_name)
-        title.append(project_name)
-        title.append(file_title)
-        title.append(self.item.properties['name'])
-        title.append("%d - %d"%(start_frame,end_frame))
-        title.append(file_type)
-        title = temp.join(title)
-        title = "["+title+"]"
-        job.title = str(title)
-
-        master_command = self._get_default_command()
-        command = master_command[:] + ['--', 'mayapy']
-
-        command.append(self._temp_file)
-        command = author.Command(argv=command)
-
-        task = author.Task(title = str(self.item.properties['name']))
-        task.addCommand(command)
-
-        rm_command = ['/bin/rm','-f']
-        rm_command.append(self._temp_file)
-        rm_command = author.Command(argv=rm_command)
-        rm_task = author.Task(title = "rm tmp")
-        rm_task.addCommand(rm_command)
-        
-        rm_task.addChild(task)
-
-
-        job.addChild(rm_task)
-
-        job.spool(hostname="10.0.20.83",owner=user_id)
+        """
+        Spools the export set by the last create_*_script call as a Tractor
+        job of its own.
+        """
+        spool_session_job([self._get_export(start_frame,end_frame,file_type)])
+
+
+def _get_camera_export_script(mel_command):
+    # runs mel_command with overscan, pan and zoom reset on camera_shapes, restoring
+    # them afterwards so later exports of the same session see the scene unchanged
+    script = ''
+    script += 'camera_settings = []\n'
+    script += 'for shape in camera_shapes:\n'
+    script += '    camera_settings.append((shape,\n'
+    script += '                            cmds.getAttr(shape + ".overscan"),\n'
+    script += '                            cmds.getAttr(shape + ".panZoomEnabled"),\n'
+    script += '                            cmds.getAttr(shape + ".pan")[0],\n'
+    script += '                            cmds.getAttr(shape + ".zoom"),\n'
+    script += '                            cmds.getAttr(shape + ".renderPanZoom")))\n'
+    script += '    cmds.setAttr(shape + ".overscan", 1.0)\n'
+    script += '    if cmds.getAttr(shape + ".panZoomEnabled") == True:\n'
+    script += '        cmds.setAttr(shape + ".pan", 0.0, 0.0, typ="float2")\n'
+    script += '        cmds.setAttr(shape + ".zoom", 1.0)\n'
+    script += '        if cmds.getAttr(shape + ".renderPanZoom") == True:\n'
+    script += '            cmds.setAttr(shape + ".renderPanZoom", False)\n'
+    script += '            cmds.setAttr(shape + ".panZoomEnabled", False)\n'
+    script += 'try:\n'
+    script += '    mel.eval(\'{}\')\n'.format(mel_command)
+    script += 'finally:\n'
+    script += '    for shape, overscan, pan_zoom_enabled, pan, zoom, render_pan_zoom in camera_settings:\n'
+    script += '        cmds.setAttr(shape + ".overscan", overscan)\n'
+    script += '        cmds.setAttr(shape + ".pan", pan[0], pan[1], typ="float2")\n'
+    script += '        cmds.setAttr(shape + ".zoom", zoom)\n'
+    script += '        cmds.setAttr(shape + ".renderPanZoom", render_pan_zoom)\n'
+    script += '        cmds.setAttr(shape + ".panZoomEnabled", pan_zoom_enabled)\n'
+    return script
+
+
+def _get_export_plugins(version):
+    # maya plugins loaded by the scripts exporting geometry
+    if version == "2022":
+        return ["mayaUsdPlugin.so", "AbcExport.so"]
+    return ["pxrUsd.so", "cvJiggle.so", "cvwrap.so", "iDeform.so", "weightDriver.so", "AbcExport.so"]
+
+
+def _create_session_script(scene, exports):
+    """
+    Returns a mayapy script opening scene once and running every export of
+    exports in turn. A failing export doesn't stop the others, the script exits
+    with an error once they've all run.
+    """
+    script = ''
+    script += 'import maya.standalone\n'
+    script += 'maya.standalone.initialize()\n'
+    script += 'import maya.cmds as cmds\n'
+    script += 'import maya.mel as mel\n'
+    script += 'import os\n'
+    script += 'import sys\n'
+    script += 'import traceback\n'
+
+    script += '\n'
+    script += '\n'
+
+    script += 'cmds.file("{}",open=1,force=1,iv=1)\n'.format(scene)
+
+    plugins = []
+    for export in exports:
+        plugins.extend([x for x in export["plugins"] if x not in plugins])
+    for plugin in plugins:
+        script += 'cmds.loadPlugin("{}")\n'.format(plugin)
+
+    for index, export in enumerate(exports):
+        script += '\n'
+        script += '\n'
+        script += 'def export_{}():\n'.format(index)
+        for line in export["script"].splitlines():
+            script += '    {}\n'.format(line)
+
+    script += '\n'
+    script += '\n'
+    script += 'failed = []\n'
+    for index, export in enumerate(exports):
+        script += 'try:\n'
+        script += '    export_{}()\n'.format(index)
+        script += 'except Exception:\n'
+        script += '    traceback.print_exc()\n'
+        script += '    failed.append("{}")\n'.format(export["name"])
+    script += 'if failed:\n'
+    script += '    sys.exit("Failed exports: " + ", ".join(failed))\n'
+    return script
+
+
+def spool_session_job(exports=None):
+    """
+    Spools the exports added to the current publish session, or exports if
+    given, as Tractor jobs of their own scene: one mayapy task opens the scene
+    once and runs all the exports. Returns the number of exports spooled.
+    """
+    session = exports is None
+    if session:
+        exports = _session_exports[:]
+    if not exports:
+        return 0
+
+    # exports of the same scene share a job
+    scenes = []
+    for export in exports:
+        if export["scene"] not in scenes:
+            scenes.append(export["scene"])
+    for scene in scenes:
+        scene_exports = [x for x in exports if x["scene"] == scene]
+        _spool_scene_job(scene, scene_exports)
+        if session:
+            # forget the exports once spooled, so a failing spool keeps the
+            # exports of the scenes left for another attempt
+            _session_exports[:] = [x for x in _session_exports if x not in scene_exports]
+    return len(exports)
+
+
+def clear_session_job():
+    """
+    Forgets the exports added to the current publish session.
+    """
+    del _session_exports[:]
+
+
+def _spool_scene_job(scene, exports):
+
+    script = _create_session_script(scene, exports)
+    temp_file = exports[0]["temp_file"]
+    if len(exports) > 1:
+        temp_file = os.path.splitext(temp_file)[0] + "_session.py"
+    with open( temp_file, 'w' ) as f:
+        f.write(script)
+
+    author = _import_tractor_author()
+
+    job = author.Job()
+    job.service = "convert"
+    job.priority = 50
+    
+    file_title = scene.split(".")[0].split("/")[-1]
+    user_id = os.environ['USER']
+
+    start_frame = min(x["start_frame"] for x in exports)
+    end_frame = max(x["end_frame"] for x in exports)
+    file_types = []
+    for export in exports:
+        if export["file_type"] not in file_types:
+            file_types.append(export["file_type"])
+
+    temp = "] ["
+    title = []
+    title.append(exports[0]["user"])
+    title.append(exports[0]["project"])
+    title.append(file_title)
+    if len(exports) > 1:
+        title.append("%d items"%len(exports))
+    else:
+        title.append(exports[0]["name"])
+    title.append("%d - %d"%(start_frame,end_frame))
+    title.append(", ".join(file_types))
+    title = temp.join(title)
+    title = "["+title+"]"
+    job.title = str(title)
+
+    master_command = _get_default_command()
+    command = master_command[:] + ['--', 'mayapy']
+
+    command.append(temp_file)
+    command = author.Command(argv=command)
+
+    task = author.Task(title = str(", ".join(x["name"] for x in exports)))
+    task.addCommand(command)
+
+    rm_command = ['/bin/rm','-f']
+    rm_command.append(temp_file)
+    rm_command = author.Command(argv=rm_command)
+    rm_task = author.Task(title = "rm tmp")
+    rm_task.addCommand(rm_command)
+    
+    rm_task.addChild(task)
+
+
+    job.addChild(rm_task)
+
+    job.spool(hostname="10.0.20.83",owner=user_id)
+
+
+def _import_tractor_author():
+
+    version = cmds.about(version=1)
+    if version == "2022":
+        sys.path.append("/westworld/inhouse/tool/rez-packages/tractor/2.2.0/platform-linux/arch-x86_64/lib/python3.6/site-packages")
+    else:
+        sys.path.append("/westworld/inhouse/tool/rez-packages/tractor/2.2.0/platform-linux/arch-x86_64/lib/python2.7/site-packages")
+
+    import tractor.api.author as author
+    return author
+
+
+def _get_default_command():
+    
+    version = cmds.about(version=1)
+    engine = sgtk.platform.current_engine()
+    context = engine.context
+    project = context.project
+    sg = engine.shotgun
+    if version == "2022":
+        version="2022.1"
+
+
+    filter_dict = [['code', 'is', 'Maya ' + version], ['projects', 'in', project]]
+    packages = sg.find("Software", filter_dict, ['sg_rez'])
+    if packages:
+        packages = packages[0]['sg_rez']
+        pkg_list = packages.split(',')
+    else:
+        filter_dict = [['code', 'is', "Maya " + version], ['projects', 'is', None]]
+        packages = sg.find("Software", filter_dict, ['sg_rez'])
+        packages = packages[0]['sg_rez']
+        pkg_list = packages.split(',')
 
+    #maya_ver = [pkg[:-4] for pkg in pkg_list if 'maya-' in pkg][0]
+    #packages = [pkg for pkg in pkg_list if 'maya-' not in pkg]
+    command = ['rez-env'] + pkg_list
+    return command